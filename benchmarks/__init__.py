@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+r"""Offline benchmarks for TweetAI.
+
+Run ``python -m benchmarks`` for the pipeline scenarios.
+
+Modules
+-------
+fakes
+    Offline stand-ins for Twitter and GPT-2
+minhash
+    Near duplicate index build time and query latency by corpus size
+pipeline
+    Download, filter, generation and posting scenarios against the fakes
+"""
@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+r"""Run the pipeline benchmarks, see benchmarks.pipeline."""
+from .pipeline import main
+
+main()
@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+r"""Offline stand-ins for Twitter and GPT-2 used by the benchmarks.
+
+Classes
+-------
+FakeClient
+    Local fake of the tweepy client methods used by TweetAI
+StubGPT2
+    Stub of the gpt_2_simple functions used by TweetAI
+
+Functions
+---------
+syntheticTweets
+    Make a list of synthetic tweets
+install
+    Use a stub in place of gpt_2_simple and tensorflow
+"""
+import json
+import os
+import re
+import sys
+import types
+import zlib
+from contextlib import contextmanager
+from time import sleep
+
+import requests
+import tweepy
+
+BLOCKED = ['blockedterm', 'forbidden phrase']
+
+
+def syntheticTweets(size, rng, vocab=20000, words=(8, 30)):
+    r"""Make a list of synthetic tweets.
+
+    Parameters
+    ----------
+    size
+        Number of tweets to make
+    rng
+        Random number generator
+    vocab: optional
+        Number of distinct words, default is 20000
+    words: optional
+        Range of words in each tweet, default is 8 to 30
+
+    Returns
+    -------
+    list
+        Tweets made
+    """
+    return [
+        ' '.join(f'w{rng.randrange(vocab)}' for _ in range(rng.randint(*words)))
+        for _ in range(size)
+    ]
+
+
+def _response(status, reason, body):
+    r"""Build an HTTP response to raise a tweepy exception with.
+
+    Parameters
+    ----------
+    status
+        HTTP status code
+    reason
+        HTTP reason phrase
+    body
+        Dictionary sent as the JSON body
+
+    Returns
+    -------
+    requests.Response
+        Response with the status and body
+    """
+    response = requests.Response()
+    response.status_code = status
+    response.reason = reason
+    response._content = json.dumps(body).encode('utf8')
+    return response
+
+
+class FakeClient:
+    r"""Local fake of the tweepy client methods used by TweetAI.
+
+    The timeline holds synthetic tweets with ascending ids, some starting with
+    mentions or holding links so text cleaning has work to do. Responses are
+    returned as tweepy responses whatever the return type is set to.
+
+    Parameters
+    ----------
+    tweets
+        List of tweet texts making up the timeline, oldest first
+    latency: optional
+        Seconds each request takes, default is 0
+    failure_rate: optional
+        Fraction of posts that fail with a server error, default is 0
+    rng: optional
+        Random number generator deciding failures, default is None for no failures
+
+    Attributes
+    ----------
+    timeline
+        List of (id, text) tuples, oldest first
+    posted
+        List of texts posted
+    requests
+        Number of requests made, shared with copies of the client
+
+    Methods
+    -------
+    add
+        Add tweets to the end of the timeline
+    get_user
+        Get the fake user
+    get_users_tweets
+        Get a page of the timeline
+    create_tweet
+        Post a tweet
+    """
+    def __init__(self, tweets, latency=0, failure_rate=0, rng=None):
+        self.timeline = []
+        self.posted = []
+        self._counts = {'requests': 0}
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.rng = rng
+        self.return_type = tweepy.Response
+        self.add(tweets)
+
+    @property
+    def requests(self):
+        return self._counts['requests']
+
+    def add(self, tweets):
+        r"""Add tweets to the end of the timeline.
+
+        Parameters
+        ----------
+        tweets
+            List of tweet texts, oldest first
+        """
+        start = len(self.timeline) + 1
+        for i, text in enumerate(tweets):
+            tweet_id = start + i
+            if tweet_id % 7 == 0:
+                text = f'@someone {text}'
+            elif tweet_id % 11 == 0:
+                text = f'{text} https://t.co/x{tweet_id}'
+            self.timeline.append((tweet_id, text))
+
+    def get_user(self, *, username):
+        self._request()
+        return tweepy.Response({'id': '1', 'username': username}, {}, [], {})
+
+    def get_users_tweets(self, id, *, max_results=10, exclude=None, start_time=None,
+                         since_id=None, pagination_token=None):
+        self._request()
+        since_id = int(since_id or 0)
+        newest = [tweet for tweet in reversed(self.timeline) if tweet[0] > since_id]
+        offset = int(pagination_token or 0)
+        page = newest[offset:offset + max_results]
+        meta = {'result_count': len(page)}
+        if page:
+            meta['newest_id'] = str(page[0][0])
+            meta['oldest_id'] = str(page[-1][0])
+        if offset + max_results < len(newest):
+            meta['next_token'] = str(offset + max_results)
+        data = [{'id': str(tweet_id), 'text': text} for tweet_id, text in page]
+        return tweepy.Response(data or None, {}, [], meta)
+
+    def create_tweet(self, *, text):
+        self._request()
+        if self.rng is not None and self.rng.random() < self.failure_rate:
+            raise tweepy.TwitterServerError(_response(503, 'Service Unavailable', {}))
+        if text in self.posted:
+            raise tweepy.Forbidden(_response(403, 'Forbidden', {
+                'detail': 'You are not allowed to create a Tweet with duplicate content.'
+            }))
+        self.posted.append(text)
+        return tweepy.Response({'id': str(len(self.posted)), 'text': text}, {}, [], {})
+
+    def _request(self):
+        r"""Count a request and wait out its latency."""
+        self._counts['requests'] += 1
+        if self.latency:
+            sleep(self.latency)
+
+
+class _Graph:
+    r"""Stand-in for a tensorflow graph."""
+    @contextmanager
+    def as_default(self):
+        yield self
+
+
+class _Session:
+    r"""Stand-in for a tensorflow session."""
+    def __init__(self):
+        self.graph = _Graph()
+
+    def close(self):
+        pass
+
+
+class _Encoder:
+    r"""Stand-in for the GPT-2 byte pair encoder, one token per word or symbol.
+
+    Token ids come from a checksum rather than the salted builtin hash, so they are
+    the same in every run.
+    """
+    def encode(self, text):
+        return [zlib.crc32(piece.encode('utf8')) % 50257 for piece in re.findall(r'\w+|[^\w\s]', text)]
+
+    def decode(self, tokens):
+        return ' '.join(str(token) for token in tokens)
+
+
+class StubGPT2:
+    r"""Stub of the gpt_2_simple functions used by TweetAI.
+
+    Generated samples come from the outputs function and take time in proportion
+    to the number of batches and tokens requested, like inference does. Samples are
+    cut to the requested length, counting one token per word or symbol, and then at
+    the truncate marker.
+
+    Parameters
+    ----------
+    outputs
+        Function taking a random number generator and returning one sample's text
+    rng
+        Random number generator passed to outputs
+    load_latency: optional
+        Seconds loading a checkpoint takes, default is 0
+    batch_latency: optional
+        Seconds of fixed cost for each batch, default is 0
+    token_latency: optional
+        Seconds each token of a batch takes, default is 0
+    train_latency: optional
+        Seconds fine-tuning takes, default is 0
+
+    Attributes
+    ----------
+    samples
+        Number of samples generated
+    tokens
+        Number of tokens requested across all samples
+    cut_short
+        Number of samples cut at the requested length before their truncate marker
+
+    Methods
+    -------
+    module
+        Get the stub as a gpt_2_simple module
+    """
+    def __init__(self, outputs, rng, load_latency=0, batch_latency=0, token_latency=0, train_latency=0):
+        self.outputs = outputs
+        self.rng = rng
+        self.load_latency = load_latency
+        self.batch_latency = batch_latency
+        self.token_latency = token_latency
+        self.train_latency = train_latency
+        self.samples = 0
+        self.tokens = 0
+        self.cut_short = 0
+
+    def module(self):
+        r"""Get the stub as a gpt_2_simple module.
+
+        Returns
+        -------
+        module
+            Module with the stubbed functions
+        """
+        module = types.ModuleType('gpt_2_simple')
+        for name in ('start_tf_sess', 'download_gpt2', 'load_gpt2', 'finetune', 'generate'):
+            setattr(module, name, getattr(self, name))
+        return module
+
+    def start_tf_sess(self, *args, **kwargs):
+        return _Session()
+
+    def download_gpt2(self, model_name='124M', **kwargs):
+        os.makedirs(os.path.join('models', model_name), exist_ok=True)
+
+    def load_gpt2(self, sess, run_name='run1', **kwargs):
+        sleep(self.load_latency)
+
+    def finetune(self, sess, dataset, run_name='run1', checkpoint_dir='checkpoint', **kwargs):
+        sleep(self.train_latency)
+        os.makedirs(os.path.join(checkpoint_dir, run_name), exist_ok=True)
+
+    def generate(self, sess, length=1023, nsamples=1, batch_size=1, prefix=None,
+                 truncate=None, return_as_list=False, **kwargs):
+        batches = -(-nsamples // batch_size)
+        sleep(batches * (self.batch_latency + self.token_latency * length))
+        self.samples += nsamples
+        self.tokens += nsamples * length
+        samples = []
+        for _ in range(nsamples):
+            text = self.outputs(self.rng)
+            pieces = list(re.finditer(r'\w+|[^\w\s]', text))
+            if len(pieces) > length:
+                text = text[:pieces[length].start()]
+            if truncate and truncate in text:
+                text = text[:text.index(truncate)]
+            elif truncate:
+                self.cut_short += 1
+            samples.append((prefix or '') + text)
+        return samples
+
+
+def install(stub):
+    r"""Use a stub in place of gpt_2_simple and tensorflow.
+
+    TweetAI imports them on first use, so this must be called before any model is
+    trained, loaded or generated with.
+
+    Parameters
+    ----------
+    stub
+        StubGPT2 to generate with
+    """
+    tf = types.ModuleType('tensorflow')
+    tf.Graph = _Graph
+    module = stub.module()
+    module.__path__ = []
+    module.src = types.ModuleType('gpt_2_simple.src')
+    module.src.__path__ = []
+    module.src.encoder = types.ModuleType('gpt_2_simple.src.encoder')
+    module.src.encoder.get_encoder = lambda model_path: _Encoder()
+    sys.modules['gpt_2_simple'] = module
+    sys.modules['gpt_2_simple.src'] = module.src
+    sys.modules['gpt_2_simple.src.encoder'] = module.src.encoder
+    sys.modules['tensorflow'] = tf
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+r"""Benchmark of the near duplicate index.
+
+Builds a MinHash index over synthetic corpora of increasing size and measures the
+latency of checking a candidate, half of which are lightly edited copies of corpus
+lines. Results are printed as JSON.
+
+Usage: python -m benchmarks.minhash [--sizes 1000 10000 100000] [--queries 500]
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import statistics
+import tempfile
+from time import perf_counter
+
+from tweetai.minhash import MinHashIndex
+
+from .fakes import syntheticTweets
+
+
+def syntheticCorpus(path, size, rng, vocab=20000, words=(8, 30)):
+    r"""Write a synthetic training data file.
+
+    Parameters
+    ----------
+    path
+        Path of the csv file to write
+    size
+        Number of tweets to write
+    rng
+        Random number generator
+    vocab: optional
+        Number of distinct words, default is 20000
+    words: optional
+        Range of words in each tweet, default is 8 to 30
+
+    Returns
+    -------
+    list
+        Tweets written
+    """
+    tweets = syntheticTweets(size, rng, vocab, words)
+    with open(path, 'w', encoding='utf8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Tweets'])
+        writer.writerows([tweet] for tweet in tweets)
+    return tweets
+
+
+def edit(tweet, rng):
+    r"""Lightly edit a tweet by swapping one word and adding punctuation.
+
+    Parameters
+    ----------
+    tweet
+        Tweet to edit
+    rng
+        Random number generator
+
+    Returns
+    -------
+    str
+        Edited tweet
+    """
+    words = tweet.split()
+    words[rng.randrange(len(words))] = 'swapped'
+    return ' '.join(words).capitalize() + rng.choice(['!', '.', '?!'])
+
+
+def run(sizes, queries, seed=0):
+    r"""Run the benchmark for each corpus size.
+
+    Parameters
+    ----------
+    sizes
+        List of corpus sizes
+    queries
+        Number of candidates checked at each size
+    seed: optional
+        Random seed, default is 0
+
+    Returns
+    -------
+    list
+        Dictionary of results for each size
+    """
+    rng = random.Random(seed)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            path = os.path.join(tmp, f'bench{size}.csv')
+            tweets = syntheticCorpus(path, size, rng)
+            index = MinHashIndex(path)
+            start = perf_counter()
+            index.sync()
+            build = perf_counter() - start
+
+            candidates = [
+                edit(rng.choice(tweets), rng) if i % 2 == 0 else
+                ' '.join(f'w{rng.randrange(20000)}' for _ in range(15))
+                for i in range(queries)
+            ]
+            latencies = []
+            hits = 0
+            for candidate in candidates:
+                start = perf_counter()
+                hits += index.isNearDuplicate(candidate)
+                latencies.append(perf_counter() - start)
+            latencies.sort()
+            results.append({
+                'corpus_size': size,
+                'build_seconds': round(build, 3),
+                'queries': queries,
+                'near_duplicates_found': hits,
+                'latency_mean_ms': round(statistics.mean(latencies) * 1000, 4),
+                'latency_p50_ms': round(latencies[len(latencies) // 2] * 1000, 4),
+                'latency_p99_ms': round(latencies[int(len(latencies) * 0.99)] * 1000, 4),
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--queries', type=int, default=500)
+    args = parser.parse_args()
+    print(json.dumps(run(args.sizes, args.queries), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,470 @@
+# -*- coding: utf-8 -*-
+r"""Benchmark of the tweet pipeline against offline fakes.
+
+Runs each stage of the pipeline in a temporary directory with a fake Twitter
+client and a stub generator, so no credentials, network or model checkpoint are
+needed. Results are printed as JSON.
+
+Scenarios
+---------
+download
+    Full and incremental download of a synthetic timeline
+dataset
+    Full, unchanged and incremental tokenizing of the training data
+filters
+    Throughput of the checks every generated tweet goes through
+generation
+    Tweet set generation, from the stub model through the checks to the buffer
+budget
+    Tokens generated per accepted tweet with a fixed and a fitted token budget
+posting
+    Delivery of queued tweets through the outbox with injected failures
+
+Usage: python -m benchmarks [--scenarios download dataset filters generation budget posting] [--corpus 5000]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import tempfile
+from contextlib import contextmanager
+from time import perf_counter
+
+from .fakes import BLOCKED, FakeClient, StubGPT2, install, syntheticTweets
+
+SCENARIOS = ['download', 'dataset', 'filters', 'generation', 'budget', 'posting']
+USER = 'bench'
+
+
+def candidate(tweets, rng):
+    r"""Make a candidate tweet like the model would generate.
+
+    Parameters
+    ----------
+    tweets
+        Tweets of the training data
+    rng
+        Random number generator
+
+    Returns
+    -------
+    str
+        Copy or edit of a training tweet, a tweet with a link or blocked term, or a
+        new tweet
+    """
+    kind = rng.random()
+    if kind < 0.1:
+        return rng.choice(tweets)
+    if kind < 0.2:
+        words = rng.choice(tweets).split()
+        words[rng.randrange(len(words))] = 'swapped'
+        return ' '.join(words)
+    fresh = ' '.join(f'n{rng.randrange(50000)}' for _ in range(rng.randint(8, 30)))
+    if kind < 0.3:
+        return f'{fresh} see example.com/page'
+    if kind < 0.35:
+        return f'{fresh} {rng.choice(BLOCKED)}'
+    return fresh
+
+
+def summarize(latencies):
+    r"""Summarize a list of latencies.
+
+    Parameters
+    ----------
+    latencies
+        List of seconds
+
+    Returns
+    -------
+    dict
+        Mean, median and 99th percentile in milliseconds
+    """
+    latencies = sorted(latencies)
+    return {
+        'latency_mean_ms': round(statistics.mean(latencies) * 1000, 4),
+        'latency_p50_ms': round(latencies[len(latencies) // 2] * 1000, 4),
+        'latency_p99_ms': round(latencies[int(len(latencies) * 0.99)] * 1000, 4),
+    }
+
+
+@contextmanager
+def workspace():
+    r"""Run in a temporary directory removed afterwards.
+
+    Yields
+    ------
+    str
+        Path to the directory
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            yield tmp
+        finally:
+            os.chdir(cwd)
+
+
+def bareBrain(client):
+    r"""Make a brain with only what downloading needs.
+
+    Parameters
+    ----------
+    client
+        Fake client to download from
+
+    Returns
+    -------
+    Brain
+        Brain without a model or checks
+    """
+    from tweetai.brain import Brain
+    from tweetai.fetcher import TimelineFetcher
+
+    brain = Brain.__new__(Brain)
+    brain.client = client
+    brain.username = USER
+    brain.userid = client.get_user(username=USER).data['id']
+    brain.fetcher = TimelineFetcher(client, min_interval=0)
+    return brain
+
+
+def fullBrain(client, stub, args, **options):
+    r"""Make a brain on downloaded synthetic data.
+
+    Parameters
+    ----------
+    client
+        Fake client to download from
+    stub
+        Stub generator to use
+    args
+        Parsed benchmark arguments
+    options: optional
+        Extra options passed on to Brain
+
+    Returns
+    -------
+    Brain
+        Brain with its model trained and first tweet set generated
+    """
+    install(stub)
+    from tweetai.brain import Brain
+    from tweetai.history import TweetHistory
+
+    bareBrain(client)._getNewTwitterData()
+    with open('blocked.txt', 'w', encoding='utf8') as f:
+        f.write('\n'.join(BLOCKED))
+    brain = Brain(
+        client, USER, 'blocked.txt', TweetHistory(f'{USER}.db'),
+        offline_links=True, max_samples=args.max_samples, max_batch_size=args.max_batch_size, **options
+    )
+    brain.warmUp()
+    return brain
+
+
+def download(args, rng):
+    r"""Benchmark a full and an incremental timeline download.
+
+    Parameters
+    ----------
+    args
+        Parsed benchmark arguments
+    rng
+        Random number generator
+
+    Returns
+    -------
+    dict
+        Download times and tweet rates
+    """
+    client = FakeClient(syntheticTweets(args.corpus, rng), latency=args.request_latency)
+    results = {'corpus_size': args.corpus}
+    with workspace():
+        brain = bareBrain(client)
+        for name, added in (('full', args.corpus), ('incremental', max(args.corpus // 100, 1))):
+            if name == 'incremental':
+                client.add(syntheticTweets(added, rng))
+            requests = client.requests
+            start = perf_counter()
+            brain._getNewTwitterData()
+            elapsed = perf_counter() - start
+            results[name] = {
+                'tweets': added,
+                'requests': client.requests - requests,
+                'seconds': round(elapsed, 4),
+                'tweets_per_second': round(added / elapsed, 1),
+            }
+    return results
+
+
+def dataset(args, rng):
+    r"""Benchmark tokenizing the training data.
+
+    Parameters
+    ----------
+    args
+        Parsed benchmark arguments
+    rng
+        Random number generator
+
+    Returns
+    -------
+    dict
+        Sync times for a new cache, an unchanged corpus and appended tweets
+    """
+    from tweetai.dataset import DatasetCache
+
+    install(StubGPT2(lambda r: '', rng))
+    client = FakeClient(syntheticTweets(args.corpus, rng))
+    results = {'corpus_size': args.corpus}
+    with workspace():
+        brain = bareBrain(client)
+        brain._getNewTwitterData()
+        for name in ('full', 'unchanged', 'incremental'):
+            if name == 'incremental':
+                client.add(syntheticTweets(max(args.corpus // 100, 1), rng))
+                brain._getNewTwitterData()
+            cache = DatasetCache(f'{USER}.csv')
+            start = perf_counter()
+            cache.sync()
+            results[name] = {'seconds': round(perf_counter() - start, 4), 'tokens': len(cache)}
+    return results
+
+
+def filters(args, rng):
+    r"""Benchmark the checks on generated tweets.
+
+    Parameters
+    ----------
+    args
+        Parsed benchmark arguments
+    rng
+        Random number generator
+
+    Returns
+    -------
+    dict
+        Check latency, throughput and acceptance
+    """
+    tweets = syntheticTweets(args.corpus, rng)
+    stub = StubGPT2(lambda r: candidate(tweets, r), rng)
+    with workspace():
+        brain = fullBrain(FakeClient(tweets), stub, args)
+        candidates = [candidate(tweets, rng) for _ in range(args.candidates)]
+        latencies = []
+        accepted = 0
+        start = perf_counter()
+        for tweet in candidates:
+            begin = perf_counter()
+            accepted += brain._checkTweet(tweet)
+            latencies.append(perf_counter() - begin)
+        elapsed = perf_counter() - start
+        start = perf_counter()
+        brain.filters.evaluate(candidates)
+        batch_elapsed = perf_counter() - start
+        per_filter = brain.filters.report()
+        brain.blocked.stop()
+    return {
+        'corpus_size': args.corpus,
+        'candidates': args.candidates,
+        'accepted': accepted,
+        'candidates_per_second': round(args.candidates / elapsed, 1),
+        'batch_candidates_per_second': round(args.candidates / batch_elapsed, 1),
+        'filters': {
+            name: {**stats, 'seconds': round(stats['seconds'], 4)} for name, stats in per_filter.items()
+        },
+        **summarize(latencies),
+    }
+
+
+def generation(args, rng):
+    r"""Benchmark generating tweet sets.
+
+    Parameters
+    ----------
+    args
+        Parsed benchmark arguments
+    rng
+        Random number generator
+
+    Returns
+    -------
+    dict
+        Round times, samples, tokens and acceptance
+    """
+    tweets = syntheticTweets(args.corpus, rng)
+    stub = StubGPT2(
+        lambda r: candidate(tweets, r), rng, load_latency=args.load_latency,
+        batch_latency=args.batch_latency, token_latency=args.token_latency
+    )
+    with workspace():
+        brain = fullBrain(FakeClient(tweets), stub, args)
+        samples, tokens = stub.samples, stub.tokens
+        latencies = []
+        accepted = 0
+        for _ in range(args.rounds):
+            start = perf_counter()
+            accepted += len(brain._generateTweetSet())
+            latencies.append(perf_counter() - start)
+        brain.blocked.stop()
+    samples = stub.samples - samples
+    tokens = stub.tokens - tokens
+    return {
+        'rounds': args.rounds,
+        'samples': samples,
+        'accepted': accepted,
+        'acceptance_rate': round(accepted / samples, 4) if samples else 0,
+        'tokens': tokens,
+        'tokens_per_accepted': round(tokens / accepted, 1) if accepted else None,
+        'seconds_per_accepted': round(sum(latencies) / accepted, 4) if accepted else None,
+        **summarize(latencies),
+    }
+
+
+def budget(args, rng):
+    r"""Benchmark the tokens generated per accepted tweet by token budget.
+
+    The stub keeps writing tweets past the end marker like the model does, so every
+    sample costs its full budget. Samples cut short ran out of tokens before their
+    end marker.
+
+    Parameters
+    ----------
+    args
+        Parsed benchmark arguments
+    rng
+        Random number generator
+
+    Returns
+    -------
+    dict
+        Tokens, acceptance and samples cut short with the fixed and fitted budgets
+    """
+    tweets = syntheticTweets(args.corpus, rng)
+
+    def outputs(r):
+        return '<|endoftext|>\n<|startoftext|>'.join(candidate(tweets, r) for _ in range(8))
+
+    results = {}
+    for length in (200, 'auto'):
+        stub = StubGPT2(outputs, random.Random(args.seed), batch_latency=args.batch_latency,
+                        token_latency=args.token_latency)
+        with workspace():
+            brain = fullBrain(FakeClient(tweets), stub, args, length=length)
+            samples, tokens, cut_short = stub.samples, stub.tokens, stub.cut_short
+            accepted = 0
+            start = perf_counter()
+            for _ in range(args.rounds):
+                accepted += len(brain._generateTweetSet())
+            elapsed = perf_counter() - start
+            brain.blocked.stop()
+        samples = stub.samples - samples
+        tokens = stub.tokens - tokens
+        results[f'length_{length}'] = {
+            'tokens_per_sample': brain._sampleLength(),
+            'samples': samples,
+            'accepted': accepted,
+            'cut_short': stub.cut_short - cut_short,
+            'tokens': tokens,
+            'tokens_per_accepted': round(tokens / accepted, 1) if accepted else None,
+            'seconds_per_accepted': round(elapsed / accepted, 4) if accepted else None,
+        }
+    fixed, fitted = results['length_200'], results['length_auto']
+    if fixed['tokens_per_accepted'] and fitted['tokens_per_accepted']:
+        results['token_savings'] = round(1 - fitted['tokens_per_accepted'] / fixed['tokens_per_accepted'], 4)
+    return results
+
+
+def posting(args, rng):
+    r"""Benchmark delivering queued tweets.
+
+    Parameters
+    ----------
+    args
+        Parsed benchmark arguments
+    rng
+        Random number generator
+
+    Returns
+    -------
+    dict
+        Delivery time, throughput and failures
+    """
+    from tweetai.mouth import Mouth
+    from tweetai.outbox import Outbox
+
+    client = FakeClient([], latency=args.request_latency, failure_rate=args.failure_rate, rng=rng)
+    tweets = [f'n{i} ' + ' '.join(f'n{rng.randrange(50000)}' for _ in range(10)) for i in range(args.posts)]
+
+    async def deliver(mouth):
+        task = asyncio.ensure_future(mouth.deliver())
+        await asyncio.sleep(0)
+        start = perf_counter()
+        for tweet in tweets:
+            mouth.sendTweet(tweet)
+        while len(mouth.outbox):
+            await asyncio.sleep(0.001)
+        elapsed = perf_counter() - start
+        task.cancel()
+        await task
+        return elapsed
+
+    with workspace():
+        mouth = Mouth(client, True, outbox=Outbox(f'{USER}.outbox.db'), post_limit=None, backoff=0.001)
+        elapsed = asyncio.run(deliver(mouth))
+        counts = mouth.outbox.counts()
+        mouth.outbox.close()
+    return {
+        'posts': args.posts,
+        'posted': counts.get('sent', 0),
+        'failed': counts.get('failed', 0),
+        'requests': client.requests,
+        'seconds': round(elapsed, 4),
+        'posts_per_second': round(args.posts / elapsed, 1),
+    }
+
+
+def run(args):
+    r"""Run the selected scenarios.
+
+    Parameters
+    ----------
+    args
+        Parsed benchmark arguments
+
+    Returns
+    -------
+    dict
+        Results of each scenario
+    """
+    results = {}
+    for scenario in args.scenarios:
+        results[scenario] = globals()[scenario](args, random.Random(args.seed))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--corpus', type=int, default=5000, help='tweets in the synthetic timeline')
+    parser.add_argument('--candidates', type=int, default=1000, help='tweets checked in the filters scenario')
+    parser.add_argument('--rounds', type=int, default=10, help='tweet sets in the generation and budget scenarios')
+    parser.add_argument('--posts', type=int, default=200, help='tweets in the posting scenario')
+    parser.add_argument('--max-samples', type=int, default=40)
+    parser.add_argument('--max-batch-size', type=int, default=10)
+    parser.add_argument('--request-latency', type=float, default=0, help='seconds per Twitter request')
+    parser.add_argument('--load-latency', type=float, default=0, help='seconds to load the model')
+    parser.add_argument('--batch-latency', type=float, default=0.01, help='fixed seconds per batch')
+    parser.add_argument('--token-latency', type=float, default=0.0001, help='seconds per token of a batch')
+    parser.add_argument('--failure-rate', type=float, default=0.05, help='fraction of posts that fail')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    print(json.dumps(run(args), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -14,7 +14,7 @@ REQUIRES_PYTHON = '>=3.10.0'
 # Only include direct dependencies, transitive dependencies should be
 # handled automatically.
 REQUIRED = [
-    'tweepy', 'gpt-2-simple', 'tensorflow-gpu'
+    'tweepy', 'gpt-2-simple', 'tensorflow-gpu', 'numpy'
 ]
 
 # What packages are optional?
@@ -55,7 +55,7 @@ setup(
     author_email=about['__author_email__'],
     python_requires=REQUIRES_PYTHON,
     url=about['__url__'],
-    packages=find_packages(exclude=["tests", "*.tests", "*.tests.*", "tests.*"]),
+    packages=find_packages(exclude=["tests", "*.tests", "*.tests.*", "tests.*", "benchmarks", "benchmarks.*"]),
     install_requires=REQUIRED,
     extras_require=EXTRAS,
     include_package_data=True,
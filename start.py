@@ -2,12 +2,21 @@
 # -*- coding: utf-8 -*-
 r"""Main driver script for tweetAI."""
 import os
+import json
 import logging
 import logging.config
 import argparse
+import re
 
-from tweetai import TweetAI
+from tweetai import TweetAI, TweetHost
 from tweetai import __version__
+from tweetai.buffer import TweetBuffer
+from tweetai.filters import LengthFilter, PatternFilter
+from tweetai.residency import SessionPool
+from tweetai.workers import GenerationPool
+from tweetai.scheduler import parseSchedule
+from tweetai.startup import STARTUP
+from tweetai.tuning import PROFILE_PATH, autotune, loadProfile
 
 LOGDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.log')
 
@@ -27,21 +36,224 @@ def main(config):
     logger.info('Logging configured and initialized')
     logger.info(f'Welcome to TweetAI version {__version__}')
 
-    auth = {
-        'bearer_token': os.getenv('BEARER_TOKEN'),
-        'consumer_key': os.getenv('CONSUMER_KEY'),
-        'consumer_secret': os.getenv('CONSUMER_SECRET'),
-        'access_token': os.getenv('USER_ACCESS_TOKEN'),
-        'access_secret': os.getenv('USER_ACCESS_SECRET'),
-    }
-    blocked = os.getenv('BLOCKED_TERMS')
-    tweetAI = TweetAI(
-        auth=auth,
-        user=os.getenv('TWTUSER'),
-        blocked=blocked,
-        enabled=args.enable
+    with STARTUP.phase('configuration'):
+        blocked, options, host = readConfig()
+        personas = os.getenv('PERSONAS')
+        if personas is not None:
+            with open(personas) as f:
+                personas = json.load(f)
+
+    if args.check:
+        if personas is None:
+            TweetAI.validate(readAuth(), os.getenv('TWTUSER'))
+        else:
+            for persona in personas:
+                TweetAI.validate(readAuth(persona.get('env_prefix', '')), persona['user'])
+        logger.info('Configuration is valid')
+        print('Configuration is valid')
+        return
+
+    if args.buffer:
+        users = [os.getenv('TWTUSER')] if personas is None else [persona['user'] for persona in personas]
+        for user in users:
+            pruneBuffer(f'{user}.buffer', args)
+        return
+
+    if args.autotune is not None:
+        best = autotune(
+            args.autotune, path=os.getenv('INFERENCE_PROFILE') or PROFILE_PATH,
+            length=100 if options['length'] == 'auto' else options['length'],
+            batch_size=options['max_batch_size']
+        )
+        print(f'Recorded inference profile: {best}')
+        return
+
+    # Generation moves into worker processes when any are configured
+    processes = int(envNumber('GENERATION_PROCESSES', 0))
+    workers = int(envNumber('GENERATION_WORKERS', max(processes, 1)))
+    generator = None
+    if processes > 0:
+        generator = GenerationPool(
+            workers=processes,
+            capacity=int(envNumber('MAX_RESIDENT_MODELS', 1)),
+            idle_timeout=options['idle_timeout'],
+            min_available=options['min_available'],
+            timeout=envNumber('GENERATION_TIMEOUT', 900),
+            intra_op_threads=options['intra_op_threads'],
+            inter_op_threads=options['inter_op_threads']
+        )
+
+    if personas is None:
+        with STARTUP.phase('bots'):
+            tweetAI = TweetAI(
+                auth=readAuth(),
+                user=os.getenv('TWTUSER'),
+                blocked=blocked,
+                enabled=args.enable,
+                options=options,
+                generator=generator
+            )
+        tweetAI.run(workers=workers, **host)
+        return
+
+    # Multiple personas share one session pool and generation workers
+    with STARTUP.phase('bots'):
+        pool = SessionPool(
+            capacity=int(envNumber('MAX_RESIDENT_MODELS', 1)),
+            idle_timeout=options['idle_timeout'],
+            min_available=options['min_available'],
+            intra_op_threads=options['intra_op_threads'],
+            inter_op_threads=options['inter_op_threads']
+        )
+        bots = []
+        for persona in personas:
+            bots.append(TweetAI(
+                auth=readAuth(persona.get('env_prefix', '')),
+                user=persona['user'],
+                blocked=persona.get('blocked', blocked),
+                enabled=args.enable,
+                options={**options, 'run_name': persona.get('run_name', persona['user']), **persona.get('options', {})},
+                pool=pool,
+                generator=generator
+            ))
+    TweetHost(bots, workers=workers, **host).run()
+
+
+def pruneBuffer(path, args):
+    r"""List the tweets of a stopped bot's buffer, removing those selected.
+
+    Parameters
+    ----------
+    path
+        Path to the buffer log
+    args
+        Parsed command line arguments selecting the tweets to remove
+    """
+    if not os.path.isfile(path):
+        print(f'No buffer at {path}')
+        return
+    pattern = re.compile(args.match) if args.match else None
+    drop = set(args.drop)
+    buffer = TweetBuffer(path=path, sync_interval=3600)
+    removed = buffer.prune(
+        lambda index, tweet: args.clear or index in drop or (pattern is not None and pattern.search(tweet) is not None)
     )
-    tweetAI.run()
+    print(f'{path}: {len(buffer)} tweet(s) buffered, {removed} removed')
+    for index, tweet in enumerate(buffer):
+        print(f'{index:4d}  {tweet}')
+    buffer.close()
+
+
+def readConfig():
+    r"""Read the bot configuration from environment variables.
+
+    Returns
+    -------
+    tuple
+        Path to the blocked terms, dictionary of bot options and dictionary of
+        host options
+    """
+    blocked = os.getenv('BLOCKED_TERMS')
+    options = {
+        'whole_word': os.getenv('BLOCKED_WHOLE_WORD') == '1',
+        'normalized': os.getenv('BLOCKED_NORMALIZE') == '1',
+        'offline_links': os.getenv('OFFLINE_LINKS') == '1',
+        'idle_timeout': envNumber('MODEL_IDLE_TIMEOUT', 0),
+        'min_available': envNumber('MODEL_MIN_AVAILABLE_MB', None),
+        'low_water': int(envNumber('BUFFER_LOW_WATER', 3)),
+        'high_water': int(envNumber('BUFFER_HIGH_WATER', 10)),
+        'target_accepted': int(envNumber('TARGET_ACCEPTED', 5)),
+        'max_samples': int(envNumber('MAX_SAMPLES', 40)),
+        'max_batch_size': int(envNumber('MAX_BATCH_SIZE', 10)),
+        'near_duplicate': envNumber('NEAR_DUPLICATE_THRESHOLD', 0.6),
+        'post_limit': envNumber('POST_LIMIT', 300),
+        'post_window': envNumber('POST_WINDOW', 10800),
+        'retrain_steps': int(envNumber('RETRAIN_STEPS', 100)),
+        'filters': [],
+        'check_workers': int(envNumber('CHECK_WORKERS', 8)),
+        'check_deadline': envNumber('CHECK_DEADLINE', 30),
+    }
+    length = os.getenv('GENERATION_LENGTH', 'auto')
+    options['length'] = length if length == 'auto' else int(length)
+    # Settings recorded by --autotune apply unless set explicitly
+    profile = loadProfile(os.getenv('INFERENCE_PROFILE') or PROFILE_PATH) or {}
+    options['model_name'] = os.getenv('MODEL_NAME') or profile.get('model_name', '355M')
+    options['intra_op_threads'] = int(envNumber('TF_INTRA_OP_THREADS', profile.get('intra_op_threads', 0)))
+    options['inter_op_threads'] = int(envNumber('TF_INTER_OP_THREADS', profile.get('inter_op_threads', 0)))
+    max_length = envNumber('MAX_TWEET_LENGTH', None)
+    min_length = envNumber('MIN_TWEET_LENGTH', None)
+    if max_length is not None or min_length is not None:
+        options['filters'].append(LengthFilter(
+            max_length=int(max_length or 279), min_length=int(min_length or 1)
+        ))
+    patterns = os.getenv('BANNED_PATTERNS')
+    if patterns:
+        options['filters'].append(PatternFilter.fromFile(patterns))
+
+    schedule = os.getenv('POST_SCHEDULE')
+    retrain = os.getenv('RETRAIN_SCHEDULE')
+    compact = os.getenv('COMPACT_SCHEDULE')
+    host = {
+        'schedule': parseSchedule(schedule) if schedule else None,
+        'jitter': envNumber('POST_JITTER', 0),
+        'catchup': os.getenv('POST_CATCHUP') or 'once',
+        'metrics_port': envNumber('METRICS_PORT', None),
+        'snapshot': os.getenv('METRICS_SNAPSHOT') or None,
+        'snapshot_interval': envNumber('METRICS_SNAPSHOT_INTERVAL', 60),
+        'retrain': parseSchedule(retrain) if retrain else None,
+        'compact': parseSchedule(compact) if compact else None,
+        'admin_port': envNumber('ADMIN_PORT', None),
+        'admin_token': os.getenv('ADMIN_TOKEN') or None,
+    }
+    for key in ('metrics_port', 'admin_port'):
+        if host[key] is not None:
+            host[key] = int(host[key])
+    return blocked, options, host
+
+
+def readAuth(prefix=''):
+    r"""Read auth tokens and secrets from environment variables.
+
+    Parameters
+    ----------
+    prefix: optional
+        Prefix of the environment variable names, default is none
+
+    Returns
+    -------
+    dict
+        Auth dictionary for TweetAI
+    """
+    return {
+        'bearer_token': os.getenv(f'{prefix}BEARER_TOKEN'),
+        'consumer_key': os.getenv(f'{prefix}CONSUMER_KEY'),
+        'consumer_secret': os.getenv(f'{prefix}CONSUMER_SECRET'),
+        'access_token': os.getenv(f'{prefix}USER_ACCESS_TOKEN'),
+        'access_secret': os.getenv(f'{prefix}USER_ACCESS_SECRET'),
+    }
+
+
+def envNumber(name, default):
+    r"""Read a number from an environment variable.
+
+    Parameters
+    ----------
+    name
+        Name of the environment variable
+    default
+        Value used when the variable is not set
+
+    Returns
+    -------
+    float or None
+        Value of the variable, None if it is set to 'none'
+    """
+    value = os.getenv(name)
+    if value is None or value == '':
+        return default
+    if value.lower() == 'none':
+        return None
+    return float(value)
 
 
 def parseCL():
@@ -68,6 +280,24 @@ def parseCL():
     parser.add_argument(
         '-e', '--enable', action='store_true', default=False,
         help='\tallow the bot to start tweeting')
+    parser.add_argument(
+        '-c', '--check', action='store_true', default=False,
+        help='\tvalidate the configuration and exit')
+    parser.add_argument(
+        '-b', '--buffer', action='store_true', default=False,
+        help='\tlist the buffered tweets of a stopped bot and exit')
+    parser.add_argument(
+        '--drop', type=int, nargs='+', default=[], metavar='N',
+        help='\twith --buffer, remove the tweets at these positions')
+    parser.add_argument(
+        '--match', action='store', metavar='pattern',
+        help='\twith --buffer, remove the tweets matching a regular expression')
+    parser.add_argument(
+        '--clear', action='store_true', default=False,
+        help='\twith --buffer, remove every buffered tweet')
+    parser.add_argument(
+        '--autotune', type=float, metavar='seconds',
+        help='\trecord the fastest inference profile generating a tweet within this many seconds and exit')
 
     args = parser.parse_args()
     if args.temporary not in [None, 'all', 'log']:
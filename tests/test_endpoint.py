@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+r"""Tests of the local HTTP endpoint."""
+import asyncio
+
+import pytest
+
+from tweetai.endpoint import Endpoint
+
+
+def serve(endpoint, *requests):
+    r"""Send raw requests to an endpoint and return the status code and body of each."""
+    async def main():
+        await endpoint.start()
+        responses = []
+        try:
+            for request in requests:
+                reader, writer = await asyncio.open_connection('127.0.0.1', endpoint.port)
+                writer.write(request.encode('latin1'))
+                await writer.drain()
+                data = await reader.read()
+                writer.close()
+                head, _, body = data.decode('utf8').partition('\r\n\r\n')
+                responses.append((int(head.split(' ', 2)[1]), body))
+        finally:
+            await endpoint.stop()
+        return responses
+    return asyncio.run(main())
+
+
+def request(method, path, headers=(), body=''):
+    lines = [f'{method} {path} HTTP/1.1', 'Host: localhost', *headers]
+    if body:
+        lines.append(f'Content-Length: {len(body)}')
+    return '\r\n'.join(lines) + '\r\n\r\n' + body
+
+
+@pytest.fixture
+def calls():
+    return []
+
+
+def endpoint(calls, token=None):
+    endpoint = Endpoint(port=0, token=token)
+
+    def change(query, body):
+        calls.append((query, body))
+        return 200, 'text/plain', 'changed\n'
+
+    async def read(query, body):
+        return 200, 'application/json', '{"ok": true}'
+
+    endpoint.route('GET', '/read', read)
+    endpoint.route('POST', '/change', change)
+    return endpoint
+
+
+def test_routes(calls):
+    responses = serve(
+        endpoint(calls),
+        request('GET', '/read'),
+        request('POST', '/change?x=1', body='data'),
+        request('GET', '/change'),
+        request('GET', '/missing'),
+        'nonsense\r\n\r\n',
+    )
+    assert [status for status, _ in responses] == [200, 200, 405, 404, 400]
+    assert responses[0][1] == '{"ok": true}'
+    assert calls == [({'x': '1'}, b'data')]
+
+
+def test_posts_from_web_pages_are_refused(calls):
+    responses = serve(
+        endpoint(calls),
+        request('POST', '/change', ['Origin: http://example.com']),
+        request('GET', '/read', ['Origin: http://example.com']),
+    )
+    assert [status for status, _ in responses] == [403, 200]
+    assert calls == []
+
+
+def test_token_is_needed_to_change_state(calls):
+    responses = serve(
+        endpoint(calls, token='secret'),
+        request('POST', '/change'),
+        request('POST', '/change', ['Authorization: Bearer wrong']),
+        request('POST', '/change', ['Authorization: Basic secret']),
+        request('POST', '/change', ['Authorization: Bearer secret']),
+        request('GET', '/read'),
+    )
+    assert [status for status, _ in responses] == [401, 401, 401, 200, 200]
+    assert len(calls) == 1
+
+
+def test_large_body_is_refused(calls):
+    responses = serve(endpoint(calls), request('POST', '/change', body='x' * 70000))
+    assert responses[0][0] == 413
+    assert calls == []
+
+
+def exchange(endpoint, data, close=False):
+    r"""Send part of a request to an endpoint and return the status code of the response."""
+    async def main():
+        await endpoint.start()
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', endpoint.port)
+            writer.write(data.encode('latin1'))
+            if close:
+                writer.write_eof()
+            response = await asyncio.wait_for(reader.read(), 5)
+            writer.close()
+        finally:
+            await endpoint.stop()
+        return int(response.split(b' ', 2)[1])
+    return asyncio.run(main())
+
+
+def test_stalled_request_times_out(calls):
+    server = endpoint(calls)
+    server.timeout = 0.2
+    assert exchange(server, 'POST /change HTTP/1.1\r\nContent-Length: 10\r\n\r\nabc') == 400
+    assert exchange(server, 'GET /read HTTP/1.1\r\nHost: localhost\r\n') == 400
+    assert calls == []
+
+
+def test_truncated_body_is_refused(calls):
+    assert exchange(endpoint(calls), 'POST /change HTTP/1.1\r\nContent-Length: 10\r\n\r\nabc', close=True) == 400
+    assert calls == []
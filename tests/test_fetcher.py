@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+r"""Tests of the timeline fetcher against a fake client."""
+import json
+import time
+
+import pytest
+import requests
+import tweepy
+
+from tweetai.fetcher import TimelineFetcher
+
+
+def _response(status, body=None, headers=None):
+    response = requests.Response()
+    response.status_code = status
+    response.reason = requests.status_codes._codes[status][0].upper()
+    response._content = json.dumps(body or {}).encode('utf8')
+    response.headers.update(headers or {})
+    return response
+
+
+class _Clock:
+    r"""Monotonic clock that only moves when slept on."""
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class _Client:
+    r"""Client answering timeline requests from a list of scripted replies.
+
+    Each reply is either a response, returned as is, or an exception, raised.
+    """
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.calls = []
+        self.return_type = tweepy.Response
+
+    def get_users_tweets(self, id, **params):
+        self.calls.append(params)
+        reply = self.replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+
+def _page(count, next_token=None, headers=None):
+    data = [{'id': str(i), 'text': f'tweet {i}'} for i in range(count)]
+    meta = {'result_count': count}
+    if next_token is not None:
+        meta['next_token'] = next_token
+    return _response(200, {'data': data, 'meta': meta}, headers)
+
+
+@pytest.fixture
+def clock():
+    return _Clock()
+
+
+def fetcher(client, clock, **kwargs):
+    return TimelineFetcher(client, clock=clock, sleeper=clock.sleep, **kwargs)
+
+
+def test_rate_limit_waits_for_reset(clock):
+    headers = {'x-rate-limit-remaining': '0', 'x-rate-limit-reset': str(int(time.time()) + 60)}
+    client = _Client([tweepy.TooManyRequests(_response(429, headers=headers)), _page(3)])
+    page = fetcher(client, clock).fetch('1')
+    assert len(page.data) == 3
+    assert len(client.calls) == 2
+    # Waited out the reset, give or take the second the header is rounded to
+    assert 58 <= sum(clock.sleeps) <= 62
+
+
+def test_rate_limit_headers_space_out_requests(clock):
+    headers = {'x-rate-limit-remaining': '10', 'x-rate-limit-reset': str(int(time.time()) + 100)}
+    client = _Client([_page(1, headers=headers), _page(1)])
+    tweets = fetcher(client, clock)
+    tweets.fetch('1')
+    tweets.fetch('1')
+    assert len(clock.sleeps) == 1
+    assert 9 <= clock.sleeps[0] <= 10.1
+
+
+def test_server_errors_are_retried_with_backoff(clock, monkeypatch):
+    monkeypatch.setattr('tweetai.fetcher.random.uniform', lambda low, high: high)
+    client = _Client([
+        tweepy.TwitterServerError(_response(503)),
+        requests.ConnectionError('reset'),
+        tweepy.TwitterServerError(_response(500)),
+        _page(2),
+    ])
+    page = fetcher(client, clock, min_interval=0, backoff=2).fetch('1')
+    assert len(page.data) == 2
+    assert clock.sleeps == [2, 4, 8]
+
+
+def test_backoff_is_capped(clock, monkeypatch):
+    monkeypatch.setattr('tweetai.fetcher.random.uniform', lambda low, high: high)
+    client = _Client([tweepy.TwitterServerError(_response(503))] * 4 + [_page(1)])
+    fetcher(client, clock, min_interval=0, backoff=2, max_backoff=5).fetch('1')
+    assert clock.sleeps == [2, 4, 5, 5]
+
+
+def test_retries_run_out(clock):
+    client = _Client([tweepy.TwitterServerError(_response(503))] * 3)
+    with pytest.raises(tweepy.TwitterServerError):
+        fetcher(client, clock, max_retries=2).fetch('1')
+    assert len(client.calls) == 3
+
+
+def test_client_errors_are_not_retried(clock):
+    client = _Client([tweepy.Unauthorized(_response(401)), _page(1)])
+    with pytest.raises(tweepy.Unauthorized):
+        fetcher(client, clock).fetch('1')
+    assert len(client.calls) == 1
+
+
+def test_pages_follow_pagination_tokens(clock):
+    client = _Client([_page(100, 'b'), _page(100, 'c'), _page(5)])
+    pages = list(fetcher(client, clock).pages('1', since_id='42'))
+    assert [len(page.data) for page in pages] == [100, 100, 5]
+    assert [call.get('pagination_token') for call in client.calls] == [None, 'b', 'c']
+    assert all(call['since_id'] == '42' and call['max_results'] == 100 for call in client.calls)
+
+
+def test_full_page_without_token_is_last(clock):
+    # A page of exactly max_results tweets is only followed by another if it has a token
+    client = _Client([_page(100)])
+    pages = list(fetcher(client, clock).pages('1'))
+    assert len(pages) == 1
+    assert len(pages[0].data) == 100
+    assert 'start_time' in client.calls[0]
+
+
+def test_empty_page(clock):
+    client = _Client([_response(200, {'meta': {'result_count': 0}})])
+    page = fetcher(client, clock).fetch('1')
+    assert page.data == []
+    assert page.meta == {'result_count': 0}
+
+
+def test_client_is_not_changed(clock):
+    client = _Client([_page(1)])
+    tweets = fetcher(client, clock)
+    assert client.return_type is tweepy.Response
+    assert tweets.client.return_type is requests.Response
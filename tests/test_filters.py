@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+r"""Tests of the tweet filter chain."""
+import time
+
+import pytest
+
+from tweetai.filters import DEADLINE, ERROR, Filter, FilterChain, LengthFilter
+
+
+def fragile(tweet):
+    if 'boom' in tweet:
+        raise RuntimeError('check failed')
+    return 'bad' not in tweet
+
+
+@pytest.fixture
+def chain():
+    chain = FilterChain(workers=4)
+    yield chain
+    chain.close()
+
+
+def test_cheapest_filter_runs_first(chain):
+    seen = []
+    chain.add(Filter('expensive', lambda tweet: seen.append(tweet) or True, cost=10))
+    chain.add(LengthFilter(max_length=10))
+    assert chain.evaluate(['short', 'much too long for it']) == [None, 'length']
+    assert seen == ['short']
+
+
+@pytest.mark.parametrize('concurrent', [False, True])
+def test_error_rejects_only_its_tweet(chain, concurrent):
+    chain.add(Filter('fragile', fragile, concurrent=concurrent))
+    assert chain.evaluate(['fine', 'boom', 'bad', 'also fine']) == [None, ERROR, 'fragile', None]
+    stats = chain.report()['fragile']
+    assert (stats['checked'], stats['rejected'], stats['errors']) == (4, 1, 1)
+
+
+def test_failing_batch_is_checked_one_tweet_at_a_time(chain):
+    def batch(tweets):
+        raise RuntimeError('batch failed')
+
+    chain.add(Filter('fragile', fragile, batch=batch))
+    assert chain.evaluate(['fine', 'boom', 'bad']) == [None, ERROR, 'fragile']
+
+
+def test_deadline_rejects_slow_checks(chain):
+    chain.add(Filter('slow', lambda tweet: time.sleep(0.5) or True, concurrent=True))
+    assert chain.evaluate(['a', 'b'], deadline=0.05) == [DEADLINE, DEADLINE]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+r"""Tests of the tweet history database."""
+import pytest
+
+from tweetai.history import GENERATED, POSTED, TweetHistory
+
+
+@pytest.fixture
+def history(tmp_path):
+    history = TweetHistory(str(tmp_path / 'history.db'), max_rows=10)
+    yield history
+    history.close()
+
+
+def test_duplicates_are_found_by_normalized_text(history):
+    history.record('Hello, World!', POSTED)
+    assert history.contains('hello world')
+    assert not history.contains('hello there')
+
+
+def test_compact_keeps_newest_and_posted(history):
+    history.recordBatch([f'generated {i}' for i in range(50)], GENERATED)
+    history.record('posted', POSTED)
+    assert history.compact() == 40
+    assert history.counts() == {GENERATED: 10, POSTED: 1}
+    assert history.contains('generated 49', (GENERATED,))
+    assert not history.contains('generated 0', (GENERATED,))
+
+
+def test_compact_reclaims_every_free_page(history):
+    history.recordBatch([f'tweet {i} {"x" * 2000}' for i in range(500)], GENERATED)
+    history.compact()
+    assert history._db.execute('PRAGMA freelist_count').fetchone()[0] == 0
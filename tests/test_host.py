@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+r"""Tests of the bot host with fake bots."""
+import asyncio
+import json
+import threading
+
+from tweetai.host import TweetHost
+from tweetai.scheduler import Interval
+
+
+class _Buffer:
+    r"""Tweet buffer held in a list."""
+    def __init__(self, size=0, low_water=3, high_water=10):
+        self.low_water = low_water
+        self.high_water = high_water
+        self.tweets = [f'tweet {i}' for i in range(size)]
+
+    def __len__(self):
+        return len(self.tweets)
+
+    def isLow(self):
+        return len(self.tweets) < self.low_water
+
+    def isFull(self):
+        return len(self.tweets) >= self.high_water
+
+    def close(self):
+        pass
+
+
+class _Retrainer:
+    def running(self):
+        return False
+
+    def trainedOn(self):
+        return None
+
+    def stop(self):
+        pass
+
+
+class _Filters:
+    def report(self):
+        return {}
+
+
+class _Brain:
+    r"""Brain whose warm up and generation wait on gates the test opens."""
+    def __init__(self, buffered=0, ready=True, low_water=3):
+        self.run_name = 'run1'
+        self.generator = None
+        self.retrainer = _Retrainer()
+        self.filters = _Filters()
+        self.tweets = _Buffer(buffered, low_water=low_water)
+        self.ready = threading.Event()
+        if ready:
+            self.ready.set()
+        self.warm_gate = threading.Event()
+        self.warm_gate.set()
+        self.gate = threading.Event()
+        self.gate.set()
+        self.rounds = 0
+
+    @property
+    def residency(self):
+        return self
+
+    @property
+    def stats(self):
+        return {}
+
+    def isLoaded(self):
+        return True
+
+    def warmUp(self):
+        self.warm_gate.wait()
+        self.ready.set()
+
+    def refill(self, max_rounds=5):
+        self.gate.wait()
+        added = 0
+        for _ in range(max_rounds):
+            if self.tweets.isFull():
+                break
+            self.rounds += 1
+            self.tweets.tweets.append(f'generated {self.rounds}')
+            added += 1
+        return added
+
+    def getTweet(self):
+        if not self.tweets.tweets:
+            self.refill(1)
+        return self.tweets.tweets.pop(0)
+
+
+class _Outbox:
+    def counts(self):
+        return {}
+
+
+class _Mouth:
+    def __init__(self):
+        self.enabled = False
+        self.outbox = _Outbox()
+        self.sent = []
+
+    def sendTweet(self, tweet):
+        self.sent.append(tweet)
+
+    async def deliver(self):
+        await asyncio.Event().wait()
+
+
+class _Bot:
+    def __init__(self, username, **kwargs):
+        self.username = username
+        self.brain = _Brain(**kwargs)
+        self.mouth = _Mouth()
+
+
+def host(bots, **kwargs):
+    return TweetHost(bots, loop=asyncio.new_event_loop(), schedule=Interval(86400), **kwargs)
+
+
+def drive(host, check):
+    r"""Run a host until a check coroutine finishes and return its result."""
+    async def main():
+        try:
+            # The task starts while the endpoints are starting
+            if host.admin is not None:
+                await until(lambda: host.admin.port != 0)
+            return await check()
+        finally:
+            host.loop.stop()
+    task = host.loop.create_task(main())
+    host.run()
+    return task.result()
+
+
+async def call(host, method, path, headers=()):
+    r"""Send a request to a host's control API and return the status code and body."""
+    reader, writer = await asyncio.open_connection('127.0.0.1', host.admin.port)
+    head = '\r\n'.join([f'{method} {path} HTTP/1.1', 'Host: localhost', *headers])
+    writer.write(f'{head}\r\n\r\n'.encode('latin1'))
+    await writer.drain()
+    data = await reader.read()
+    writer.close()
+    status, _, body = data.decode('utf8').partition('\r\n\r\n')
+    return int(status.split(' ', 2)[1]), body
+
+
+async def until(condition, timeout=5):
+    r"""Wait for a condition to hold."""
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return True
+        await asyncio.sleep(0.01)
+    return False
+
+
+def test_ready_bots_generate_while_others_warm_up():
+    ready = _Bot('ready')
+    slow = _Bot('slow', ready=False)
+    slow.brain.warm_gate.clear()
+    bots = host([ready, slow], workers=1)
+
+    async def check():
+        try:
+            return await until(lambda: ready.brain.rounds > 0), slow.brain.ready.is_set()
+        finally:
+            slow.brain.warm_gate.set()
+
+    assert drive(bots, check) == (True, False)
+
+
+def test_second_generation_is_refused_while_one_runs():
+    busy = _Bot('busy', buffered=5)
+    other = _Bot('other', buffered=5)
+    busy.brain.gate.clear()
+    bots = host([busy, other], workers=1, admin_port=0)
+
+    async def check():
+        try:
+            first = asyncio.ensure_future(call(bots, 'POST', '/generate?bot=busy'))
+            assert await until(lambda: busy in bots._refilling)
+            again = await call(bots, 'POST', '/generate?bot=busy')
+            elsewhere = await call(bots, 'POST', '/generate?bot=other')
+            status = json.loads((await call(bots, 'GET', '/status'))[1])
+        finally:
+            busy.brain.gate.set()
+        return again[0], elsewhere, status['workers'], await first
+
+    again, elsewhere, workers, first = drive(bots, check)
+    assert again == 429
+    assert elsewhere == (429, 'every generation worker is busy\n')
+    assert workers == {'total': 1, 'busy': 1}
+    assert first[0] == 200
+    assert json.loads(first[1]) == {'added': 1, 'buffered': 6}
+    assert other.brain.rounds == 0
+
+
+def test_generation_on_full_buffer_is_refused():
+    bot = _Bot('full', buffered=10)
+    bots = host([bot], admin_port=0)
+    status, _ = drive(bots, lambda: call(bots, 'POST', '/generate'))
+    assert status == 409
+    assert bot.brain.rounds == 0
+
+
+def test_post_on_empty_buffer_takes_a_worker_slot():
+    empty = _Bot('empty', low_water=0)
+    other = _Bot('other', buffered=5)
+    empty.brain.gate.clear()
+    bots = host([empty, other], workers=1, admin_port=0)
+
+    async def check():
+        try:
+            posting = asyncio.ensure_future(bots._tweet(empty))
+            assert await until(lambda: empty in bots._refilling)
+            locked = bots._slots.locked()
+            refused = await call(bots, 'POST', '/generate?bot=other')
+        finally:
+            empty.brain.gate.set()
+        await posting
+        return locked, refused[0]
+
+    assert drive(bots, check) == (True, 429)
+    assert empty.mouth.sent == ['generated 1']
+
+
+def test_paused_bot_is_skipped():
+    paused = _Bot('paused', buffered=0)
+    waiting = _Bot('waiting', buffered=0)
+    bots = host([paused, waiting])
+    try:
+        bots._paused.add(paused)
+        assert bots._nextBot() is waiting
+        bots._refilling.add(waiting)
+        assert bots._nextBot() is None
+    finally:
+        bots.loop.close()
+
+
+def test_post_pause_and_resume():
+    bot = _Bot('bot', buffered=1, low_water=0)
+    bots = host([bot], admin_port=0)
+
+    async def check():
+        posted = await call(bots, 'POST', '/post')
+        empty = await call(bots, 'POST', '/post')
+        paused = await call(bots, 'POST', '/pause')
+        status = json.loads((await call(bots, 'GET', '/status'))[1])
+        await bots._tweet(bot)
+        resumed = await call(bots, 'POST', '/resume?bot=bot')
+        unknown = await call(bots, 'POST', '/pause?bot=nobody')
+        return posted, empty[0], paused, status['bots']['bot']['paused'], resumed, unknown[0]
+
+    posted, empty, paused, status, resumed, unknown = drive(bots, check)
+    assert posted == (202, json.dumps({'tweet': 'tweet 0', 'enabled': False}))
+    assert empty == 503
+    assert json.loads(paused[1]) == {'paused': True, 'generating': False}
+    assert status is True
+    assert json.loads(resumed[1]) == {'paused': False, 'generating': False}
+    assert unknown == 404
+    assert bot.mouth.sent == ['tweet 0']
+    assert bot not in bots._paused
+
+
+def test_control_api_needs_token_and_no_origin():
+    bot = _Bot('bot', buffered=5)
+    bots = host([bot], admin_port=0, admin_token='secret')
+
+    async def check():
+        return [
+            (await call(bots, 'POST', '/pause'))[0],
+            (await call(bots, 'POST', '/pause', ['Authorization: Bearer wrong']))[0],
+            (await call(bots, 'POST', '/pause', ['Authorization: Bearer secret', 'Origin: http://example.com']))[0],
+            (await call(bots, 'GET', '/status'))[0],
+            (await call(bots, 'POST', '/pause', ['Authorization: Bearer secret']))[0],
+        ]
+
+    assert drive(bots, check) == [401, 401, 403, 200, 200]
+    assert bot in bots._paused
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+r"""Tests of the link resolver against a local HTTP server."""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from tweetai.links import LinkResolver
+
+
+class _Handler(BaseHTTPRequestHandler):
+    r"""Stub site answering each path with a fixed behaviour."""
+    def do_HEAD(self):
+        self._answer('HEAD')
+
+    def do_GET(self):
+        self._answer('GET')
+
+    def _answer(self, method):
+        self.server.requests.append((method, self.path))
+        if self.path == '/ok':
+            self.send_response(200)
+        elif self.path == '/redirect':
+            self.send_response(302)
+            self.send_header('Location', '/ok')
+        elif self.path == '/get-only':
+            self.send_response(405 if method == 'HEAD' else 200)
+        elif self.path == '/slow':
+            time.sleep(1)
+            self.send_response(200)
+        else:
+            self.send_response(404)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    httpd.daemon_threads = True
+    httpd.requests = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def resolver():
+    resolver = LinkResolver(timeout=2, deadline=5)
+    yield resolver
+    resolver.close()
+
+
+def url(server, path):
+    return f'http://127.0.0.1:{server.server_address[1]}{path}'
+
+
+def test_working_link(server, resolver):
+    assert resolver.hasLink(f'see {url(server, "/ok")} now')
+
+
+def test_missing_page_is_not_a_link(server, resolver):
+    assert not resolver.hasLink(f'see {url(server, "/missing")}')
+
+
+def test_missing_page_does_not_hide_other_pages(server, resolver):
+    assert not resolver.hasLink(url(server, '/missing'))
+    assert resolver.hasLink(url(server, '/ok'))
+
+
+def test_head_not_allowed_falls_back_to_get(server, resolver):
+    assert resolver.hasLink(url(server, '/get-only'))
+    assert server.requests == [('HEAD', '/get-only'), ('GET', '/get-only')]
+
+
+def test_redirect_is_followed(server, resolver):
+    assert resolver.hasLink(url(server, '/redirect'))
+    assert ('HEAD', '/ok') in server.requests
+
+
+def test_request_timeout(server):
+    resolver = LinkResolver(timeout=0.2, deadline=5)
+    try:
+        assert not resolver.hasLink(url(server, '/slow'))
+    finally:
+        resolver.close()
+
+
+def test_deadline_judges_by_shape(server):
+    resolver = LinkResolver(timeout=5, deadline=0.2)
+    try:
+        start = time.monotonic()
+        # An ip address has the shape of a link
+        assert resolver.hasLink(url(server, '/slow'))
+        assert time.monotonic() - start < 0.9
+    finally:
+        resolver.close()
+
+
+def test_verdicts_are_cached(server, resolver):
+    assert resolver.hasLink(url(server, '/ok'))
+    assert not resolver.hasLink(url(server, '/missing'))
+    count = len(server.requests)
+    assert resolver.hasLink(url(server, '/ok#top'))
+    assert not resolver.hasLink(url(server, '/missing'))
+    assert len(server.requests) == count
+
+
+def test_unreachable_host_is_cached(server, resolver):
+    port = server.server_address[1]
+    server.shutdown()
+    server.server_close()
+    assert not resolver.hasLink(f'http://127.0.0.1:{port}/ok')
+    assert resolver.cache.get(f'127.0.0.1:{port}') is False
+    assert not resolver.hasLink(f'http://127.0.0.1:{port}/other')
+
+
+def test_offline_judges_by_shape():
+    resolver = LinkResolver(offline=True)
+    try:
+        assert resolver.hasLink('go to example.com today')
+        assert not resolver.hasLink('the end.story of it')
+    finally:
+        resolver.close()
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+r"""Tests of posting tweets from the outbox."""
+import asyncio
+
+import pytest
+import tweepy
+
+from tweetai.mouth import Mouth
+from tweetai.outbox import FAILED, PENDING, SENT, Outbox
+
+
+class _Client:
+    r"""Client posting by calling a function with the text."""
+    def __init__(self, post):
+        self.post = post
+
+    def create_tweet(self, *, text):
+        return self.post(text)
+
+
+def post(mouth):
+    r"""Claim the next message and attempt to post it."""
+    async def main():
+        mouth._loop = asyncio.get_running_loop()
+        await mouth._post(mouth.outbox.claim())
+    asyncio.run(main())
+
+
+@pytest.fixture
+def outbox():
+    outbox = Outbox(':memory:')
+    yield outbox
+    outbox.close()
+
+
+def test_posted(outbox):
+    mouth = Mouth(_Client(lambda text: tweepy.Response({'id': '7', 'text': text}, {}, [], {})), True, outbox=outbox)
+    outbox.enqueue('hello')
+    post(mouth)
+    assert outbox.counts() == {SENT: 1}
+
+
+def test_response_without_data_is_posted(outbox):
+    mouth = Mouth(_Client(lambda text: object()), True, outbox=outbox)
+    outbox.enqueue('hello')
+    post(mouth)
+    assert outbox.counts() == {SENT: 1}
+
+
+def test_unexpected_error_releases_claim(outbox):
+    def fail(text):
+        raise TypeError('unexpected')
+
+    mouth = Mouth(_Client(fail), True, outbox=outbox, backoff=0)
+    outbox.enqueue('hello')
+    post(mouth)
+    assert outbox.counts() == {PENDING: 1}
+    assert outbox.claim().attempts == 1
+
+
+def test_unexpected_errors_give_up(outbox):
+    def fail(text):
+        raise AttributeError('unexpected')
+
+    mouth = Mouth(_Client(fail), True, outbox=outbox, backoff=0, max_attempts=2)
+    outbox.enqueue('hello')
+    post(mouth)
+    post(mouth)
+    assert outbox.counts() == {FAILED: 1}
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+r"""Tests of the outbox queue."""
+import pytest
+
+from tweetai.outbox import FAILED, PENDING, SENT, Outbox
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return _Clock()
+
+
+@pytest.fixture
+def outbox(clock):
+    outbox = Outbox(':memory:', clock=clock, retention=3600)
+    yield outbox
+    outbox.close()
+
+
+def test_same_tweet_is_queued_once(outbox):
+    assert outbox.enqueue('Hello world')
+    assert not outbox.enqueue('hello, world!')
+    assert len(outbox) == 1
+
+
+def test_claim_takes_oldest_due(outbox, clock):
+    outbox.enqueue('first')
+    clock.now += 1
+    outbox.enqueue('second')
+    message = outbox.claim()
+    assert message.text == 'first'
+    outbox.retry(message, 60)
+    assert outbox.claim().text == 'second'
+    assert outbox.claim() is None
+    clock.now += 60
+    assert outbox.claim().text == 'first'
+
+
+def test_sent_messages_are_pruned_after_retention(outbox, clock):
+    outbox.enqueue('old')
+    outbox.sent(outbox.claim(), '1')
+    clock.now += 1800
+    outbox.enqueue('new')
+    outbox.sent(outbox.claim(), '2')
+    assert outbox.counts() == {SENT: 2}
+    clock.now += 2400
+    outbox.enqueue('newest')
+    outbox.sent(outbox.claim(), '3')
+    assert outbox.counts() == {SENT: 2}
+    assert outbox.sentSince(0) == [2800.0, 5200.0]
+
+
+def test_prune_keeps_unsent(outbox, clock):
+    outbox.enqueue('failed')
+    outbox.fail(outbox.claim())
+    outbox.enqueue('sent')
+    outbox.sent(outbox.claim())
+    outbox.enqueue('pending')
+    clock.now += 7200
+    assert outbox.prune() == 1
+    assert outbox.counts() == {FAILED: 1, PENDING: 1}
+
+
+def test_interrupted_claims_are_resumed(tmp_path):
+    path = str(tmp_path / 'outbox.db')
+    outbox = Outbox(path)
+    outbox.enqueue('tweet')
+    assert outbox.claim() is not None
+    outbox.close()
+    outbox = Outbox(path)
+    try:
+        assert outbox.claim().text == 'tweet'
+    finally:
+        outbox.close()
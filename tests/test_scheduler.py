@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+r"""Tests of the job scheduler on a fake clock."""
+import asyncio
+import logging
+from datetime import datetime
+
+import pytest
+
+from tweetai.scheduler import ALL, ONCE, SKIP, Cron, FakeClock, Interval, Job, Scheduler, parseSchedule
+
+
+def run(scheduler, seconds):
+    r"""Run a scheduler until the clock has moved on by some seconds."""
+    async def main():
+        stop = Interval(seconds, anchor=scheduler.clock.now())
+        scheduler.add(Job('stop', stop, scheduler.stop))
+        await scheduler.run()
+        # Let the callbacks of the last jobs fired run
+        await asyncio.sleep(0)
+    asyncio.run(main())
+
+
+@pytest.fixture
+def scheduler():
+    return Scheduler(FakeClock())
+
+
+@pytest.mark.parametrize('fields, after, expected', [
+    ('0 */2 * * *', datetime(2000, 1, 1, 1, 30), datetime(2000, 1, 1, 2, 0)),
+    ('0 */2 * * *', datetime(2000, 1, 1, 2, 0), datetime(2000, 1, 1, 4, 0)),
+    ('30 9 * * 1-5', datetime(2021, 6, 4, 10, 0), datetime(2021, 6, 7, 9, 30)),
+    ('0 0 1 * *', datetime(2021, 12, 15), datetime(2022, 1, 1)),
+    ('0 0 29 2 *', datetime(2021, 3, 1), datetime(2024, 2, 29)),
+    ('0 12 13 * 5', datetime(2021, 6, 1), datetime(2021, 6, 4, 12, 0)),
+    ('15,45 * * * 0', datetime(2021, 6, 5, 23, 50), datetime(2021, 6, 6, 0, 15)),
+])
+def test_cron_next(fields, after, expected):
+    assert Cron(fields).next(after) == expected
+
+
+@pytest.mark.parametrize('fields', ['* * * *', '60 * * * *', '* * * 13 *', '*/0 * * * *', '0 0 31 2 *'])
+def test_invalid_cron(fields):
+    with pytest.raises(ValueError):
+        Cron(fields).next(datetime(2000, 1, 1))
+
+
+def test_interval_lines_up_with_anchor():
+    schedule = Interval(900)
+    assert schedule.next(datetime(2021, 6, 1, 10, 7)) == datetime(2021, 6, 1, 10, 15)
+    assert schedule.next(datetime(2021, 6, 1, 10, 15)) == datetime(2021, 6, 1, 10, 30)
+    anchored = Interval(3600, anchor=datetime(2021, 6, 1, 0, 20))
+    assert anchored.next(datetime(2021, 6, 1, 10, 7)) == datetime(2021, 6, 1, 10, 20)
+
+
+def test_parse_schedule():
+    assert isinstance(parseSchedule('60'), Interval)
+    assert isinstance(parseSchedule('0 * * * *'), Cron)
+
+
+def test_jobs_run_on_schedule(scheduler):
+    hourly = scheduler.add(Job('hourly', Interval(3600), lambda: None))
+    cron = scheduler.add(Job('cron', Cron('0 */2 * * *'), lambda: None))
+    run(scheduler, 6 * 3600 + 60)
+    assert hourly.runs == 6
+    assert cron.runs == 3
+    assert hourly.next_run == datetime(2000, 1, 1, 7, 0)
+
+
+def test_coroutine_callbacks_are_awaited(scheduler):
+    done = []
+
+    async def callback():
+        done.append(True)
+
+    scheduler.add(Job('async', Interval(60), callback))
+    run(scheduler, 150)
+    assert done == [True, True]
+
+
+def test_jitter_stays_in_bounds(scheduler):
+    jobs = [scheduler.add(Job(f'job {i}', Interval(60), lambda: None, jitter=30)) for i in range(200)]
+    for due, _, job in scheduler._heap:
+        jitter = (job.due - job.next_run).total_seconds()
+        assert 0 <= jitter <= 30
+        assert due == pytest.approx(60 + jitter)
+    assert len({job.due for job in jobs}) > 1
+
+
+def test_jittered_runs_are_not_late(scheduler, monkeypatch, caplog):
+    monkeypatch.setattr('tweetai.scheduler.random.uniform', lambda low, high: high)
+    job = scheduler.add(Job('jittered', Interval(3600), lambda: None, jitter=600, catchup=SKIP, grace=60))
+    with caplog.at_level(logging.WARNING, logger='tweetai.scheduler'):
+        run(scheduler, 4 * 3600 + 1200)
+    assert job.runs == 4
+    assert not caplog.records
+
+
+@pytest.mark.parametrize('catchup, runs', [(SKIP, 0), (ONCE, 1), (ALL, 10)])
+def test_catchup(scheduler, catchup, runs):
+    job = scheduler.add(Job('missed', Interval(60), lambda: None, catchup=catchup))
+    # The loop was asleep through ten runs
+    scheduler.clock.advance(600)
+    run(scheduler, 30)
+    assert job.runs == runs
+    assert job.next_run == datetime(2000, 1, 1, 0, 11)
+
+
+def test_late_within_grace_runs(scheduler):
+    job = scheduler.add(Job('late', Interval(60), lambda: None, catchup=SKIP, grace=60))
+    scheduler.clock.advance(90)
+    run(scheduler, 10)
+    assert job.runs == 1
+
+
+def test_cancelled_job_does_not_run(scheduler):
+    job = scheduler.add(Job('cancelled', Interval(60), lambda: None))
+    job.cancel()
+    assert scheduler.jobs() == []
+    run(scheduler, 300)
+    assert job.runs == 0
+
+
+def test_failing_job_keeps_running(scheduler):
+    def fail():
+        raise RuntimeError('boom')
+
+    job = scheduler.add(Job('failing', Interval(60), fail))
+    run(scheduler, 200)
+    assert job.runs == 3
+
+
+def test_invalid_catchup():
+    with pytest.raises(ValueError):
+        Job('bad', Interval(60), lambda: None, catchup='never')
@@ -6,6 +6,8 @@ from tweetai.__version__ import (__author__, __author_email__, __copyright__,
                                __description__, __license__, __title__,
                                __url__, __version__)
 from tweetai.core import TweetAI, __doc__
+from tweetai.filters import Filter, FilterChain, LengthFilter, PatternFilter
+from tweetai.host import TweetHost
 
 try:
     from logging import NullHandler
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+r"""Module for sizing generation batches.
+
+Classes
+-------
+BatchSizer
+    Batch size controller driven by the tweet acceptance rate
+"""
+import logging
+from collections import deque
+from math import ceil
+
+logger = logging.getLogger(__name__)
+
+
+class BatchSizer:
+    r"""Batch size controller driven by the tweet acceptance rate.
+
+    Keeps a rolling window of how many generated tweets passed the checks and asks
+    for enough samples to reach the target number of accepted tweets, within the
+    sample and batch limits.
+
+    Parameters
+    ----------
+    target: optional
+        Number of accepted tweets wanted from each generation, default is 5
+    max_samples: optional
+        Most samples generated at once, bounds generation time, default is 40
+    max_batch_size: optional
+        Most samples generated in parallel, bounds memory use, default is 10
+    window: optional
+        Number of recent generations the acceptance rate is taken from, default is 20
+
+    Attributes
+    ----------
+    target
+        Number of accepted tweets wanted from each generation
+    max_samples
+        Most samples generated at once
+    max_batch_size
+        Most samples generated in parallel
+
+    Methods
+    -------
+    rate
+        Get the recent acceptance rate
+    size
+        Get the number of samples and batch size for the next generation
+    record
+        Record the outcome of a generation
+    """
+    def __init__(self, target=5, max_samples=40, max_batch_size=10, window=20):
+        if not 0 < target <= max_samples:
+            raise ValueError('target must be between 1 and max_samples')
+        self.target = target
+        self.max_samples = max_samples
+        self.max_batch_size = max_batch_size
+        self._history = deque(maxlen=window)
+
+    def rate(self):
+        r"""Get the recent acceptance rate.
+
+        Returns
+        -------
+        float
+            Smoothed fraction of generated tweets that were accepted
+        """
+        generated = sum(gen for gen, _ in self._history)
+        accepted = sum(acc for _, acc in self._history)
+        # Smoothed so an unlucky window never drives the rate to zero
+        return (accepted + 1) / (generated + 2)
+
+    def size(self):
+        r"""Get the number of samples and batch size for the next generation.
+
+        Returns
+        -------
+        tuple
+            Number of samples and batch size, samples is a multiple of batch size
+        """
+        wanted = min(ceil(self.target / self.rate()), self.max_samples)
+        batch_size = min(wanted, self.max_batch_size)
+        nsamples = ceil(wanted / batch_size) * batch_size
+        if nsamples > self.max_samples:
+            nsamples -= batch_size
+        return max(nsamples, batch_size), batch_size
+
+    def record(self, generated, accepted):
+        r"""Record the outcome of a generation.
+
+        Parameters
+        ----------
+        generated
+            Number of tweets generated
+        accepted
+            Number of those tweets that passed the checks
+        """
+        self._history.append((generated, accepted))
+        logger.debug(f'Accepted {accepted} of {generated} tweet(s), rate now {self.rate():.2f}')
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+r"""Module for matching blocked terms.
+
+Classes
+-------
+Blocklist
+    Multi term matcher built from a list of blocked terms
+"""
+import os
+import logging
+import threading
+from unicodedata import normalize
+
+logger = logging.getLogger(__name__)
+
+
+class Blocklist:
+    r"""Multi term matcher built from a list of blocked terms.
+
+    All terms are compiled into a single Aho-Corasick automaton so text is checked
+    against every term in one pass. The terms file is watched and the automaton is
+    rebuilt in the background when it changes.
+
+    Parameters
+    ----------
+    path
+        Path to a list of blocked terms, one per line
+    whole_word: optional
+        True if terms only match on word boundaries, default is False
+    normalized: optional
+        True if unicode is normalized and case folded before matching instead of
+        only lowercased, default is False
+    interval: optional
+        Seconds between checks of the terms file for changes, default is 30
+
+    Attributes
+    ----------
+    path
+        Path to a list of blocked terms
+    whole_word
+        True if terms only match on word boundaries
+    normalized
+        True if unicode is normalized before matching
+    interval
+        Seconds between checks of the terms file for changes
+    terms
+        List of blocked terms currently in use
+
+    Methods
+    -------
+    find
+        Find the first blocked term in a text
+    reload
+        Rebuild the matcher from the terms file
+    watch
+        Start watching the terms file for changes
+    stop
+        Stop watching the terms file
+    """
+    def __init__(self, path, whole_word=False, normalized=False, interval=30):
+        self.path = path
+        self.whole_word = whole_word
+        self.normalized = normalized
+        self.interval = interval
+        self.terms = []
+        self._automaton = _Automaton([])
+        self._mtime = None
+        self._stopped = threading.Event()
+        self._watcher = None
+        self.reload()
+
+    def __len__(self):
+        return len(self.terms)
+
+    def find(self, text):
+        r"""Find the first blocked term in a text.
+
+        Parameters
+        ----------
+        text
+            Text to check for blocked terms
+
+        Returns
+        -------
+        str or None
+            The blocked term found, None if the text contains no blocked terms
+        """
+        automaton = self._automaton
+        if not automaton.terms:
+            return None
+        return automaton.find(self._fold(text), self.whole_word)
+
+    def reload(self):
+        r"""Rebuild the matcher from the terms file.
+
+        Returns
+        -------
+        bool
+            True if the terms file was read
+        """
+        if self.path is None:
+            logger.info('No block list path provided, continuing with no blocked terms')
+            return False
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            with open(self.path, encoding='utf8') as blist:
+                terms = [term.rstrip() for term in blist.readlines()]
+        except OSError:
+            logger.error('Block list path not found, continuing with previous blocked terms')
+            return False
+
+        terms = [term for term in terms if term != '']
+        # Build the new automaton before swapping so matching never sees a partial one
+        self._automaton = _Automaton([self._fold(term) for term in terms])
+        self.terms = terms
+        self._mtime = mtime
+        logger.info(f'Loaded {len(terms)} blocked term(s)')
+        return True
+
+    def watch(self):
+        r"""Start watching the terms file for changes."""
+        if self.path is None or self._watcher is not None:
+            return
+        self._stopped.clear()
+        self._watcher = threading.Thread(target=self._watch, name='blocklist-watcher', daemon=True)
+        self._watcher.start()
+
+    def stop(self):
+        r"""Stop watching the terms file."""
+        self._stopped.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
+
+    def _watch(self):
+        r"""Poll the terms file and reload it when it changes."""
+        while not self._stopped.wait(self.interval):
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                continue
+            if mtime != self._mtime:
+                logger.info('Block list changed, reloading')
+                self.reload()
+
+    def _fold(self, text):
+        r"""Fold text to the form used for matching.
+
+        Parameters
+        ----------
+        text
+            Text to fold
+
+        Returns
+        -------
+        str
+            Lowercased text, or normalized and case folded text
+        """
+        if self.normalized:
+            return normalize('NFKC', text).casefold()
+        return text.lower()
+
+
+class _Automaton:
+    r"""Aho-Corasick automaton over a list of terms.
+
+    Parameters
+    ----------
+    terms
+        Terms to match, already folded
+
+    Attributes
+    ----------
+    terms
+        Terms matched by the automaton
+    """
+    def __init__(self, terms):
+        self.terms = terms
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        for index, term in enumerate(terms):
+            state = 0
+            for char in term:
+                nxt = self._goto[state].get(char)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][char] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                state = nxt
+            self._out[state] += (index,)
+
+        # Breadth first pass to set failure links and merge outputs
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for char, nxt in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(char, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._out[nxt] += self._out[self._fail[nxt]]
+                queue.append(nxt)
+
+    def find(self, text, whole_word=False):
+        r"""Find the first term in a text.
+
+        Parameters
+        ----------
+        text
+            Folded text to search
+        whole_word: optional
+            True if matches must start and end on word boundaries, default is False
+
+        Returns
+        -------
+        str or None
+            The first term found, None if there are no matches
+        """
+        goto, fail, out, terms = self._goto, self._fail, self._out, self.terms
+        state = 0
+        for pos, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for index in out[state]:
+                term = terms[index]
+                if not whole_word or _isWord(text, pos + 1 - len(term), pos + 1):
+                    return term
+        return None
+
+
+def _isWord(text, start, end):
+    r"""Check if a span of text sits on word boundaries.
+
+    Parameters
+    ----------
+    text
+        Text containing the span
+    start
+        Index the span starts at
+    end
+        Index the span ends before
+
+    Returns
+    -------
+    bool
+        True if the characters around the span are not word characters
+    """
+    before = start == 0 or not _isWordChar(text[start - 1]) or not _isWordChar(text[start])
+    after = end == len(text) or not _isWordChar(text[end]) or not _isWordChar(text[end - 1])
+    return before and after
+
+
+def _isWordChar(char):
+    return char.isalnum() or char == '_'
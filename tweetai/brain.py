@@ -10,18 +10,46 @@ import os
 import logging
 import csv
 import re
-from time import sleep
-import requests
-from urllib3.exceptions import LocationParseError
-
-import gpt_2_simple as gpt2
+import threading
+
+from .batching import BatchSizer
+from .blocklist import Blocklist
+from .buffer import TweetBuffer
+from .corpus import CorpusIndex
+from .dataset import DatasetCache
+from .fetcher import TimelineFetcher
+from .filters import Filter, FilterChain
+from .history import GENERATED, POSTED, REJECTED, normalizeText
+from .links import LinkResolver
+from .metrics import REGISTRY
+from .minhash import MinHashIndex
+from .residency import ModelResidency, checkpointModel, importGPT2, newSession
+from .startup import STARTUP
+from .sync import SyncState
+from .training import Retrainer
 
 logger = logging.getLogger(__name__)
 
+GENERATED_TWEETS = REGISTRY.counter('tweetai_tweets_generated_total', 'Tweets generated', ['user'])
+ACCEPTED_TWEETS = REGISTRY.counter('tweetai_tweets_accepted_total', 'Generated tweets passing every check', ['user'])
+ACCEPTANCE_RATE = REGISTRY.gauge('tweetai_acceptance_rate', 'Smoothed fraction of generated tweets accepted', ['user'])
+BUFFERED_TWEETS = REGISTRY.gauge('tweetai_buffered_tweets', 'Tweets ready to be posted', ['user'])
+
+# Characters a tweet may have once posted
+TWEET_LENGTH = 279
+# Tokens generated for each tweet until the training data has been measured
+DEFAULT_LENGTH = 200
+# Most tokens generated for each tweet, leaving room in the model's context for the prefix
+MAX_LENGTH = 1000
+
 
 class Brain:
     r"""AI processing and text generation class.
 
+    Creating a brain is cheap. Downloading data, training and loading the model and
+    generating the first tweets wait for warmUp, which is usually run in the
+    background so the bot is live before it is ready.
+
     Parameters
     ----------
     client
@@ -30,6 +58,67 @@ class Brain:
         Twitter username of whom to base tweets on
     blocked
         Path to a list of blocked terms
+    history: optional
+        Record of earlier tweets to keep from repeating, default is None
+    pool: optional
+        Session pool shared with other brains, default is None for a session of its own
+    generator: optional
+        GenerationPool generating in worker processes, default is None to generate
+        in this process
+    run_name: optional
+        Name of the AI model training run, default is run1
+    model_name: optional
+        Name of the base GPT-2 model a new training run is fine-tuned from, such
+        as 124M or 355M, default is 355M
+    intra_op_threads: optional
+        Threads running the work of a single TensorFlow operation, default is 0 to
+        let TensorFlow decide
+    inter_op_threads: optional
+        TensorFlow operations run at once, default is 0 to let TensorFlow decide
+    whole_word: optional
+        True if blocked terms only match whole words, default is False
+    normalized: optional
+        True if unicode is normalized before matching blocked terms, default is False
+    offline_links: optional
+        True if links are detected by their shape only with no requests, default is False
+    link_deadline: optional
+        Seconds allowed to check all links in a tweet, default is 5
+    idle_timeout: optional
+        Seconds the model is kept loaded after generating, None to keep it loaded
+        until memory is low, default is 0 to unload right after generating, ignored
+        when a pool is provided
+    min_available: optional
+        Megabytes of available memory below which the model is unloaded, default is
+        None, ignored when a pool is provided
+    low_water: optional
+        Number of ready tweets below which the buffer is refilled, default is 3
+    high_water: optional
+        Number of ready tweets a refill aims for, default is 10
+    buffer_path: optional
+        Path to keep ready tweets in across restarts, default is None to only keep
+        them in memory
+    target_accepted: optional
+        Number of accepted tweets wanted from each generation, default is 5
+    max_samples: optional
+        Most tweets generated at once, default is 40
+    max_batch_size: optional
+        Most tweets generated in parallel, default is 10
+    near_duplicate: optional
+        Similarity to a tweet in the data at which a tweet is rejected as a near
+        duplicate, None to only reject exact copies, default is 0.6
+    retrain_steps: optional
+        Number of fine-tuning steps each time the model is retrained, default is 100
+    filters: optional
+        Extra filters generated tweets must pass, such as LengthFilter or
+        PatternFilter, default is none
+    check_workers: optional
+        Most generated tweets whose links are checked at once, default is 8
+    check_deadline: optional
+        Seconds allowed to check a set of generated tweets, tweets still being
+        checked are rejected, None for no limit, default is 30
+    length: optional
+        Most tokens generated for each tweet, auto to fit the tweet length limit
+        based on the tokens per character of the training data, default is auto
 
     Attributes
     ----------
@@ -38,39 +127,111 @@ class Brain:
     username
         Twitter username of whom to base tweets on
     userid
-        Twitter user id of the username provided
+        Twitter user id of the username provided, None until warmed up
+    ready
+        threading.Event set once the brain is warmed up
     blocked
-        List of blocked terms
-    session
-        Gpt2 artificial intelligence session
+        Blocked term matcher, reloaded when the terms file changes
+    history
+        Record of earlier tweets, None if not kept
+    residency
+        Manager keeping the gpt2 artificial intelligence session loaded
+    generator
+        Worker processes generating tweets, None if generated in this process
     run_name
         Name of AI model training run
+    model_name
+        Name of the base GPT-2 model the training run is fine-tuned from
     tweets
-        List of tweets ready to be used
+        Buffer of tweets ready to be used
     newest_tweet
-        Tweet id of the most recent tweet fetched for data
+        Tweet id of the most recent tweet fetched for data, kept across runs
+    fetcher
+        Rate limit aware downloader for the user's tweets
+    corpus
+        Substring index over the training data
+    near_duplicates
+        Near duplicate index over the training data, None if not used
+    links
+        Link detector used to filter tweets
+    filters
+        Chain of checks generated tweets must pass, cheapest first
+    sizer
+        Controller for the number of tweets generated at once
+    retrainer
+        Background fine-tuning of the model on new twitter data
+    length
+        Most tokens generated for each tweet, auto if fit to the training data
 
     Methods
     -------
+    warmUp
+        Prepares the data and model and generates the first tweets
     getTweet
         Retrieves a single tweet, ready to post
+    refill
+        Generates tweets until the buffer is full
+    retrain
+        Fine-tunes the model further on new twitter data
     """
-    def __init__(self, client, username, blocked):
+    def __init__(self, client, username, blocked, history=None, pool=None, generator=None, run_name='run1',
+                 model_name='355M', intra_op_threads=0, inter_op_threads=0, whole_word=False, normalized=False,
+                 offline_links=False, link_deadline=5, idle_timeout=0, min_available=None, low_water=3,
+                 high_water=10, buffer_path=None, target_accepted=5, max_samples=40, max_batch_size=10,
+                 near_duplicate=0.6, retrain_steps=100, filters=(), check_workers=8, check_deadline=30,
+                 length='auto'):
         self.client = client
         self.username = username
-        self.userid = self.client.get_user(username=username).data['id']
-        self.tweets = []
-        self.blocked = []
-        if blocked is None:
-            logger.info('No block list path provided, continuing with no blocked terms')
-        elif os.path.isfile(blocked):
-            with open(blocked) as blist:
-                self.blocked = [term.rstrip() for term in blist.readlines()]
+        self.run_name = run_name
+        self.model_name = model_name
+        self._threads = (intra_op_threads, inter_op_threads)
+        if pool is None:
+            self.residency = ModelResidency(
+                self.run_name, idle_timeout=idle_timeout, min_available=min_available,
+                intra_op_threads=intra_op_threads, inter_op_threads=inter_op_threads
+            )
         else:
-            logger.error('Block list path not found, continuing with no blocked terms')
-
+            self.residency = pool.residency(self.run_name)
+        self.generator = generator
+        self.userid = None
+        self.ready = threading.Event()
+        self.fetcher = TimelineFetcher(client)
+        self.tweets = TweetBuffer(low_water=low_water, high_water=high_water, path=buffer_path)
+        self.blocked = Blocklist(blocked, whole_word=whole_word, normalized=normalized)
+        self.blocked.watch()
+        self.history = history
+        self.links = LinkResolver(offline=offline_links, deadline=link_deadline)
+        self.sizer = BatchSizer(target=target_accepted, max_samples=max_samples,
+                                max_batch_size=max_batch_size)
+        self.near_duplicate = near_duplicate
+        self.retrainer = Retrainer(self.run_name, model_name=model_name, steps=retrain_steps)
+        self.filters = FilterChain([
+            Filter('blocked', lambda tweet: not self._isBlockedTweet(tweet), cost=1),
+            Filter('repeat', lambda tweet: not self._isRepeatTweet(tweet), cost=5,
+                   batch=lambda tweets: [not repeat for repeat in self._areRepeatTweets(tweets)]),
+            Filter('unique', self._isUniqueTweet, cost=10),
+            Filter('link', lambda tweet: not self._hasLink(tweet), cost=100, concurrent=True),
+            *filters
+        ], workers=check_workers, deadline=check_deadline)
+        self.length = length
+        self._budget = None
+        self._indexes = threading.Lock()
+
+    def warmUp(self):
+        r"""Prepare the data and model and generate the first tweets.
+
+        Does nothing if the brain is already warmed up.
+        """
+        if self.ready.is_set():
+            return
+        with STARTUP.phase(f'{self.username} user lookup'):
+            self.userid = self.client.get_user(username=self.username).data['id']
         self._initializeModel()
-        self._generateTweetSet()
+        with STARTUP.phase(f'{self.username} first generation'):
+            if len(self.tweets) == 0:
+                self._generateTweetSet()
+        self.ready.set()
+        logger.info(f'Brain for @{self.username} ready')
 
     def getTweet(self):
         r"""Get a tweet.
@@ -79,17 +240,72 @@ class Brain:
         -------
         str
             Text ready to be sent as a tweet
+
+        Warning
+        -------
+        Generates tweets on the calling thread when the buffer is empty
         """
-        if len(self.tweets) == 0:
+        tweet = self.tweets.get()
+        while tweet is None:
             self._generateTweetSet()
-        return self.tweets.pop(0)
+            tweet = self.tweets.get()
+        BUFFERED_TWEETS.labels(user=self.username).set(len(self.tweets))
+        return tweet
+
+    def refill(self, max_rounds=5):
+        r"""Generate tweets until the buffer is full.
+
+        Parameters
+        ----------
+        max_rounds: optional
+            Most tweet sets generated in one refill, default is 5
+
+        Returns
+        -------
+        int
+            Number of tweets added to the buffer
+        """
+        added = 0
+        for _ in range(max_rounds):
+            if self.tweets.isFull():
+                break
+            added += len(self._generateTweetSet())
+        logger.info(f'Buffer refilled with {added} tweet(s), {len(self.tweets)} ready')
+        return added
+
+    def retrain(self):
+        r"""Fine-tune the model further on new twitter data.
+
+        Downloads tweets newer than the last download, then resumes training from
+        the current checkpoint in a background process. The new checkpoint is used
+        from the next generation on, generating carries on with the current one
+        until then.
+
+        Returns
+        -------
+        bool
+            True if a retrained model was swapped in, False if there was no new data
+
+        Warning
+        -------
+        Blocks until training finishes
+        """
+        self._getNewTwitterData()
+        with self._indexes:
+            self.corpus.sync()
+            if self.near_duplicates is not None:
+                self.near_duplicates.sync()
+        cache = DatasetCache(f'{self.username}.csv', model_name=self.retrainer.model_name)
+        dataset = cache.sync()
+        self._measureBudget(cache)
+        return self.retrainer.train(dataset, cache.key())
 
     def _generateTweetSet(self):
-        r"""Generate a set of about 10 tweets.
+        r"""Generate a set of tweets.
 
-        Attempts to generate a list of 10 tweets. If any of the generated tweets are
-        exactly the same text as a tweet from the data, it is not included. So the
-        list length may be less than 10.
+        Attempts to generate enough tweets to end up with the target number of
+        accepted tweets, based on the recent acceptance rate. Generated tweets that
+        fail the checks are not included. Accepted tweets are added to the buffer.
 
         Returns
         -------
@@ -98,68 +314,166 @@ class Brain:
 
         Warning
         -------
-        List size is not guaranteed to be exactly 10 due to not including certain generated text
+        List size is not guaranteed to match the target due to not including certain generated text
         """
-        self.tweets = []
-        tweet_list = self._generateN(10)
+        candidates = []
+        rejected = []
+        seen = set()
+        nsamples, batch_size = self.sizer.size()
+        tweet_list = self._generateN(nsamples, batch_size)
         for tweet in tweet_list:
             tweet = re.sub(r'<\|startoftext\|>', '', tweet)
-            if self._checkTweet(tweet):
-                self.tweets.append(tweet)
-        gpt2.reset_session(self.session)
-        self.session = None
+            key = normalizeText(tweet)
+            (rejected if key in seen else candidates).append(tweet)
+            seen.add(key)
+        with self._indexes:
+            verdicts = self.filters.evaluate(candidates)
+        accepted = [tweet for tweet, verdict in zip(candidates, verdicts) if verdict is None]
+        rejected.extend(tweet for tweet, verdict in zip(candidates, verdicts) if verdict is not None)
+        self.sizer.record(len(tweet_list), len(accepted))
+        if self.history is not None:
+            self.history.recordBatch(accepted, GENERATED)
+            self.history.recordBatch(rejected, REJECTED)
+        self.tweets.put(accepted)
+        GENERATED_TWEETS.labels(user=self.username).inc(len(tweet_list))
+        ACCEPTED_TWEETS.labels(user=self.username).inc(len(accepted))
+        ACCEPTANCE_RATE.labels(user=self.username).set(self.sizer.rate())
+        BUFFERED_TWEETS.labels(user=self.username).set(len(self.tweets))
+        return accepted
 
     def _initializeModel(self):
         r"""Check if a new AI model needs to be trained."""
-        self.session = None
-        self.run_name = 'run1'
-
-        if not os.path.isfile(f'{self.username}.csv'):
-            logger.info('Fetching new twitter data...')
+        logger.info('Fetching new twitter data...')
+        with STARTUP.phase(f'{self.username} download'):
             self._getNewTwitterData()
-            logger.info('Finished gathering twitter data')
+        logger.info('Finished gathering twitter data')
+
+        logger.info('Indexing twitter data...')
+        with STARTUP.phase(f'{self.username} indexing'):
+            self.corpus = CorpusIndex(f'{self.username}.csv')
+            self.corpus.sync()
+            self.near_duplicates = None
+            if self.near_duplicate is not None:
+                self.near_duplicates = MinHashIndex(f'{self.username}.csv', threshold=self.near_duplicate)
+                self.near_duplicates.sync()
 
         if not os.path.isdir(os.path.join('checkpoint', self.run_name)):
-            model_name = '355M'
             logger.info('Need to train a new model. This could take a while...')
+            with STARTUP.phase(f'{self.username} training'):
+                self._train(self.model_name)
+        else:
+            trained_from = checkpointModel(self.run_name)
+            if trained_from is not None and trained_from != self.model_name:
+                # Fine-tuning can only resume from the model the checkpoint has the shape of
+                logger.warning(
+                    f'Model {self.run_name} was trained from {trained_from}, not {self.model_name}, '
+                    f'use another run name to train from {self.model_name}'
+                )
+                self.model_name = self.retrainer.model_name = trained_from
+        if self.length == 'auto':
+            with STARTUP.phase(f'{self.username} token budget'):
+                self._measureBudget()
+        logger.info('Brain initialized')
+
+    def _measureBudget(self, cache=None):
+        r"""Fit the tokens generated for each tweet to the tweet length limit.
+
+        Tweets are cut to the limit before posting, so tokens generated past it are
+        wasted. The budget covers the limit at the tokens per character of the
+        training data, with some margin, plus the end marker.
+
+        Parameters
+        ----------
+        cache: optional
+            Synced dataset cache of the training data, default is None to sync one
+            with the encoder saved alongside the checkpoint
+        """
+        if self.length != 'auto':
+            return
+        if cache is None:
+            cache = DatasetCache(f'{self.username}.csv', model_name=self.run_name, model_dir='checkpoint')
+            try:
+                cache.sync()
+            except OSError as e:
+                logger.warning(f'Could not measure the twitter data, generating {DEFAULT_LENGTH} tokens per tweet')
+                logger.warning(e)
+                return
+        budget = cache.tokenBudget(TWEET_LENGTH)
+        if budget is not None:
+            self._budget = min(budget, MAX_LENGTH)
+            logger.info(f'Generating up to {self._budget} tokens per tweet')
+
+    def _sampleLength(self):
+        r"""Get the most tokens generated for each tweet.
+
+        Returns
+        -------
+        int
+            Fixed length, or the measured budget when fit to the training data
+        """
+        if self.length != 'auto':
+            return self.length
+        return DEFAULT_LENGTH if self._budget is None else self._budget
 
-            if not os.path.isdir(os.path.join('models', model_name)):
-                logger.info(f'Downloading {model_name} model...')
-                gpt2.download_gpt2(model_name=model_name)
+    def _train(self, model_name):
+        r"""Train a new model on the twitter data.
 
-            logger.info('Starting model training. Please be patient...')
-            self.session = gpt2.start_tf_sess()
-            gpt2.finetune(self.session, dataset=f'{self.username}.csv',
+        Parameters
+        ----------
+        model_name
+            Name of the base GPT-2 model to fine-tune
+        """
+        gpt2 = importGPT2()
+        if not os.path.isdir(os.path.join('models', model_name)):
+            logger.info(f'Downloading {model_name} model...')
+            gpt2.download_gpt2(model_name=model_name)
+
+        # Tweets are tokenized once and reused until the twitter data changes
+        cache = DatasetCache(f'{self.username}.csv', model_name=model_name)
+        dataset = cache.sync()
+
+        logger.info('Starting model training. Please be patient...')
+        session = newSession(*self._threads)
+        with session.graph.as_default():
+            gpt2.finetune(session, dataset=dataset,
                           steps=100, model_name=model_name,
                           restore_from='fresh', run_name=self.run_name,
                           save_every=50, print_every=10)
-            logger.info('Model training complete')
-        logger.info('Brain initialized')
+        self.retrainer.record(cache.key())
+        if self.generator is None:
+            # Trained session already holds the model, no need to load it again
+            self.residency.adopt(session)
+        else:
+            session.close()
+        logger.info('Model training complete')
 
-    def _generateN(self, num):
+    def _generateN(self, num, batch_size=1):
         r"""Generate a number of tweets based on the supplied parameter.
 
         Parameters
         ----------
         num
             Number of tweets to generate
+        batch_size: optional
+            Number of tweets generated in parallel, must divide num, default is 1
 
         Returns
         -------
         list
             List containing the generated text
         """
-        if self.session is None:
-            logger.info('Loading model...')
-            self.session = gpt2.start_tf_sess()
-            gpt2.load_gpt2(self.session, run_name=self.run_name)
-        logger.info(f'Generating {num} tweet(s)...')
-        return gpt2.generate(
-            self.session,
-            length=200, temperature=1.0, top_p=0.9,
+        options = dict(
+            length=self._sampleLength(), temperature=1.0, top_p=0.9,
             prefix='<|startoftext|>', truncate='<|endoftext|>',
-            nsamples=num, return_as_list=True
+            nsamples=num, batch_size=batch_size
         )
+        if self.generator is not None:
+            logger.info(f'Generating {num} tweet(s) in a worker...')
+            return self.generator.generate(self.run_name, **options)
+        gpt2 = importGPT2()
+        with self.residency.session() as session:
+            logger.info(f'Generating {num} tweet(s)...')
+            return gpt2.generate(session, return_as_list=True, **options)
 
     def _checkTweet(self, tweet):
         r"""Check if tweet is allowed.
@@ -174,11 +488,7 @@ class Brain:
         bool
             True if tweet passes all checks
         """
-        return all([
-            self._isUniqueTweet(tweet),
-            not self._isBlockedTweet(tweet),
-            not self._hasLink(tweet)
-        ])
+        return self.filters.check(tweet)
 
     def _isUniqueTweet(self, tweet):
         r"""Check if the generated text is in the training data.
@@ -191,14 +501,46 @@ class Brain:
         Returns
         -------
         bool
-            False if the text is in the training data, True otherwise
+            False if the text or a near duplicate of it is in the training data,
+            True otherwise
+        """
+        if self.corpus.contains(tweet):
+            return False
+        return self.near_duplicates is None or not self.near_duplicates.isNearDuplicate(tweet)
+
+    def _isRepeatTweet(self, tweet):
+        r"""Check if the generated text was already generated or posted.
+
+        Parameters
+        ----------
+        tweet
+            Text to check against the tweet history
+
+        Returns
+        -------
+        bool
+            True if the text is in the history as generated or posted
         """
-        clean = re.sub('"', '', tweet)
-        with open(f'{self.username}.csv') as db:
-            for line in db.readlines():
-                if clean in re.sub('"', '', line):
-                    return False
-        return True
+        if self.history is None:
+            return False
+        return self.history.contains(tweet, statuses=(GENERATED, POSTED))
+
+    def _areRepeatTweets(self, tweets):
+        r"""Check which of the generated texts were already generated or posted.
+
+        Parameters
+        ----------
+        tweets
+            List of texts to check against the tweet history
+
+        Returns
+        -------
+        list
+            True for each text in the history as generated or posted
+        """
+        if self.history is None:
+            return [False] * len(tweets)
+        return self.history.containsBatch(tweets, statuses=(GENERATED, POSTED))
 
     def _isBlockedTweet(self, tweet):
         r"""Check if tweet contains a blocked term.
@@ -213,10 +555,7 @@ class Brain:
         bool
             True if text contains a blocked term
         """
-        if self.blocked == []:
-            return False
-        low = tweet.lower()
-        return any([term for term in self.blocked if term in low])
+        return self.blocked.find(tweet) is not None
 
     def _hasLink(self, tweet):
         r"""Check if tweet contains a link.
@@ -231,61 +570,71 @@ class Brain:
         bool
             True if text contains a link
         """
-        links = re.findall(r'\S+\.\S+', tweet)
-        for link in links:
-            if not link.startswith('http'):
-                link = f'https://{link}'
-            try:
-                response = requests.get(link)
-                if response.ok:
-                    return True
-            except LocationParseError:
-                # LocationParseError thrown by urllib3 when link is invalid
-                # instead of requests.InvalidURL
-                pass
-        return False
+        return self.links.hasLink(tweet)
 
     def _getNewTwitterData(self):
-        r"""Set up csv writer to get tweet data."""
-        with open(f'{self.username}.csv', 'w', encoding='utf8') as f:
+        r"""Set up csv writer to get new tweet data.
+
+        Tweets newer than the last download are appended to the data file, skipping
+        any already in it. A download that was interrupted is resumed first.
+        """
+        path = f'{self.username}.csv'
+        state = SyncState(f'{self.username}.sync.json').load()
+        seen = set()
+        if os.path.isfile(path):
+            with open(path, encoding='utf8', newline='') as f:
+                seen.update(row[0] for row in csv.reader(f) if row)
+        else:
+            state.reset()
+            with open(path, 'w', encoding='utf8', newline='') as f:
+                csv.writer(f).writerow(['Tweets'])
+                seen.add('Tweets')
+
+        with open(path, 'a', encoding='utf8', newline='') as f:
             writer = csv.writer(f)
-            writer.writerow(['Tweets'])
-            self._downloadTweets(writer)
+            self._downloadTweets(writer, f, state, seen)
+        self.newest_tweet = state.newest_id
 
-    def _downloadTweets(self, writer):
+    def _downloadTweets(self, writer, f, state, seen):
         r"""Download and write tweet data to a file.
 
+        Each page is written and synced to disk before the download progress is
+        saved, so an interrupted download loses nothing.
+
         Parameters
         ----------
         writer
             csv writer used to add the data to the file
+        f
+            File the writer adds to
+        state
+            Download progress, updated after every page
+        seen
+            Set of tweet texts already in the file
         """
-        logger.info(f'Getting tweet data for user @{self.username}')
-
-        response = self.client.get_users_tweets(
-            self.userid, max_results=100,
-            exclude=['retweets', 'replies'],
-            start_time='2010-11-06T00:00:00Z',
-        )
-        for tweet in response.data:
-            text = self._cleanText(tweet['text'])
-            if text != '':
-                writer.writerow([text])
-
-        self.newest_tweet = response.meta['newest_id']
-
-        while response.meta['result_count'] >= 100:
-            sleep(2)
-            response = self.client.get_users_tweets(
-                self.userid, max_results=100,
-                exclude=['retweets', 'replies'],
-                start_time='2010-11-06T00:00:00Z',
-                pagination_token=response.meta['next_token']
-            )
-            for tweet in response.data:
+        if state.inProgress():
+            logger.info(f'Resuming tweet data download for user @{self.username}')
+            since_id = state.since_id
+        else:
+            since_id = state.begin()
+            if since_id is None:
+                logger.info(f'Getting tweet data for user @{self.username}')
+            else:
+                logger.info(f'Getting tweet data for user @{self.username} newer than {since_id}')
+
+        for page in self.fetcher.pages(self.userid, since_id, state.cursor):
+            added = 0
+            for tweet in page.data:
                 text = self._cleanText(tweet['text'])
-                if text != '':
+                if text != '' and text not in seen:
+                    seen.add(text)
                     writer.writerow([text])
+                    added += 1
+            f.flush()
+            os.fsync(f.fileno())
+            logger.debug(f'Added {added} tweet(s) from page')
+            state.advance(page.meta.get('newest_id'), page.meta.get('next_token'))
+        state.complete()
 
     def _cleanText(self, text):
         r"""Remove unwanted text from downloaded data.
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+r"""Module for buffering tweets ready to be posted.
+
+Classes
+-------
+TweetBuffer
+    Queue of tweets ready to be posted with refill marks
+"""
+import os
+import logging
+import json
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class TweetBuffer:
+    r"""Queue of tweets ready to be posted with refill marks.
+
+    Tweets are added by the generation side and taken by the posting side, which
+    may run on different threads.
+
+    When given a path, every change is also appended to a log file that is
+    replayed on creation, so generated tweets survive a restart. Writes reach the
+    operating system right away and are synced to disk in the background at most
+    once per sync interval, and the log is rewritten with only the buffered tweets
+    once it holds enough stale records. A record cut short by a crash is dropped.
+
+    Parameters
+    ----------
+    low_water: optional
+        Number of tweets below which the buffer needs refilling, default is 3
+    high_water: optional
+        Number of tweets a refill aims for, default is 10
+    path: optional
+        Path to the log file keeping the buffer across restarts, default is None
+        to only keep it in memory
+    sync_interval: optional
+        Most seconds between syncs of the log to disk, default is 1
+    compact_after: optional
+        Number of records in the log after which it is rewritten, default is 1000
+
+    Attributes
+    ----------
+    low_water
+        Number of tweets below which the buffer needs refilling
+    high_water
+        Number of tweets a refill aims for
+    path
+        Path to the log file, None if the buffer is only kept in memory
+
+    Methods
+    -------
+    put
+        Add tweets to the end of the buffer
+    get
+        Take the oldest tweet from the buffer
+    prune
+        Remove the tweets matching a condition
+    isLow
+        Check if the buffer needs refilling
+    isFull
+        Check if the buffer has reached the refill target
+    flush
+        Sync the log to disk
+    close
+        Stop background syncing and close the log
+    """
+    def __init__(self, low_water=3, high_water=10, path=None, sync_interval=1, compact_after=1000):
+        if low_water > high_water:
+            raise ValueError('low water mark is above high water mark')
+        self.low_water = low_water
+        self.high_water = high_water
+        self.path = path
+        self.compact_after = compact_after
+        self._tweets = deque()
+        self._lock = threading.Lock()
+        self._log = None
+        self._records = 0
+        self._dirty = False
+        self._stopped = threading.Event()
+        self._syncer = None
+        if path is not None:
+            self._replay()
+            self._compact()
+            if self._tweets:
+                logger.info(f'Resumed {len(self._tweets)} tweet(s) from {path}')
+            self._syncer = threading.Thread(
+                target=self._sync, args=(sync_interval,), name='buffer-sync', daemon=True
+            )
+            self._syncer.start()
+
+    def __len__(self):
+        return len(self._tweets)
+
+    def __iter__(self):
+        return iter(list(self._tweets))
+
+    def put(self, tweets):
+        r"""Add tweets to the end of the buffer.
+
+        Parameters
+        ----------
+        tweets
+            List of tweets to add
+        """
+        with self._lock:
+            self._tweets.extend(tweets)
+            self._append(''.join(f'+{json.dumps(tweet)}\n' for tweet in tweets))
+
+    def get(self):
+        r"""Take the oldest tweet from the buffer.
+
+        Returns
+        -------
+        str or None
+            Oldest tweet, None if the buffer is empty
+        """
+        with self._lock:
+            try:
+                tweet = self._tweets.popleft()
+            except IndexError:
+                return None
+            self._append('-\n')
+        return tweet
+
+    def prune(self, condition):
+        r"""Remove the tweets matching a condition.
+
+        Parameters
+        ----------
+        condition
+            Function taking the position and text of a tweet and returning True if
+            it is removed
+
+        Returns
+        -------
+        int
+            Number of tweets removed
+        """
+        with self._lock:
+            kept = deque(tweet for index, tweet in enumerate(self._tweets) if not condition(index, tweet))
+            removed = len(self._tweets) - len(kept)
+            self._tweets = kept
+            if removed and self.path is not None:
+                self._compact()
+        return removed
+
+    def isLow(self):
+        r"""Check if the buffer needs refilling.
+
+        Returns
+        -------
+        bool
+            True if the buffer is below the low water mark
+        """
+        return len(self._tweets) < self.low_water
+
+    def isFull(self):
+        r"""Check if the buffer has reached the refill target.
+
+        Returns
+        -------
+        bool
+            True if the buffer is at or above the high water mark
+        """
+        return len(self._tweets) >= self.high_water
+
+    def flush(self):
+        r"""Sync the log to disk."""
+        with self._lock:
+            if self._log is not None and self._dirty:
+                self._log.flush()
+                os.fsync(self._log.fileno())
+                self._dirty = False
+
+    def close(self):
+        r"""Stop background syncing and close the log."""
+        self._stopped.set()
+        if self._syncer is not None:
+            self._syncer.join()
+            self._syncer = None
+        self.flush()
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+    def _append(self, records):
+        r"""Write records to the end of the log.
+
+        Parameters
+        ----------
+        records
+            Lines to write, each ending in a line break
+        """
+        if self._log is None:
+            return
+        self._log.write(records)
+        self._log.flush()
+        self._dirty = True
+        self._records += records.count('\n')
+        if self._records >= self.compact_after:
+            self._compact()
+
+    def _replay(self):
+        r"""Rebuild the buffer from the log, dropping a record cut short by a crash."""
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, encoding='utf8') as f:
+            for number, line in enumerate(f, 1):
+                try:
+                    if not line.endswith('\n'):
+                        raise ValueError('record is incomplete')
+                    if line == '-\n':
+                        self._tweets.popleft()
+                    elif line.startswith('+'):
+                        self._tweets.append(json.loads(line[1:]))
+                    else:
+                        raise ValueError('record is not recognized')
+                except (ValueError, IndexError) as e:
+                    logger.warning(f'Ignoring the rest of {self.path} from line {number}: {e}')
+                    break
+
+    def _compact(self):
+        r"""Rewrite the log with only the buffered tweets."""
+        if self._log is not None:
+            self._log.close()
+        with open(f'{self.path}.tmp', 'w', encoding='utf8') as f:
+            f.write(''.join(f'+{json.dumps(tweet)}\n' for tweet in self._tweets))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f'{self.path}.tmp', self.path)
+        self._log = open(self.path, 'a', encoding='utf8')
+        self._records = len(self._tweets)
+        self._dirty = False
+
+    def _sync(self, interval):
+        r"""Sync the log to disk after changes.
+
+        Parameters
+        ----------
+        interval
+            Seconds between syncs
+        """
+        while not self._stopped.wait(interval):
+            try:
+                self.flush()
+            except OSError as e:
+                logger.error(f'Failed to sync tweet buffer: {e}')
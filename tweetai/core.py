@@ -8,12 +8,14 @@ TweetAI
 """
 import logging
 import asyncio
-from datetime import datetime, timedelta
 
 import tweepy
 
 from .brain import Brain
+from .history import TweetHistory
+from .host import TweetHost
 from .mouth import Mouth
+from .outbox import Outbox
 
 __all__ = ['TweetAI']
 
@@ -23,6 +25,9 @@ logger = logging.getLogger(__name__)
 class TweetAI:
     r"""Tweet generating bot that learns from a Twitter user.
 
+    Creating a bot does no network or model work, its brain is warmed up in the
+    background once it runs.
+
     Parameters
     ----------
     auth
@@ -33,6 +38,13 @@ class TweetAI:
         Path to a list of blocked terms
     enabled: optional
         True if bot is allowed to post tweets, default is False
+    options: optional
+        dictionary of additional brain options, see:options section
+    pool: optional
+        Session pool shared with other bots in the same process, default is None
+    generator: optional
+        GenerationPool generating tweets in worker processes, default is None to
+        generate in this process
 
     Auth
     ----
@@ -47,6 +59,59 @@ class TweetAI:
     access_secret
         OAuth access token secret for bot
 
+    Options
+    -------
+    run_name
+        Name of the AI model training run, default is run1
+    model_name
+        Name of the base GPT-2 model a new training run is fine-tuned from, such as
+        124M or 355M
+    intra_op_threads
+        Threads running the work of a single TensorFlow operation, 0 to let
+        TensorFlow decide
+    inter_op_threads
+        TensorFlow operations run at once, 0 to let TensorFlow decide
+    whole_word
+        True if blocked terms only match whole words
+    normalized
+        True if unicode is normalized before matching blocked terms
+    offline_links
+        True if links are detected by their shape only with no requests
+    link_deadline
+        Seconds allowed to check all links in a tweet
+    idle_timeout
+        Seconds the model is kept loaded after generating, None to keep it loaded,
+        ignored when a pool is provided
+    min_available
+        Megabytes of available memory below which the model is unloaded, ignored
+        when a pool is provided
+    low_water
+        Number of ready tweets below which the buffer is refilled in the background
+    high_water
+        Number of ready tweets a refill aims for
+    target_accepted
+        Number of accepted tweets wanted from each generation
+    max_samples
+        Most tweets generated at once
+    max_batch_size
+        Most tweets generated in parallel
+    near_duplicate
+        Similarity to a tweet in the data at which a tweet is rejected, None to disable
+    post_limit
+        Most tweets posted in a window, None for no limit
+    post_window
+        Seconds of the posting limit window
+    retrain_steps
+        Number of fine-tuning steps each time the model is retrained
+    filters
+        Extra filters generated tweets must pass, such as LengthFilter
+    check_workers
+        Most generated tweets whose links are checked at once
+    check_deadline
+        Seconds allowed to check a set of generated tweets, None for no limit
+    length
+        Most tokens generated for each tweet, auto to fit the tweet length limit
+
     Attributes
     ----------
     username
@@ -55,13 +120,55 @@ class TweetAI:
         AI processing and text generating instance
     mouth
         Tweet processing and posting instance
+    history
+        Record of generated, rejected and posted tweets
+    outbox
+        Queue of tweets waiting to be posted
+    loop
+        Event loop the bot runs on
 
     Raises
     ------
     ValueError
         API tokens or user was not provided on creation
     """
-    def __init__(self, *, auth, user, blocked=None, enabled=False):
+    def __init__(self, *, auth, user, blocked=None, enabled=False, options=None, pool=None, generator=None):
+        self.validate(auth, user)
+
+        self.username = user
+        client = tweepy.Client(
+            bearer_token=auth['bearer_token'],
+            consumer_key=auth['consumer_key'],
+            consumer_secret=auth['consumer_secret'],
+            access_token=auth['access_token'],
+            access_token_secret=auth['access_secret']
+        )
+        self.history = TweetHistory(f'{self.username}.db')
+        self.history.compact()
+        options = dict(options or {})
+        posting = {key: options.pop(key) for key in ('post_limit', 'post_window') if key in options}
+        self.outbox = Outbox(f'{self.username}.outbox.db')
+        self.brain = Brain(client, self.username, blocked, self.history, pool=pool,
+                           generator=generator, buffer_path=f'{self.username}.buffer', **options)
+        self.mouth = Mouth(client, enabled, self.history, self.outbox, **posting)
+        self.loop = asyncio.get_event_loop()
+
+    @staticmethod
+    def validate(auth, user):
+        r"""Check that the auth and user needed to create a bot are provided.
+
+        Parameters
+        ----------
+        auth
+            dictionary containing all the required auth tokens and secrets
+        user
+            Twitter username to read tweets from
+
+        Raises
+        ------
+        ValueError
+            API tokens or user was not provided
+        """
         if not auth['bearer_token']:
             logger.critical('No bearer token was provided!')
             raise ValueError('no bearer token provided')
@@ -75,55 +182,14 @@ class TweetAI:
             logger.critical('User was not provided!')
             raise ValueError('no user provided')
 
-        self.username = user
-        client = tweepy.Client(
-            bearer_token=auth['bearer_token'],
-            consumer_key=auth['consumer_key'],
-            consumer_secret=auth['consumer_secret'],
-            access_token=auth['access_token'],
-            access_token_secret=auth['access_secret']
-        )
-        self.brain = Brain(client, self.username, blocked)
-        self.mouth = Mouth(client, enabled)
-        self.loop = asyncio.get_event_loop()
-
-    def run(self):
+    def run(self, **kwargs):
         r"""Begin execution of the bot.
 
         Starts generating and posting tweets occasionally.
+
+        Parameters
+        ----------
+        kwargs: optional
+            Posting schedule, metrics and control API options passed on to TweetHost
         """
-        self._running = True
-        self.loop.create_task(self._tweet())
-        try:
-            logger.info('Executing main event loop')
-            self.loop.run_forever()
-        except KeyboardInterrupt:
-            logger.info('Keyboard interrupt detected')
-        finally:
-            logger.info('Stopping tasks now')
-            self._running = False
-            tasks = asyncio.all_tasks(self.loop)
-            for task in tasks:
-                task.cancel()
-            self.loop.run_until_complete(asyncio.gather(*tasks))
-            self.loop.stop()
-        self.loop.close()
-
-    async def _tweet(self):
-        r"""Tweet task method.
-
-        Controls the timed posting of tweets.
-        """
-        while self._running:
-            now = datetime.now()
-            next_time = now + (datetime.min - now) % timedelta(hours=2)
-            if next_time.hour % 2 == 1:
-                # Adjust to get back on even hour cycle
-                next_time.hour = next_time.hour - 1
-            try:
-                await asyncio.sleep((next_time - now).seconds)
-                tweet = self.brain.getTweet()
-                self.mouth.sendTweet(tweet)
-                await asyncio.sleep(1)
-            except asyncio.CancelledError:
-                logger.warning('Task cancelled: _tweet')
+        TweetHost([self], loop=self.loop, **kwargs).run()
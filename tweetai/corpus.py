@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+r"""Module for indexing the training corpus.
+
+Classes
+-------
+CorpusIndex
+    Persistent substring index over the cleaned training data
+
+Functions
+---------
+readAppended
+    Read the complete lines added to a data file since an earlier read
+"""
+import os
+import logging
+import json
+import hashlib
+import mmap
+import re
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Byte that never appears in utf-8 encoded text, used to keep matches inside one line
+SEPARATOR = b'\xff'
+
+
+def readAppended(path, offset, digest):
+    r"""Read the complete lines added to a data file since an earlier read.
+
+    The part of the file read before is checked against its digest. If it no longer
+    matches, the file was rewritten rather than appended to and is read from the
+    start. A partial last line is left for the next read.
+
+    Parameters
+    ----------
+    path
+        Path to the data file
+    offset
+        Number of bytes read before
+    digest
+        Sha1 hex digest of the bytes read before
+
+    Returns
+    -------
+    tuple
+        True if the file was only appended to, the new bytes, the new offset and the
+        digest of everything up to the new offset
+    """
+    size = os.path.getsize(path)
+    prefix = hashlib.sha1()
+    with open(path, 'rb') as data:
+        remaining = offset if offset <= size else 0
+        while remaining > 0:
+            chunk = data.read(min(remaining, 1 << 20))
+            if not chunk:
+                break
+            prefix.update(chunk)
+            remaining -= len(chunk)
+        appended = offset <= size and prefix.hexdigest() == digest
+        if not appended:
+            offset = 0
+            prefix = hashlib.sha1()
+        data.seek(offset)
+        tail = data.read()
+    end = tail.rfind(b'\n') + 1
+    tail = tail[:end]
+    prefix.update(tail)
+    return appended, tail, offset + end, prefix.hexdigest()
+
+
+class CorpusIndex:
+    r"""Persistent substring index over the cleaned training data.
+
+    The index is made of segments, each holding the cleaned text of a range of lines
+    from the data file and a suffix array over that text. Both are stored in a
+    directory beside the data file and memory mapped when in use. New lines appended
+    to the data file are indexed as a new segment, so the full corpus is only indexed
+    once.
+
+    Parameters
+    ----------
+    path
+        Path to the csv file containing the training data
+    max_segments: optional
+        Number of segments allowed before they are merged into one, default is 8
+
+    Attributes
+    ----------
+    path
+        Path to the csv file containing the training data
+    directory
+        Path to the directory holding the index files
+    max_segments
+        Number of segments allowed before they are merged into one
+
+    Methods
+    -------
+    sync
+        Bring the index up to date with the data file
+    contains
+        Check if text is contained in any line of the data
+    close
+        Release the memory mapped index files
+    """
+    def __init__(self, path, max_segments=8):
+        self.path = path
+        self.directory = f'{path}.idx'
+        self.max_segments = max_segments
+        self._manifest = {'offset': 0, 'digest': hashlib.sha1().hexdigest(), 'segments': []}
+        self._segments = []
+
+    def sync(self):
+        r"""Bring the index up to date with the data file.
+
+        Lines appended since the last sync are indexed as a new segment. If the data
+        file was rewritten instead of appended to, the whole index is rebuilt.
+        """
+        self._loadManifest()
+        appended, tail, offset, digest = readAppended(
+            self.path, self._manifest['offset'], self._manifest['digest']
+        )
+        if not appended:
+            logger.info('Training data changed, rebuilding corpus index')
+            self._reset()
+        if tail:
+            self._addSegment(tail)
+        self._manifest['offset'] = offset
+        self._manifest['digest'] = digest
+
+        if len(self._manifest['segments']) > self.max_segments:
+            logger.info('Merging corpus index segments')
+            self._reset()
+            self.sync()
+            return
+
+        self._saveManifest()
+        self._openSegments()
+
+    def contains(self, text):
+        r"""Check if text is contained in any line of the data.
+
+        Parameters
+        ----------
+        text
+            Text to look for, quotes are ignored the same way as in the data
+
+        Returns
+        -------
+        bool
+            True if the text appears in a line of the data
+        """
+        pattern = re.sub('"', '', text).encode('utf8')
+        if b'\n' in pattern:
+            return False
+        return any(self._search(text_map, suffixes, pattern) for text_map, suffixes in self._segments)
+
+    def close(self):
+        r"""Release the memory mapped index files."""
+        for text_map, suffixes in self._segments:
+            suffixes.release()
+            text_map.close()
+        self._segments = []
+
+    def _search(self, text_map, suffixes, pattern):
+        r"""Binary search a suffix array for a pattern.
+
+        Parameters
+        ----------
+        text_map
+            Memory mapped segment text
+        suffixes
+            Suffix array of the segment text
+        pattern
+            Encoded text to look for
+
+        Returns
+        -------
+        bool
+            True if a suffix of the segment starts with the pattern
+        """
+        length = len(pattern)
+        low, high = 0, len(suffixes)
+        while low < high:
+            mid = (low + high) // 2
+            start = suffixes[mid]
+            if text_map[start:start + length] < pattern:
+                low = mid + 1
+            else:
+                high = mid
+        if low == len(suffixes):
+            return False
+        start = suffixes[low]
+        return text_map[start:start + length] == pattern
+
+    def _addSegment(self, raw):
+        r"""Index a block of lines from the data file as a new segment.
+
+        Parameters
+        ----------
+        raw
+            Bytes read from the data file, ending on a line break
+        """
+        lines = raw.decode('utf8', errors='replace').split('\n')
+        text = SEPARATOR.join(re.sub('"', '', line).encode('utf8') for line in lines if line)
+        text += SEPARATOR
+        suffixes = _suffixArray(text)
+
+        name = f'seg{len(self._manifest["segments"]):04d}'
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, f'{name}.txt'), 'wb') as f:
+            f.write(text)
+        with open(os.path.join(self.directory, f'{name}.sa'), 'wb') as f:
+            suffixes.tofile(f)
+        self._manifest['segments'].append(name)
+
+    def _openSegments(self):
+        r"""Memory map the text and suffix array of every segment."""
+        self.close()
+        for name in self._manifest['segments']:
+            with open(os.path.join(self.directory, f'{name}.txt'), 'rb') as f:
+                text_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            with open(os.path.join(self.directory, f'{name}.sa'), 'rb') as f:
+                sa_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._segments.append((text_map, memoryview(sa_map).cast('I')))
+
+    def _loadManifest(self):
+        r"""Read the index manifest if one exists."""
+        manifest = os.path.join(self.directory, 'manifest.json')
+        if os.path.isfile(manifest):
+            with open(manifest) as f:
+                self._manifest = json.load(f)
+
+    def _saveManifest(self):
+        r"""Write the index manifest."""
+        os.makedirs(self.directory, exist_ok=True)
+        manifest = os.path.join(self.directory, 'manifest.json')
+        with open(f'{manifest}.tmp', 'w') as f:
+            json.dump(self._manifest, f)
+        os.replace(f'{manifest}.tmp', manifest)
+
+    def _reset(self):
+        r"""Remove all index segments."""
+        self.close()
+        for name in self._manifest['segments']:
+            for ext in ('txt', 'sa'):
+                try:
+                    os.remove(os.path.join(self.directory, f'{name}.{ext}'))
+                except FileNotFoundError:
+                    pass
+        self._manifest = {'offset': 0, 'digest': hashlib.sha1().hexdigest(), 'segments': []}
+        self._saveManifest()
+
+
+def _suffixArray(text):
+    r"""Build the suffix array of a byte string by prefix doubling.
+
+    Each round sorts the suffixes by the rank pairs of their first two halves with
+    numpy, so a corpus of tens of thousands of tweets is indexed in a second or two.
+
+    Parameters
+    ----------
+    text
+        Bytes to index
+
+    Returns
+    -------
+    numpy.ndarray
+        Start offsets of every suffix of the text in sorted order, as uint32
+    """
+    size = len(text)
+    if size == 0:
+        return np.zeros(0, dtype=np.uint32)
+    rank = np.frombuffer(text, dtype=np.uint8).astype(np.int64)
+    base = max(size, 256) + 1
+    step = 1
+    while True:
+        # Rank pairs are packed into one key, ranks stay below the base so they cannot mix
+        keys = rank * base
+        if step < size:
+            keys[:size - step] += rank[step:] + 1
+        suffixes = np.argsort(keys)
+        ordered = keys[suffixes]
+        rank = np.empty(size, dtype=np.int64)
+        rank[suffixes] = np.concatenate(([0], np.cumsum(ordered[1:] != ordered[:-1])))
+        if rank[suffixes[-1]] == size - 1:
+            break
+        step *= 2
+    return suffixes.astype(np.uint32)
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+r"""Module for preparing the training dataset.
+
+Classes
+-------
+DatasetCache
+    Pre-tokenized, content addressed cache of the training data
+"""
+import os
+import logging
+import csv
+import math
+import hashlib
+import io
+import json
+
+import numpy as np
+
+from .corpus import readAppended
+from .history import normalizeText
+from .residency import importGPT2
+
+logger = logging.getLogger(__name__)
+
+START_TOKEN = '<|startoftext|>'
+END_TOKEN = '<|endoftext|>'
+
+# Bump when the cleaning, encoding or manifest changes so old caches are rebuilt
+VERSION = 2
+
+
+class DatasetCache:
+    r"""Pre-tokenized, content addressed cache of the training data.
+
+    Each tweet in the data file is cleaned, deduplicated and BPE encoded once,
+    wrapped in the same start and end tokens gpt_2_simple uses for csv files. The
+    tokens are appended to a flat array beside the data file, so new tweets only
+    cost encoding themselves. Training reads an npz file named after a hash of the
+    cleaned tweets, so an unchanged corpus reuses the same file and the same
+    corpus always gives the same training input.
+
+    Parameters
+    ----------
+    path
+        Path to the csv file containing the training data
+    model_name: optional
+        Name of the downloaded GPT-2 model whose encoder is used, default is 355M
+    model_dir: optional
+        Directory the models are downloaded to, default is models
+
+    Attributes
+    ----------
+    path
+        Path to the csv file containing the training data
+    directory
+        Directory holding the cache files
+    model_name
+        Name of the GPT-2 model whose encoder is used
+    model_dir
+        Directory the models are downloaded to
+
+    Methods
+    -------
+    sync
+        Encode new tweets and get the dataset file for training
+    key
+        Get the content hash of the cleaned tweets
+    tokenBudget
+        Get the number of tokens a sample of some length likely takes
+    """
+    def __init__(self, path, model_name='355M', model_dir='models'):
+        self.path = path
+        self.directory = f'{path}.dataset'
+        self.model_name = model_name
+        self.model_dir = model_dir
+        self._encoder = None
+        self._manifest = self._emptyManifest()
+
+    def __len__(self):
+        return self._manifest['tokens']
+
+    def key(self):
+        r"""Get the content hash of the cleaned tweets.
+
+        Returns
+        -------
+        str
+            Hex digest identifying the cleaned, deduplicated tweets in order
+        """
+        return self._manifest['key']
+
+    def tokenBudget(self, characters, margin=1.15):
+        r"""Get the number of tokens a sample of some length likely takes.
+
+        Based on the ratio of tokens to characters in the encoded tweets, plus the
+        tokens of the end marker the model writes after a tweet.
+
+        Parameters
+        ----------
+        characters
+            Number of characters of the sample
+        margin: optional
+            Factor allowing for samples denser than the average tweet, default is 1.15
+
+        Returns
+        -------
+        int or None
+            Number of tokens, None if nothing is encoded yet
+        """
+        if not self._manifest['characters']:
+            return None
+        ratio = self._manifest['text_tokens'] / self._manifest['characters']
+        return math.ceil(characters * ratio * margin) + self._manifest['end_tokens']
+
+    def sync(self):
+        r"""Encode new tweets and get the dataset file for training.
+
+        Tweets appended to the data file since the last sync are encoded and added.
+        If the data file was rewritten, every tweet is encoded again.
+
+        Returns
+        -------
+        str
+            Path to the npz file of tokens for the current data
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        manifest_path = os.path.join(self.directory, 'manifest.json')
+        tokens_path = os.path.join(self.directory, 'tokens.bin')
+        if os.path.isfile(manifest_path) and os.path.isfile(tokens_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            if manifest['version'] == VERSION and os.path.getsize(tokens_path) >= manifest['tokens'] * 2:
+                self._manifest = manifest
+
+        appended, tail, offset, digest = readAppended(
+            self.path, self._manifest['offset'], self._manifest['digest']
+        )
+        if not appended:
+            logger.info('Training data changed, encoding the whole dataset')
+            self._manifest = self._emptyManifest()
+        seen = self._seen() if appended else set()
+
+        key = self._manifest['key']
+        tokens = []
+        added = characters = 0
+        for text in self._rows(tail, skip_header=self._manifest['offset'] == 0):
+            normalized = normalizeText(text)
+            if not normalized or normalized in seen:
+                continue
+            seen.add(normalized)
+            # Chained per tweet so the key does not depend on how syncs were split
+            key = hashlib.sha1(f'{key}\n{text}'.encode('utf8')).hexdigest()
+            tokens.extend(self._encode(f'{START_TOKEN}{text}{END_TOKEN}\n'))
+            characters += len(text)
+            added += 1
+        if added:
+            # Markers are plain text to the encoder, their tokens are left out of the ratio
+            markers = len(self._encode(f'{START_TOKEN}{END_TOKEN}\n'))
+            self._manifest['end_tokens'] = len(self._encode(END_TOKEN))
+            self._manifest['text_tokens'] += len(tokens) - added * markers
+            self._manifest['characters'] += characters
+
+        with open(tokens_path, 'r+b' if appended and os.path.isfile(tokens_path) else 'wb') as f:
+            f.seek(self._manifest['tokens'] * 2)
+            np.asarray(tokens, dtype=np.uint16).tofile(f)
+            f.truncate()
+        if added:
+            logger.info(f'Encoded {added} new tweet(s) into {len(tokens)} token(s)')
+        self._manifest.update(offset=offset, digest=digest, key=key, tokens=self._manifest['tokens'] + len(tokens))
+        with open(f'{manifest_path}.tmp', 'w') as f:
+            json.dump(self._manifest, f)
+        os.replace(f'{manifest_path}.tmp', manifest_path)
+        return self._export(tokens_path)
+
+    def _export(self, tokens_path):
+        r"""Write the npz file for the current data if it does not exist yet.
+
+        Parameters
+        ----------
+        tokens_path
+            Path to the flat token array
+
+        Returns
+        -------
+        str
+            Path to the npz file named after the content hash
+        """
+        npz_path = os.path.join(self.directory, f'{self.key()}.npz')
+        if not os.path.isfile(npz_path):
+            tokens = np.fromfile(tokens_path, dtype=np.uint16, count=len(self))
+            with open(f'{npz_path}.tmp', 'wb') as f:
+                np.savez_compressed(f, tokens=tokens.astype(np.int32))
+            os.replace(f'{npz_path}.tmp', npz_path)
+            logger.info(f'Dataset {self.key()} written with {len(self)} token(s)')
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz') and name != os.path.basename(npz_path):
+                os.remove(os.path.join(self.directory, name))
+        return npz_path
+
+    def _rows(self, data, skip_header):
+        r"""Parse tweets from csv bytes.
+
+        Parameters
+        ----------
+        data
+            Complete csv lines
+        skip_header: optional
+            True if the first row is the header
+
+        Returns
+        -------
+        list
+            Stripped text of each row
+        """
+        reader = csv.reader(io.StringIO(data.decode('utf8', errors='replace'), newline=''))
+        if skip_header:
+            next(reader, None)
+        return [' '.join(row[0].split()) for row in reader if row]
+
+    def _seen(self):
+        r"""Get the normalized tweets already encoded.
+
+        Returns
+        -------
+        set
+            Normalized text of the tweets before the synced offset
+        """
+        with open(self.path, 'rb') as f:
+            data = f.read(self._manifest['offset'])
+        return {normalizeText(text) for text in self._rows(data, skip_header=True)}
+
+    def _encode(self, text):
+        r"""BPE encode text with the model's encoder.
+
+        Parameters
+        ----------
+        text
+            Text to encode
+
+        Returns
+        -------
+        list
+            Token ids
+        """
+        if self._encoder is None:
+            importGPT2()
+            from gpt_2_simple.src import encoder
+            self._encoder = encoder.get_encoder(os.path.join(self.model_dir, self.model_name))
+        return self._encoder.encode(text)
+
+    def _emptyManifest(self):
+        r"""Get the manifest of an empty cache.
+
+        Returns
+        -------
+        dict
+            Manifest with nothing encoded
+        """
+        return {
+            'version': VERSION, 'offset': 0, 'digest': hashlib.sha1().hexdigest(),
+            'tokens': 0, 'key': hashlib.sha1(f'tweetai-dataset-{VERSION}'.encode('ascii')).hexdigest(),
+            'characters': 0, 'text_tokens': 0, 'end_tokens': 0,
+        }
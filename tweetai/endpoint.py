@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+r"""Module for serving local HTTP requests on the event loop.
+
+Classes
+-------
+Endpoint
+    Minimal asyncio HTTP server with a table of routes
+"""
+import logging
+import asyncio
+import hmac
+from urllib.parse import parse_qsl
+
+logger = logging.getLogger(__name__)
+
+# Methods that only read, requests with any other method are checked before they are handled
+SAFE_METHODS = frozenset(('GET', 'HEAD'))
+
+REASONS = {
+    200: 'OK', 202: 'Accepted', 400: 'Bad Request', 401: 'Unauthorized', 403: 'Forbidden',
+    404: 'Not Found', 405: 'Method Not Allowed', 409: 'Conflict', 413: 'Payload Too Large',
+    429: 'Too Many Requests', 500: 'Internal Server Error', 503: 'Service Unavailable',
+}
+
+
+class _TooLarge(ValueError):
+    r"""Request body is over the size allowed."""
+
+
+class Endpoint:
+    r"""Minimal asyncio HTTP server with a table of routes.
+
+    Only meant to be bound to a local address. Each request is answered and the
+    connection closed, which is all a metrics scraper or an operator's curl needs.
+    A request must be read in full within the timeout and its body may not be over
+    the size allowed, so slow or idle clients cannot hold connections open.
+
+    Requests that change state, any method but GET and HEAD, are refused with 403
+    when they carry an Origin header, so a web page open in a local browser cannot
+    send them. When a token is set they are refused with 401 unless they carry it
+    in an 'Authorization: Bearer' header.
+
+    Parameters
+    ----------
+    host: optional
+        Address to listen on, default is 127.0.0.1
+    port: optional
+        Port to listen on, default is 9100
+    token: optional
+        Token requests that change state must carry, default is None to not need one
+    timeout: optional
+        Seconds allowed to read a whole request, default is 10
+    max_body: optional
+        Most bytes allowed in a request body, default is 65536
+
+    Attributes
+    ----------
+    host
+        Address listened on
+    port
+        Port listened on
+    timeout
+        Seconds allowed to read a whole request
+    max_body
+        Most bytes allowed in a request body
+
+    Methods
+    -------
+    route
+        Add a handler for a method and path
+    start
+        Start listening
+    stop
+        Stop listening
+    """
+    def __init__(self, host='127.0.0.1', port=9100, token=None, timeout=10, max_body=65536):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.max_body = max_body
+        self._token = token
+        self._routes = {}
+        self._server = None
+
+    def route(self, method, path, handler):
+        r"""Add a handler for a method and path.
+
+        Parameters
+        ----------
+        method
+            HTTP method such as 'GET'
+        path
+            Path without the query string
+        handler
+            Function or coroutine function taking the query dictionary and request
+            body, returning a tuple of status code, content type and body text
+        """
+        self._routes[(method.upper(), path)] = handler
+
+    async def start(self):
+        r"""Start listening."""
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f'Listening on http://{self.host}:{self.port}')
+
+    async def stop(self):
+        r"""Stop listening."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        r"""Answer one request.
+
+        Parameters
+        ----------
+        reader
+            Stream to read the request from
+        writer
+            Stream to write the response to
+        """
+        try:
+            method, target, headers, body = await asyncio.wait_for(self._read(reader), self.timeout)
+        except _TooLarge:
+            status, content_type, text = 413, 'text/plain', 'request body too large\n'
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+            status, content_type, text = 400, 'text/plain', 'bad request\n'
+        else:
+            path, _, query = target.partition('?')
+            refusal = self._refuse(method, headers)
+            if refusal is not None:
+                status, content_type, text = refusal
+            else:
+                status, content_type, text = await self._dispatch(method, path, _parseQuery(query), body)
+        data = text.encode('utf8')
+        writer.write(
+            f'HTTP/1.1 {status} {REASONS.get(status, "")}\r\n'
+            f'Content-Type: {content_type}; charset=utf-8\r\n'
+            f'Content-Length: {len(data)}\r\nConnection: close\r\n\r\n'.encode('latin1') + data
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def _read(self, reader):
+        r"""Read one request.
+
+        Parameters
+        ----------
+        reader
+            Stream to read the request from
+
+        Returns
+        -------
+        tuple
+            Uppercase method, request target, dictionary of headers with lowercase
+            names and body bytes
+
+        Raises
+        ------
+        ValueError
+            If the request is malformed or its body is over the size allowed
+        asyncio.IncompleteReadError
+            If the connection closed before the whole body was sent
+        """
+        request = await reader.readline()
+        method, target, _ = request.decode('latin1').split(' ', 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length', 0))
+        if length < 0:
+            raise ValueError(f'invalid content length: {length}')
+        if length > self.max_body:
+            raise _TooLarge(f'request body of {length} bytes')
+        body = await reader.readexactly(length) if length else b''
+        return method.upper(), target, headers, body
+
+    def _refuse(self, method, headers):
+        r"""Check a request may change state.
+
+        Parameters
+        ----------
+        method
+            HTTP method
+        headers
+            Dictionary of request headers with lowercase names
+
+        Returns
+        -------
+        tuple or None
+            Status code, content type and body text to refuse the request with, None
+            if it may be handled
+        """
+        if method in SAFE_METHODS:
+            return None
+        if 'origin' in headers:
+            logger.warning(f'Refused {method} request sent from {headers["origin"]}')
+            return 403, 'text/plain', 'requests from web pages are not allowed\n'
+        if self._token is not None:
+            scheme, _, token = headers.get('authorization', '').partition(' ')
+            if scheme.lower() != 'bearer' or not hmac.compare_digest(token.strip().encode(), self._token.encode()):
+                return 401, 'text/plain', 'missing or wrong token\n'
+        return None
+
+    async def _dispatch(self, method, path, query, body):
+        r"""Call the handler of a request.
+
+        Parameters
+        ----------
+        method
+            HTTP method
+        path
+            Request path
+        query
+            Dictionary of query parameters
+        body
+            Request body bytes
+
+        Returns
+        -------
+        tuple
+            Status code, content type and body text
+        """
+        handler = self._routes.get((method, path))
+        if handler is None:
+            if any(route_path == path for _, route_path in self._routes):
+                return 405, 'text/plain', 'method not allowed\n'
+            return 404, 'text/plain', 'not found\n'
+        try:
+            result = handler(query, body)
+            if asyncio.iscoroutine(result):
+                result = await result
+            return result
+        except Exception as e:
+            logger.error(f'Request to {path} failed with exception')
+            logger.error(e)
+            return 500, 'text/plain', 'internal error\n'
+
+
+def _parseQuery(query):
+    r"""Parse a query string.
+
+    Parameters
+    ----------
+    query
+        Query string without the '?'
+
+    Returns
+    -------
+    dict
+        Last value of each parameter
+    """
+    return dict(parse_qsl(query))
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+r"""Module for downloading a user's timeline.
+
+Classes
+-------
+Page
+    One page of a user's tweets
+TimelineFetcher
+    Rate limit aware, retrying timeline downloader
+"""
+import copy
+import logging
+import random
+from collections import namedtuple
+from time import monotonic, sleep, time
+
+import requests
+import tweepy
+
+from .metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+PAGE_SECONDS = REGISTRY.histogram('tweetai_fetch_page_seconds', 'Seconds taken by each timeline request')
+FETCH_RETRIES = REGISTRY.counter('tweetai_fetch_retries_total', 'Timeline requests retried', ['reason'])
+FETCHED_TWEETS = REGISTRY.counter('tweetai_fetched_tweets_total', 'Tweets downloaded')
+
+Page = namedtuple('Page', ['data', 'meta'])
+Page.__doc__ = r"""One page of a user's tweets.
+
+Attributes
+----------
+data
+    List of tweets on the page, each with a 'text' field
+meta
+    Dictionary of page info such as 'newest_id' and 'next_token'
+"""
+
+
+class TimelineFetcher:
+    r"""Rate limit aware, retrying timeline downloader.
+
+    Requests are spaced out using the rate limit headers of the previous response so
+    the remaining quota lasts until it resets. A rate limited request waits for the
+    reset and transient failures are retried with jittered exponential backoff.
+
+    Parameters
+    ----------
+    client
+        Tweepy client instance, copied so responses include their headers
+    min_interval: optional
+        Fewest seconds between requests, default is 1
+    max_retries: optional
+        Number of times a failed request is retried, default is 5
+    backoff: optional
+        Base seconds for the retry backoff, default is 2
+    max_backoff: optional
+        Most seconds waited between retries, default is 900
+    clock: optional
+        Monotonic clock function, default is time.monotonic
+    sleeper: optional
+        Sleep function, default is time.sleep
+
+    Attributes
+    ----------
+    client
+        Tweepy client used for requests
+    min_interval
+        Fewest seconds between requests
+    max_retries
+        Number of times a failed request is retried
+    backoff
+        Base seconds for the retry backoff
+    max_backoff
+        Most seconds waited between retries
+
+    Methods
+    -------
+    pages
+        Iterate over the pages of a user's tweets
+    fetch
+        Fetch one page of a user's tweets
+    """
+    def __init__(self, client, min_interval=1, max_retries=5, backoff=2, max_backoff=900,
+                 clock=monotonic, sleeper=sleep):
+        self.client = copy.copy(client)
+        self.client.return_type = requests.Response
+        self.min_interval = min_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._clock = clock
+        self._sleep = sleeper
+        self._next_request = clock()
+
+    def pages(self, userid, since_id=None, cursor=None):
+        r"""Iterate over the pages of a user's tweets.
+
+        Parameters
+        ----------
+        userid
+            Twitter user id to fetch tweets of
+        since_id: optional
+            Id to fetch tweets newer than, default is None to fetch the whole timeline
+        cursor: optional
+            Pagination token to start from, default is None for the first page
+
+        Yields
+        ------
+        Page
+            Each page in order, newest tweets first
+        """
+        while True:
+            page = self.fetch(userid, since_id, cursor)
+            yield page
+            cursor = page.meta.get('next_token')
+            if cursor is None:
+                return
+
+    def fetch(self, userid, since_id=None, cursor=None):
+        r"""Fetch one page of a user's tweets.
+
+        Parameters
+        ----------
+        userid
+            Twitter user id to fetch tweets of
+        since_id: optional
+            Id to fetch tweets newer than, default is None to fetch the whole timeline
+        cursor: optional
+            Pagination token of the page, default is None for the first page
+
+        Returns
+        -------
+        Page
+            Tweets and pagination info of the page
+
+        Raises
+        ------
+        tweepy.TweepyException
+            Request failed with a non transient error or ran out of retries
+        """
+        params = {}
+        if since_id is None:
+            params['start_time'] = '2010-11-06T00:00:00Z'
+        else:
+            params['since_id'] = since_id
+        if cursor is not None:
+            params['pagination_token'] = cursor
+
+        attempt = 0
+        while True:
+            self._wait()
+            try:
+                with PAGE_SECONDS.time():
+                    response = self.client.get_users_tweets(
+                        userid, max_results=100,
+                        exclude=['retweets', 'replies'],
+                        **params
+                    )
+            except tweepy.TooManyRequests as e:
+                if attempt >= self.max_retries:
+                    raise
+                FETCH_RETRIES.labels(reason='rate_limited').inc()
+                self._schedule(e.response.headers)
+                logger.warning('Rate limited while fetching tweets, waiting for reset')
+                self._retryLater(attempt)
+            except (tweepy.TwitterServerError, requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.max_retries:
+                    raise
+                FETCH_RETRIES.labels(reason='error').inc()
+                logger.warning(f'Transient error while fetching tweets: {e}')
+                self._retryLater(attempt)
+            else:
+                page = self._page(response)
+                FETCHED_TWEETS.inc(len(page.data))
+                return page
+            attempt += 1
+
+    def _page(self, response):
+        r"""Convert a response into a page and schedule the next request.
+
+        Parameters
+        ----------
+        response
+            requests.Response or tweepy.Response returned by the client
+
+        Returns
+        -------
+        Page
+            Tweets and pagination info of the response
+        """
+        if isinstance(response, requests.Response):
+            self._schedule(response.headers)
+            body = response.json()
+            return Page(body.get('data') or [], body.get('meta', {}))
+        self._schedule({})
+        return Page(response.data or [], response.meta)
+
+    def _schedule(self, headers):
+        r"""Set the time of the next request from rate limit headers.
+
+        Parameters
+        ----------
+        headers
+            Response headers, may be missing the rate limit fields
+        """
+        now = self._clock()
+        delay = self.min_interval
+        try:
+            remaining = int(headers['x-rate-limit-remaining'])
+            until_reset = max(float(headers['x-rate-limit-reset']) - time(), 0)
+        except (KeyError, TypeError, ValueError):
+            pass
+        else:
+            if remaining <= 0:
+                delay = until_reset + 1
+            else:
+                delay = max(until_reset / remaining, self.min_interval)
+        self._next_request = now + delay
+
+    def _retryLater(self, attempt):
+        r"""Push back the next request with jittered exponential backoff.
+
+        Parameters
+        ----------
+        attempt
+            Number of retries made so far
+        """
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        self._next_request = max(self._next_request, self._clock() + delay)
+
+    def _wait(self):
+        r"""Sleep until the next request is allowed."""
+        delay = self._next_request - self._clock()
+        if delay > 0:
+            logger.debug(f'Waiting {delay:.1f}s before next request')
+            self._sleep(delay)
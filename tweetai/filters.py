@@ -0,0 +1,486 @@
+# -*- coding: utf-8 -*-
+r"""Module for checking generated tweets before they are used.
+
+Classes
+-------
+Filter
+    Named check candidate tweets must pass
+LengthFilter
+    Filter rejecting tweets outside a length range
+PatternFilter
+    Filter rejecting tweets matching any banned pattern
+FilterChain
+    Cost ordered, short circuiting chain of filters
+"""
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from time import monotonic, perf_counter
+
+from .metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+FILTER_SECONDS = REGISTRY.histogram('tweetai_filter_seconds', 'Seconds taken by each tweet check', ['filter'])
+FILTER_REJECTIONS = REGISTRY.counter('tweetai_filter_rejections_total', 'Tweets failing each check', ['filter'])
+FILTER_EXPIRED = REGISTRY.counter(
+    'tweetai_filter_expired_total', 'Tweets rejected for reaching the batch deadline at each check', ['filter']
+)
+FILTER_ERRORS = REGISTRY.counter(
+    'tweetai_filter_errors_total', 'Tweets rejected because a check raised an exception', ['filter']
+)
+
+# Verdict of tweets still being checked when the batch deadline passed
+DEADLINE = 'deadline'
+# Verdict of tweets a check raised an exception on
+ERROR = 'error'
+
+
+class Filter:
+    r"""Named check candidate tweets must pass.
+
+    Parameters
+    ----------
+    name
+        Name of the filter in the statistics and metrics
+    check
+        Function taking a tweet and returning True if it passes
+    cost: optional
+        Estimated relative cost of checking a tweet, cheaper filters run first,
+        default is 1
+    batch: optional
+        Function taking a list of tweets and returning a list of results, for checks
+        that are cheaper done together, default is None to check each tweet in turn
+    concurrent: optional
+        True if the check mostly waits, such as on network requests, so a batch is
+        checked one tweet per thread at once, default is False
+
+    Attributes
+    ----------
+    name
+        Name of the filter
+    cost
+        Estimated relative cost of checking a tweet
+    concurrent
+        True if a batch is checked one tweet per thread at once
+
+    Methods
+    -------
+    check
+        Check if a tweet passes
+    checkBatch
+        Check which of several tweets pass
+    """
+    def __init__(self, name, check=None, cost=1, batch=None, concurrent=False):
+        self.name = name
+        self.cost = cost
+        self.concurrent = concurrent
+        self._check = check
+        self._batch = batch
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.name!r}, cost={self.cost})'
+
+    def check(self, tweet):
+        r"""Check if a tweet passes.
+
+        Parameters
+        ----------
+        tweet
+            Text to check
+
+        Returns
+        -------
+        bool
+            True if the tweet passes
+        """
+        return self._check(tweet)
+
+    def checkBatch(self, tweets):
+        r"""Check which of several tweets pass.
+
+        Parameters
+        ----------
+        tweets
+            List of texts to check
+
+        Returns
+        -------
+        list
+            True for each tweet that passes
+        """
+        if self._batch is not None:
+            return list(self._batch(tweets))
+        return [self.check(tweet) for tweet in tweets]
+
+
+class LengthFilter(Filter):
+    r"""Filter rejecting tweets outside a length range.
+
+    Parameters
+    ----------
+    max_length: optional
+        Most characters allowed, default is 279
+    min_length: optional
+        Fewest characters allowed, default is 1
+    name: optional
+        Name of the filter, default is length
+    cost: optional
+        Estimated relative cost of checking a tweet, default is 0.1
+    """
+    def __init__(self, max_length=279, min_length=1, name='length', cost=0.1):
+        super().__init__(name, cost=cost)
+        self.max_length = max_length
+        self.min_length = min_length
+
+    def check(self, tweet):
+        return self.min_length <= len(tweet.strip()) <= self.max_length
+
+
+class PatternFilter(Filter):
+    r"""Filter rejecting tweets matching any banned pattern.
+
+    Parameters
+    ----------
+    patterns
+        Regular expressions a tweet must not match
+    flags: optional
+        Regular expression flags, default is to ignore case
+    name: optional
+        Name of the filter, default is pattern
+    cost: optional
+        Estimated relative cost of checking a tweet, default is 0.5
+
+    Methods
+    -------
+    fromFile
+        Create a filter from a file of patterns
+    """
+    def __init__(self, patterns, flags=re.IGNORECASE, name='pattern', cost=0.5):
+        super().__init__(name, cost=cost)
+        patterns = list(patterns)
+        self.patterns = patterns
+        self._regex = re.compile('|'.join(f'(?:{pattern})' for pattern in patterns), flags) if patterns else None
+
+    @classmethod
+    def fromFile(cls, path, **kwargs):
+        r"""Create a filter from a file of patterns.
+
+        Parameters
+        ----------
+        path
+            Path to a file with one regular expression per line, blank lines and
+            lines starting with # are ignored
+        kwargs: optional
+            Options passed on to PatternFilter
+
+        Returns
+        -------
+        PatternFilter
+            Filter with the patterns of the file
+        """
+        with open(path, encoding='utf8') as f:
+            patterns = [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+        return cls(patterns, **kwargs)
+
+    def check(self, tweet):
+        return self._regex is None or self._regex.search(tweet) is None
+
+
+class FilterChain:
+    r"""Cost ordered, short circuiting chain of filters.
+
+    Filters run cheapest first and a tweet stops at the first filter it fails, so
+    expensive checks such as link lookups only see tweets every cheaper check
+    passed. Batches are checked one filter at a time over the tweets still passing,
+    letting filters check them together. Concurrent filters check the tweets of a
+    batch at once on a bounded pool of threads, and tweets still being checked when
+    the batch deadline passes are rejected. A check raising an exception rejects
+    only the tweet it was checking, and a batch check that raises is retried one
+    tweet at a time.
+
+    Parameters
+    ----------
+    filters: optional
+        Filters to check tweets with, default is none
+    workers: optional
+        Most tweets checked at once by concurrent filters, default is 8
+    deadline: optional
+        Seconds allowed to check a batch, default is None for no limit
+
+    Attributes
+    ----------
+    filters
+        Filters in the order they run
+    workers
+        Most tweets checked at once by concurrent filters
+    deadline
+        Seconds allowed to check a batch
+
+    Methods
+    -------
+    add
+        Add a filter
+    remove
+        Remove a filter by name
+    check
+        Check if a tweet passes every filter
+    evaluate
+        Find the filter each of several tweets fails
+    report
+        Get the statistics of each filter
+    close
+        Stop the threads of concurrent filters
+    """
+    def __init__(self, filters=(), workers=8, deadline=None):
+        self.filters = []
+        self.workers = workers
+        self.deadline = deadline
+        self._stats = {}
+        self._executor = None
+        self._lock = threading.Lock()
+        for item in filters:
+            self.add(item)
+
+    def __len__(self):
+        return len(self.filters)
+
+    def __iter__(self):
+        return iter(list(self.filters))
+
+    def add(self, item):
+        r"""Add a filter.
+
+        Parameters
+        ----------
+        item
+            Filter to add, filters of the same cost run in the order added
+
+        Raises
+        ------
+        ValueError
+            If a filter of the same name is already in the chain
+        """
+        with self._lock:
+            if item.name in self._stats:
+                raise ValueError(f'filter already in chain: {item.name}')
+            # Sorting is stable, so equal costs keep the order they were added in
+            self.filters = sorted([*self.filters, item], key=lambda other: other.cost)
+            self._stats[item.name] = {'checked': 0, 'rejected': 0, 'expired': 0, 'errors': 0, 'seconds': 0.0}
+
+    def remove(self, name):
+        r"""Remove a filter by name.
+
+        Parameters
+        ----------
+        name
+            Name of the filter to remove
+
+        Raises
+        ------
+        KeyError
+            If no filter has the name
+        """
+        with self._lock:
+            if name not in self._stats:
+                raise KeyError(name)
+            self.filters = [item for item in self.filters if item.name != name]
+            del self._stats[name]
+
+    def check(self, tweet):
+        r"""Check if a tweet passes every filter.
+
+        Parameters
+        ----------
+        tweet
+            Text to check
+
+        Returns
+        -------
+        bool
+            True if the tweet passes
+        """
+        return self.evaluate([tweet])[0] is None
+
+    def evaluate(self, tweets, deadline=None):
+        r"""Find the filter each of several tweets fails.
+
+        Parameters
+        ----------
+        tweets
+            List of texts to check
+        deadline: optional
+            Seconds allowed to check the tweets, default is the chain's deadline
+
+        Returns
+        -------
+        list
+            Name of the first filter each tweet failed, DEADLINE for tweets still
+            being checked at the deadline, ERROR for tweets a check raised an
+            exception on, None for tweets passing every filter
+        """
+        deadline = self.deadline if deadline is None else deadline
+        end = None if deadline is None else monotonic() + deadline
+        verdicts = [None] * len(tweets)
+        pending = list(range(len(tweets)))
+        for item in self.filters:
+            if not pending:
+                break
+            batch = [tweets[index] for index in pending]
+            start = perf_counter()
+            if end is not None and monotonic() >= end:
+                results = [None] * len(batch)
+            elif item.concurrent:
+                results = self._checkConcurrently(item, batch, end)
+            else:
+                results = self._checkSerially(item, batch)
+            elapsed = perf_counter() - start
+            passing = []
+            rejected = expired = errors = 0
+            for index, passed in zip(pending, results):
+                if passed is None:
+                    verdicts[index] = DEADLINE
+                    expired += 1
+                elif passed is ERROR:
+                    verdicts[index] = ERROR
+                    errors += 1
+                elif passed:
+                    passing.append(index)
+                else:
+                    verdicts[index] = item.name
+                    rejected += 1
+            self._record(item, len(pending), rejected, expired, errors, elapsed)
+            pending = passing
+        return verdicts
+
+    def report(self):
+        r"""Get the statistics of each filter.
+
+        Returns
+        -------
+        dict
+            Tweets checked, rejected, expired at the deadline and failed with an
+            exception and seconds taken by each filter, in the order the filters run
+        """
+        with self._lock:
+            return {item.name: dict(self._stats[item.name]) for item in self.filters}
+
+    def close(self):
+        r"""Stop the threads of concurrent filters."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _checkSerially(self, item, tweets):
+        r"""Check tweets with a filter in turn.
+
+        Parameters
+        ----------
+        item
+            Filter to check with
+        tweets
+            List of texts to check
+
+        Returns
+        -------
+        list
+            True for each tweet that passes, ERROR for tweets the check raised an
+            exception on
+        """
+        try:
+            return item.checkBatch(tweets)
+        except Exception as e:
+            logger.warning(f'Filter {item.name} failed on a batch, checking each tweet: {e}')
+        return [self._checkOne(item, tweet) for tweet in tweets]
+
+    def _checkOne(self, item, tweet):
+        r"""Check a tweet with a filter, turning an exception into a verdict.
+
+        Parameters
+        ----------
+        item
+            Filter to check with
+        tweet
+            Text to check
+
+        Returns
+        -------
+        bool or str
+            True if the tweet passes, ERROR if the check raised an exception
+        """
+        try:
+            return item.check(tweet)
+        except Exception as e:
+            logger.error(f'Filter {item.name} failed with exception')
+            logger.error(e)
+            return ERROR
+
+    def _checkConcurrently(self, item, tweets, end):
+        r"""Check tweets with a filter at once on the chain's threads.
+
+        Parameters
+        ----------
+        item
+            Filter to check with
+        tweets
+            List of texts to check
+        end
+            Monotonic time of the deadline, None for no deadline
+
+        Returns
+        -------
+        list
+            True for each tweet that passes, None for tweets not checked by the
+            deadline, ERROR for tweets the check raised an exception on
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='filter')
+            executor = self._executor
+        futures = [executor.submit(self._checkOne, item, tweet) for tweet in tweets]
+        wait(futures, timeout=None if end is None else max(end - monotonic(), 0))
+        results = []
+        for future in futures:
+            if future.done():
+                results.append(future.result())
+            else:
+                # Checks already running finish in the background, their results are dropped
+                future.cancel()
+                results.append(None)
+        return results
+
+    def _record(self, item, checked, rejected, expired, errors, elapsed):
+        r"""Record the outcome of running a filter.
+
+        Parameters
+        ----------
+        item
+            Filter that was run
+        checked
+            Number of tweets checked
+        rejected
+            Number of tweets failing
+        expired
+            Number of tweets not checked by the deadline
+        errors
+            Number of tweets the check raised an exception on
+        elapsed
+            Seconds taken
+        """
+        with self._lock:
+            stats = self._stats.get(item.name)
+            if stats is not None:
+                stats['checked'] += checked
+                stats['rejected'] += rejected
+                stats['expired'] += expired
+                stats['errors'] += errors
+                stats['seconds'] += elapsed
+        FILTER_SECONDS.labels(filter=item.name).observe(elapsed / checked, count=checked)
+        if rejected:
+            FILTER_REJECTIONS.labels(filter=item.name).inc(rejected)
+        if expired:
+            FILTER_EXPIRED.labels(filter=item.name).inc(expired)
+        if errors:
+            FILTER_ERRORS.labels(filter=item.name).inc(errors)
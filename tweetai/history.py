@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+r"""Module for storing the history of generated tweets.
+
+Classes
+-------
+TweetHistory
+    SQLite backed record of generated, rejected and posted tweets
+
+Functions
+---------
+normalizeText
+    Reduce text to the form used to detect duplicates
+"""
+import logging
+import hashlib
+import re
+import sqlite3
+import threading
+from time import time
+from unicodedata import normalize
+
+logger = logging.getLogger(__name__)
+
+GENERATED = 'generated'
+REJECTED = 'rejected'
+POSTED = 'posted'
+
+DAY = 86400
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tweets (
+    id INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL,
+    status TEXT NOT NULL,
+    text TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tweets_hash ON tweets (hash, status);
+CREATE INDEX IF NOT EXISTS tweets_status_created ON tweets (status, created);
+"""
+
+
+def normalizeText(text):
+    r"""Reduce text to the form used to detect duplicates.
+
+    Unicode is normalized and case folded, punctuation is dropped and whitespace
+    is collapsed, so tweets differing only in those count as the same.
+
+    Parameters
+    ----------
+    text
+        Text to normalize
+
+    Returns
+    -------
+    str
+        Normalized text
+    """
+    text = normalize('NFKC', text).casefold()
+    return ' '.join(re.sub(r'[^\w\s]', '', text).split())
+
+
+class TweetHistory:
+    r"""SQLite backed record of generated, rejected and posted tweets.
+
+    Every tweet is stored with a hash of its normalized text, indexed so checking
+    a tweet against the history is a single lookup. Old entries are removed by the
+    retention policy when compacting.
+
+    Parameters
+    ----------
+    path
+        Path to the database file
+    retention: optional
+        Dictionary of days each status is kept, a status that is missing or None is
+        kept forever, default keeps generated for 90 days, rejected for 14 days and
+        posted forever
+    max_rows: optional
+        Most generated and rejected tweets kept, oldest are removed first, default
+        is 100000
+
+    Attributes
+    ----------
+    path
+        Path to the database file
+    retention
+        Dictionary of days each status is kept
+    max_rows
+        Most generated and rejected tweets kept
+
+    Methods
+    -------
+    record
+        Record a single tweet
+    recordBatch
+        Record a list of tweets with the same status
+    contains
+        Check if a tweet is in the history
+    containsBatch
+        Check which of several tweets are in the history
+    counts
+        Count the tweets of each status
+    compact
+        Apply the retention policy and reclaim free space
+    close
+        Close the database
+    """
+    def __init__(self, path, retention=None, max_rows=100000):
+        self.path = path
+        self.retention = {GENERATED: 90, REJECTED: 14, POSTED: None} if retention is None else retention
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            # Must be set before any table exists for incremental vacuum to work
+            self._db.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            self._db.execute('PRAGMA journal_mode = WAL')
+            self._db.executescript(SCHEMA)
+
+    def record(self, text, status):
+        r"""Record a single tweet.
+
+        Parameters
+        ----------
+        text
+            Tweet text
+        status
+            One of 'generated', 'rejected' or 'posted'
+        """
+        self.recordBatch([text], status)
+
+    def recordBatch(self, texts, status):
+        r"""Record a list of tweets with the same status.
+
+        Parameters
+        ----------
+        texts
+            List of tweet texts
+        status
+            One of 'generated', 'rejected' or 'posted'
+
+        Raises
+        ------
+        ValueError
+            Status is not a valid status
+        """
+        if status not in (GENERATED, REJECTED, POSTED):
+            raise ValueError(f'invalid tweet status: {status}')
+        now = time()
+        rows = [(_hash(text), status, text, now) for text in texts]
+        with self._lock, self._db:
+            self._db.executemany(
+                'INSERT INTO tweets (hash, status, text, created) VALUES (?, ?, ?, ?)', rows
+            )
+
+    def contains(self, text, statuses=(POSTED,)):
+        r"""Check if a tweet is in the history.
+
+        Parameters
+        ----------
+        text
+            Tweet text, compared by its normalized form
+        statuses: optional
+            Statuses to look in, default is only posted tweets
+
+        Returns
+        -------
+        bool
+            True if a tweet with the same normalized text has one of the statuses
+        """
+        marks = ', '.join('?' * len(statuses))
+        with self._lock:
+            row = self._db.execute(
+                f'SELECT 1 FROM tweets WHERE hash = ? AND status IN ({marks}) LIMIT 1',
+                (_hash(text), *statuses)
+            ).fetchone()
+        return row is not None
+
+    def containsBatch(self, texts, statuses=(POSTED,)):
+        r"""Check which of several tweets are in the history.
+
+        Parameters
+        ----------
+        texts
+            Tweet texts, compared by their normalized form
+        statuses: optional
+            Statuses to look in, default is only posted tweets
+
+        Returns
+        -------
+        list
+            True for each text with the same normalized text in the history with
+            one of the statuses
+        """
+        hashes = [_hash(text) for text in texts]
+        marks = ', '.join('?' * len(statuses))
+        found = set()
+        with self._lock:
+            for start in range(0, len(hashes), 500):
+                chunk = hashes[start:start + 500]
+                found.update(row[0] for row in self._db.execute(
+                    f'SELECT hash FROM tweets WHERE hash IN ({", ".join("?" * len(chunk))}) '
+                    f'AND status IN ({marks})',
+                    (*chunk, *statuses)
+                ))
+        return [digest in found for digest in hashes]
+
+    def counts(self):
+        r"""Count the tweets of each status.
+
+        Returns
+        -------
+        dict
+            Number of tweets stored for each status
+        """
+        with self._lock:
+            rows = self._db.execute('SELECT status, COUNT(*) FROM tweets GROUP BY status').fetchall()
+        return dict(rows)
+
+    def compact(self):
+        r"""Apply the retention policy and reclaim free space.
+
+        Returns
+        -------
+        int
+            Number of tweets removed
+        """
+        now = time()
+        removed = 0
+        with self._lock, self._db:
+            for status, days in self.retention.items():
+                if days is None:
+                    continue
+                removed += self._db.execute(
+                    'DELETE FROM tweets WHERE status = ? AND created < ?', (status, now - days * DAY)
+                ).rowcount
+            if self.max_rows is not None:
+                removed += self._db.execute(
+                    'DELETE FROM tweets WHERE status != ? AND id NOT IN ('
+                    'SELECT id FROM tweets WHERE status != ? ORDER BY id DESC LIMIT ?)',
+                    (POSTED, POSTED, self.max_rows)
+                ).rowcount
+        with self._lock:
+            # The pragma frees one page per step and execute only steps statements without
+            # result columns once, a script is stepped until it is done
+            self._db.executescript('PRAGMA incremental_vacuum;')
+        if removed:
+            logger.info(f'Removed {removed} tweet(s) from history')
+        return removed
+
+    def close(self):
+        r"""Close the database."""
+        with self._lock:
+            self._db.close()
+
+
+def _hash(text):
+    r"""Hash the normalized form of a text.
+
+    Parameters
+    ----------
+    text
+        Text to hash
+
+    Returns
+    -------
+    str
+        Hex digest of the normalized text
+    """
+    return hashlib.sha1(normalizeText(text).encode('utf8')).hexdigest()
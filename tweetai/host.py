@@ -0,0 +1,562 @@
+# -*- coding: utf-8 -*-
+r"""Module for running bots on an event loop.
+
+Classes
+-------
+TweetHost
+    Event loop host running one or more bots
+"""
+import logging
+import asyncio
+import functools
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from .endpoint import Endpoint
+from .metrics import REGISTRY
+from .scheduler import Cron, Interval, Job, Scheduler, ONCE, SKIP
+from .startup import STARTUP
+
+__all__ = ['TweetHost']
+
+logger = logging.getLogger(__name__)
+
+
+class TweetHost:
+    r"""Event loop host running one or more bots.
+
+    The loop is live as soon as it runs, and the bots' brains are warmed up one at a
+    time in the background. A bot is ready once its brain is warmed up, and posting
+    and generation skip bots that are not ready yet.
+
+    Every bot gets its own posting job on a shared scheduler and its own task
+    delivering queued tweets. Tweet generation runs
+    on a shared pool of worker threads, handing out one generation round at a time to bots with a low
+    buffer in round robin order so no bot starves the others.
+
+    An optional local control API reports the state of each bot at GET /status.
+    POST /generate refills a bot's buffer with up to ?rounds=N tweet sets and POST
+    /post queues its next buffered tweet, while POST /pause and /resume stop and
+    start its generation and posting, so it can be drained or warmed up during a
+    deploy. Requests name the bot with ?bot=username, which can be left out when
+    there is only one. Background refills, generation requests and posts waiting
+    on an empty buffer take their slot from the same pool of worker slots, and
+    generation requests are turned away with 429 while the bot is already
+    generating or every slot is taken, so inference jobs never queue up behind each
+    other. POST requests sent from a web page are refused, and with a token set
+    they must carry it as a bearer token.
+
+    Parameters
+    ----------
+    bots
+        List of TweetAI instances to run
+    loop: optional
+        Event loop to run on, default is the current event loop
+    workers: optional
+        Number of generation rounds run at once, default is 1
+    schedule: optional
+        Interval or Cron deciding when each bot posts, default is every even hour
+    jitter: optional
+        Most random seconds added to each posting time, default is 0
+    catchup: optional
+        What to do with posts missed while the loop was busy or asleep, see Job,
+        default is 'once'
+    scheduler: optional
+        Scheduler to run the posting jobs on, default is a new scheduler
+    metrics_port: optional
+        Local port metrics are served on in the Prometheus text format at /metrics,
+        with liveness at /live and readiness at /ready, default is None to not serve
+        them
+    snapshot: optional
+        Path of a JSON file metrics are periodically written to, default is None
+    snapshot_interval: optional
+        Seconds between metrics snapshots, default is 60
+    retrain: optional
+        Interval or Cron deciding when each bot's model is retrained on new tweets,
+        default is None to not retrain
+    compact: optional
+        Interval or Cron deciding when each bot's tweet history is compacted,
+        default is every day at 4am
+    admin_port: optional
+        Local port the control API is served on, default is None to not serve it
+    admin_token: optional
+        Token POST requests to the control API must carry in an 'Authorization:
+        Bearer' header, default is None to not need one
+
+    Attributes
+    ----------
+    bots
+        List of TweetAI instances being run
+    loop
+        Event loop the bots run on
+    workers
+        Number of generation rounds run at once
+    executor
+        Executor running tweet generation off the event loop
+    scheduler
+        Scheduler running the posting jobs
+    endpoint
+        Local HTTP endpoint serving metrics and health checks, None if not served
+    admin
+        Local HTTP endpoint serving the control API, None if not served
+
+    Methods
+    -------
+    run
+        Begin execution of the bots
+    isReady
+        Check if every bot is ready
+    """
+    def __init__(self, bots, loop=None, workers=1, schedule=None, jitter=0, catchup=ONCE, scheduler=None,
+                 metrics_port=None, snapshot=None, snapshot_interval=60, retrain=None, compact=None,
+                 admin_port=None, admin_token=None):
+        if not bots:
+            raise ValueError('no bots provided')
+        self.bots = list(bots)
+        self.loop = asyncio.get_event_loop() if loop is None else loop
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='brain')
+        # Warming up can mean hours of training, so it never holds up the generation workers
+        self._warmer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='warmup')
+        self.scheduler = Scheduler() if scheduler is None else scheduler
+        schedule = Cron('0 */2 * * *') if schedule is None else schedule
+        compact = Cron('0 4 * * *') if compact is None else compact
+        for bot in self.bots:
+            self.scheduler.add(Job(
+                f'post @{bot.username}', schedule, functools.partial(self._tweet, bot),
+                jitter=jitter, catchup=catchup
+            ))
+            if retrain is not None:
+                self.scheduler.add(Job(
+                    f'retrain @{bot.username}', retrain, functools.partial(self._retrain, bot), catchup=SKIP
+                ))
+            self.scheduler.add(Job(
+                f'compact @{bot.username}', compact, functools.partial(self._compact, bot), catchup=SKIP
+            ))
+        if snapshot is not None:
+            self.scheduler.add(Job(
+                'metrics snapshot', Interval(snapshot_interval),
+                functools.partial(REGISTRY.writeSnapshot, snapshot), catchup=SKIP
+            ))
+        self.endpoint = None
+        if metrics_port is not None:
+            self.endpoint = Endpoint(port=metrics_port)
+            self.endpoint.route('GET', '/metrics', self._metrics)
+            self.endpoint.route('GET', '/live', self._live)
+            self.endpoint.route('GET', '/ready', self._ready)
+        self.admin = None
+        if admin_port is not None:
+            self.admin = Endpoint(port=admin_port, token=admin_token)
+            self.admin.route('GET', '/status', self._status)
+            self.admin.route('POST', '/generate', self._generate)
+            self.admin.route('POST', '/post', self._post)
+            self.admin.route('POST', '/pause', self._pause)
+            self.admin.route('POST', '/resume', self._resume)
+        self._training = asyncio.Lock()
+        self._refill_needed = asyncio.Event()
+        self._refilling = set()
+        # Taken by every generation round, so refills and requests never exceed the workers
+        self._slots = asyncio.Semaphore(workers)
+        self._paused = set()
+        self._turn = 0
+
+    def run(self):
+        r"""Begin execution of the bots.
+
+        Starts generating and posting tweets occasionally.
+        """
+        self._running = True
+        for endpoint in (self.endpoint, self.admin):
+            if endpoint is not None:
+                self.loop.run_until_complete(endpoint.start())
+        self.loop.create_task(self._warmUp())
+        for _ in range(self.workers):
+            self.loop.create_task(self._refill())
+        for bot in self.bots:
+            self.loop.create_task(bot.mouth.deliver())
+        self.loop.create_task(self.scheduler.run())
+        try:
+            logger.info(f'Executing main event loop for {len(self.bots)} bot(s)')
+            self.loop.call_soon(self._markLive)
+            self.loop.run_forever()
+        except KeyboardInterrupt:
+            logger.info('Keyboard interrupt detected')
+        finally:
+            logger.info('Stopping tasks now')
+            self._running = False
+            self.scheduler.stop()
+            for bot in self.bots:
+                bot.brain.retrainer.stop()
+            for generator in {bot.brain.generator for bot in self.bots} - {None}:
+                generator.stop()
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            for bot in self.bots:
+                bot.brain.tweets.close()
+            self.loop.stop()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self._warmer.shutdown(wait=False, cancel_futures=True)
+        self.loop.close()
+
+    def isReady(self):
+        r"""Check if every bot is ready.
+
+        Returns
+        -------
+        bool
+            True if every bot's brain is warmed up
+        """
+        return all(bot.brain.ready.is_set() for bot in self.bots)
+
+    def _markLive(self):
+        r"""Record that the event loop is running."""
+        elapsed = STARTUP.mark('live')
+        logger.info(f'Live after {elapsed:.2f}s')
+
+    async def _warmUp(self):
+        r"""Warm-up task method.
+
+        Warms up each bot's brain in turn on a thread of its own, retrying failures,
+        and starts refilling once a bot is ready. Bots that are ready generate and
+        post on the executor while the others warm up.
+        """
+        for bot in self.bots:
+            while self._running and not bot.brain.ready.is_set():
+                try:
+                    await self.loop.run_in_executor(self._warmer, bot.brain.warmUp)
+                except asyncio.CancelledError:
+                    logger.warning('Task cancelled: _warmUp')
+                    return
+                except Exception as e:
+                    logger.error(f'Failed to warm up @{bot.username} with exception')
+                    logger.error(e)
+                    await asyncio.sleep(60)
+            self._refill_needed.set()
+        elapsed = STARTUP.mark('ready')
+        logger.info(f'Ready after {elapsed:.2f}s')
+        STARTUP.log()
+
+    async def _tweet(self, bot):
+        r"""Posting job method.
+
+        Posts the next tweet of a bot, run by the scheduler at each posting time.
+
+        Parameters
+        ----------
+        bot
+            TweetAI instance to post for
+        """
+        if not bot.brain.ready.is_set():
+            logger.warning(f'@{bot.username} is not ready yet, skipping post')
+            return
+        if bot in self._paused:
+            logger.warning(f'@{bot.username} is paused, skipping post')
+            return
+        tweet = await self._nextTweet(bot)
+        if tweet is not None:
+            bot.mouth.sendTweet(tweet)
+
+    async def _retrain(self, bot):
+        r"""Retraining job method.
+
+        Retrains a bot's model on new tweets in the background, one bot at a time so
+        training processes do not compete for memory.
+
+        Parameters
+        ----------
+        bot
+            TweetAI instance to retrain
+        """
+        if not bot.brain.ready.is_set():
+            logger.warning(f'@{bot.username} is not ready yet, skipping retraining')
+            return
+        async with self._training:
+            await self.loop.run_in_executor(None, bot.brain.retrain)
+
+    async def _compact(self, bot):
+        r"""History compaction job method.
+
+        Applies the retention policy to a bot's tweet history off the event loop.
+
+        Parameters
+        ----------
+        bot
+            TweetAI instance to compact the history of
+        """
+        await self.loop.run_in_executor(None, bot.history.compact)
+
+    def _metrics(self, query, body):
+        r"""Metrics request handler.
+
+        Returns
+        -------
+        tuple
+            Status code, content type and the metrics in the Prometheus text format
+        """
+        return 200, 'text/plain; version=0.0.4', REGISTRY.render()
+
+    def _live(self, query, body):
+        r"""Liveness request handler.
+
+        Returns
+        -------
+        tuple
+            Status code 200, answered whenever the event loop is running
+        """
+        return 200, 'text/plain', 'live\n'
+
+    def _ready(self, query, body):
+        r"""Readiness request handler.
+
+        Returns
+        -------
+        tuple
+            Status code 200 if every bot is ready, 503 otherwise, with the readiness
+            of each bot and the startup report as JSON
+        """
+        bots = {bot.username: bot.brain.ready.is_set() for bot in self.bots}
+        status = 200 if all(bots.values()) else 503
+        return status, 'application/json', json.dumps({'bots': bots, 'startup': STARTUP.report()})
+
+    def _status(self, query, body):
+        r"""Status request handler.
+
+        Returns
+        -------
+        tuple
+            Status code 200 with the state of each bot and the scheduled jobs as JSON
+        """
+        jobs = [
+            {'name': job.name, 'schedule': repr(job.schedule), 'runs': job.runs,
+             'next_run': job.next_run.isoformat() if job.next_run else None}
+            for job in self.scheduler.jobs()
+        ]
+        status = {
+            'bots': {bot.username: self._botStatus(bot) for bot in self.bots},
+            'jobs': jobs,
+            'workers': {'total': self.workers, 'busy': len(self._refilling)},
+        }
+        return 200, 'application/json', json.dumps(status)
+
+    async def _generate(self, query, body):
+        r"""Generation request handler.
+
+        Generates right away in the executor if the bot is not already generating
+        and a worker slot is free. Generation stops once the buffer is full, so a
+        full buffer is refused rather than answered with no tweets added.
+
+        Returns
+        -------
+        tuple
+            Status code 200 with the number of tweets added and buffered as JSON
+            once done, 409 if the buffer is already full, 429 if generation cannot
+            start now
+        """
+        bot = self._findBot(query)
+        if bot is None:
+            return 404, 'text/plain', 'bot not found\n'
+        try:
+            rounds = min(max(int(query.get('rounds', 1)), 1), 10)
+        except ValueError:
+            return 400, 'text/plain', 'rounds must be a number\n'
+        if not bot.brain.ready.is_set():
+            return 503, 'text/plain', f'@{bot.username} is not ready yet\n'
+        if bot.brain.tweets.isFull():
+            return 409, 'text/plain', f'tweet buffer for @{bot.username} is full, post or prune tweets first\n'
+        if bot in self._refilling:
+            return 429, 'text/plain', f'@{bot.username} is already generating\n'
+        if self._slots.locked():
+            return 429, 'text/plain', 'every generation worker is busy\n'
+        # A free slot is taken without waiting, so no refill can take it after the check
+        async with self._slots:
+            self._refilling.add(bot)
+            try:
+                logger.info(f'Generating for @{bot.username} on request')
+                added = await self.loop.run_in_executor(self.executor, bot.brain.refill, rounds)
+            finally:
+                self._refilling.discard(bot)
+                self._refill_needed.set()
+        return 200, 'application/json', json.dumps({'added': added, 'buffered': len(bot.brain.tweets)})
+
+    def _post(self, query, body):
+        r"""Post request handler.
+
+        Only posts from the buffer, it never waits on generation.
+
+        Returns
+        -------
+        tuple
+            Status code 202 with the tweet queued for posting as JSON, 503 if the
+            buffer is empty
+        """
+        bot = self._findBot(query)
+        if bot is None:
+            return 404, 'text/plain', 'bot not found\n'
+        if not bot.brain.ready.is_set():
+            return 503, 'text/plain', f'@{bot.username} is not ready yet\n'
+        if len(bot.brain.tweets) == 0:
+            return 503, 'text/plain', f'tweet buffer for @{bot.username} is empty\n'
+        tweet = bot.brain.getTweet()
+        logger.info(f'Posting for @{bot.username} on request')
+        bot.mouth.sendTweet(tweet)
+        self._refill_needed.set()
+        return 202, 'application/json', json.dumps({'tweet': tweet, 'enabled': bot.mouth.enabled})
+
+    def _pause(self, query, body):
+        r"""Pause request handler.
+
+        A generation round already running finishes, check generating in the
+        response or status to know when the bot is idle.
+
+        Returns
+        -------
+        tuple
+            Status code 200 with whether the bot is still generating as JSON
+        """
+        bot = self._findBot(query)
+        if bot is None:
+            return 404, 'text/plain', 'bot not found\n'
+        self._paused.add(bot)
+        logger.info(f'@{bot.username} paused on request')
+        return 200, 'application/json', json.dumps({'paused': True, 'generating': bot in self._refilling})
+
+    def _resume(self, query, body):
+        r"""Resume request handler.
+
+        Returns
+        -------
+        tuple
+            Status code 200 once the bot generates and posts again
+        """
+        bot = self._findBot(query)
+        if bot is None:
+            return 404, 'text/plain', 'bot not found\n'
+        self._paused.discard(bot)
+        self._refill_needed.set()
+        logger.info(f'@{bot.username} resumed on request')
+        return 200, 'application/json', json.dumps({'paused': False, 'generating': bot in self._refilling})
+
+    def _findBot(self, query):
+        r"""Find the bot a control request is for.
+
+        Parameters
+        ----------
+        query
+            Dictionary of query parameters, naming the bot with bot
+
+        Returns
+        -------
+        TweetAI or None
+            Bot named, the only bot if none is named, None if there is no such bot
+        """
+        name = query.get('bot')
+        if name is None:
+            return self.bots[0] if len(self.bots) == 1 else None
+        return next((bot for bot in self.bots if bot.username.lower() == name.lstrip('@').lower()), None)
+
+    def _botStatus(self, bot):
+        r"""Describe the state of a bot.
+
+        Parameters
+        ----------
+        bot
+            TweetAI instance to describe
+
+        Returns
+        -------
+        dict
+            Readiness, buffer, model, filters, retraining and outbox of the bot
+        """
+        brain = bot.brain
+        if brain.generator is None:
+            model = {'run': brain.run_name, 'loaded': brain.residency.isLoaded(), **brain.residency.stats}
+        else:
+            model = {'run': brain.run_name, 'workers': brain.generator.workers, 'alive': brain.generator.alive()}
+        return {
+            'ready': brain.ready.is_set(),
+            'paused': bot in self._paused,
+            'generating': bot in self._refilling,
+            'buffer': {'depth': len(brain.tweets), 'low_water': brain.tweets.low_water,
+                       'high_water': brain.tweets.high_water},
+            'model': model,
+            'filters': brain.filters.report(),
+            'retrain': {'running': brain.retrainer.running(), 'trained_on': brain.retrainer.trainedOn()},
+            'outbox': bot.mouth.outbox.counts(),
+        }
+
+    async def _nextTweet(self, bot):
+        r"""Take the next tweet from a bot's buffer.
+
+        Parameters
+        ----------
+        bot
+            TweetAI instance to take the tweet from
+
+        Returns
+        -------
+        str or None
+            Text ready to be sent as a tweet, None if the bot was paused while
+            waiting on generation
+        """
+        if len(bot.brain.tweets) == 0:
+            # Buffer ran dry, wait on a generation worker instead of blocking the loop
+            logger.warning(f'Tweet buffer for @{bot.username} is empty, waiting on generation')
+            async with self._slots:
+                if bot in self._paused:
+                    logger.warning(f'@{bot.username} was paused while waiting on generation, skipping post')
+                    return None
+                self._refilling.add(bot)
+                try:
+                    tweet = await self.loop.run_in_executor(self.executor, bot.brain.getTweet)
+                finally:
+                    self._refilling.discard(bot)
+        else:
+            tweet = bot.brain.getTweet()
+        self._refill_needed.set()
+        return tweet
+
+    def _nextBot(self):
+        r"""Pick the next bot needing a refill in round robin order.
+
+        Returns
+        -------
+        TweetAI or None
+            Ready bot with a low buffer that is not already refilling or paused, None
+            if there is none
+        """
+        count = len(self.bots)
+        for step in range(count):
+            bot = self.bots[(self._turn + step) % count]
+            if (bot not in self._refilling and bot not in self._paused and bot.brain.ready.is_set()
+                    and bot.brain.tweets.isLow()):
+                self._turn = (self._turn + step + 1) % count
+                return bot
+        return None
+
+    async def _refill(self):
+        r"""Refill task method.
+
+        Keeps the bots' tweet buffers above their low water marks by generating
+        one round of tweets at a time in the executor, each in a worker slot.
+        """
+        while self._running:
+            try:
+                async with self._slots:
+                    bot = self._nextBot()
+                    if bot is not None:
+                        self._refilling.add(bot)
+                        try:
+                            await self.loop.run_in_executor(self.executor, bot.brain.refill, 1)
+                        finally:
+                            self._refilling.discard(bot)
+                if bot is None:
+                    self._refill_needed.clear()
+                    await self._refill_needed.wait()
+            except asyncio.CancelledError:
+                logger.warning('Task cancelled: _refill')
+            except Exception as e:
+                logger.error('Failed to refill tweet buffer with exception')
+                logger.error(e)
+                await asyncio.sleep(60)
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+r"""Module for detecting links in text.
+
+Classes
+-------
+VerdictCache
+    Least recently used cache of link verdicts with expiry
+LinkResolver
+    Concurrent link checker with a verdict cache and deadlines
+
+Functions
+---------
+looksLikeLink
+    Check if a host name has the shape of a real domain
+"""
+import logging
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from time import monotonic
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+REQUEST_SECONDS = REGISTRY.histogram('tweetai_link_request_seconds', 'Seconds taken by each link check request')
+LINK_CHECKS = REGISTRY.counter('tweetai_link_checks_total', 'Links checked by outcome', ['outcome'])
+
+# Generic top level domains commonly seen in tweets, two letter country codes are always accepted
+TLDS = frozenset((
+    'app', 'art', 'biz', 'blog', 'club', 'com', 'dev', 'edu', 'gg', 'gov', 'info', 'int',
+    'io', 'live', 'ly', 'me', 'mil', 'net', 'news', 'online', 'org', 'shop', 'site',
+    'store', 'tech', 'tv', 'xyz', 'link', 'page', 'world', 'today', 'space', 'fun',
+))
+
+HOST_RE = re.compile(r'^(?:[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?\.)+([a-z]{2,63})$')
+IPV4_RE = re.compile(r'^(?:\d{1,3}\.){3}\d{1,3}$')
+
+
+def looksLikeLink(host):
+    r"""Check if a host name has the shape of a real domain.
+
+    Parameters
+    ----------
+    host
+        Lowercase host name, without scheme, port or path
+
+    Returns
+    -------
+    bool
+        True if the host is an ip address or a domain with a known top level domain
+    """
+    if IPV4_RE.match(host):
+        return all(int(part) < 256 for part in host.split('.'))
+    match = HOST_RE.match(host)
+    if match is None:
+        return False
+    tld = match.group(1)
+    return len(tld) == 2 or tld in TLDS
+
+
+class VerdictCache:
+    r"""Least recently used cache of link verdicts with expiry.
+
+    Parameters
+    ----------
+    maxsize: optional
+        Number of verdicts kept, default is 1024
+    ttl: optional
+        Seconds a positive verdict is kept, default is 1 day
+    negative_ttl: optional
+        Seconds a negative verdict is kept, default is 1 hour
+
+    Methods
+    -------
+    get
+        Get a cached verdict
+    put
+        Cache a verdict
+    """
+    def __init__(self, maxsize=1024, ttl=86400, negative_ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        r"""Get a cached verdict.
+
+        Parameters
+        ----------
+        key
+            Link or host the verdict is for
+
+        Returns
+        -------
+        bool or None
+            Cached verdict, None if there is no verdict or it has expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            verdict, expires = entry
+            if expires <= monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return verdict
+
+    def put(self, key, verdict):
+        r"""Cache a verdict.
+
+        Parameters
+        ----------
+        key
+            Link or host the verdict is for
+        verdict
+            True if the link works
+        """
+        ttl = self.ttl if verdict else self.negative_ttl
+        with self._lock:
+            self._entries[key] = (verdict, monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+class LinkResolver:
+    r"""Concurrent link checker with a verdict cache and deadlines.
+
+    Links are checked with a HEAD request, falling back to GET when the server does
+    not allow HEAD. Every request has its own timeout and a whole text is given a
+    total deadline, links still unresolved at the deadline are judged by their shape.
+
+    Verdicts are cached by link, so a missing page does not hide other pages of the
+    same site. A host that cannot be connected to is cached as well, so other links
+    to it are not requested again until the verdict expires.
+
+    Parameters
+    ----------
+    offline: optional
+        True if links are only judged by their shape with no requests, default is False
+    timeout: optional
+        Seconds allowed for each request, default is 3
+    deadline: optional
+        Seconds allowed to check all links in a text, default is 5
+    workers: optional
+        Number of concurrent requests and pooled connections, default is 8
+    cache: optional
+        Verdict cache to use, default is a new VerdictCache
+    scheme: optional
+        Scheme added to links without one, default is https
+
+    Attributes
+    ----------
+    offline
+        True if links are only judged by their shape
+    timeout
+        Seconds allowed for each request
+    deadline
+        Seconds allowed to check all links in a text
+    cache
+        Verdict cache in use
+    scheme
+        Scheme added to links without one
+
+    Methods
+    -------
+    hasLink
+        Check if text contains a link
+    checkHost
+        Check if a single link resolves
+    close
+        Release the pooled connections and workers
+    """
+    def __init__(self, offline=False, timeout=3, deadline=5, workers=8, cache=None, scheme='https'):
+        self.offline = offline
+        self.timeout = timeout
+        self.deadline = deadline
+        self.cache = VerdictCache() if cache is None else cache
+        self.scheme = scheme
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='link')
+
+    def hasLink(self, text):
+        r"""Check if text contains a link.
+
+        Parameters
+        ----------
+        text
+            Text to check for link(s)
+
+        Returns
+        -------
+        bool
+            True if text contains a link
+        """
+        links = {}
+        for token in re.findall(r'\S+\.\S+', text):
+            link, host = self._split(token)
+            if host is None or link in links:
+                continue
+            if self.offline:
+                if looksLikeLink(host):
+                    return True
+                continue
+            verdict = self.cache.get(urlsplit(link).netloc)
+            if verdict is None:
+                verdict = self.cache.get(link)
+            if verdict is not None:
+                LINK_CHECKS.labels(outcome='cached').inc()
+            if verdict:
+                return True
+            if verdict is None:
+                links[link] = host
+
+        if not links:
+            return False
+
+        futures = {self._executor.submit(self.checkHost, link): link for link in links}
+        end = monotonic() + self.deadline
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=max(end - monotonic(), 0), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.result():
+                    for other in pending:
+                        other.cancel()
+                    return True
+
+        for future in pending:
+            future.cancel()
+            link = futures[future]
+            LINK_CHECKS.labels(outcome='deadline').inc()
+            logger.debug(f'Link check deadline passed for {link}, judging by shape')
+            if looksLikeLink(links[link]):
+                return True
+        return False
+
+    def checkHost(self, link):
+        r"""Check if a single link resolves and cache the verdict.
+
+        Parameters
+        ----------
+        link
+            Full url to request, as returned for a token by the resolver
+
+        Returns
+        -------
+        bool
+            True if the link responded successfully
+        """
+        try:
+            with REQUEST_SECONDS.time():
+                response = self._session.head(link, timeout=self.timeout, allow_redirects=True)
+                if response.status_code in (405, 501):
+                    response = self._session.get(link, timeout=self.timeout, stream=True)
+                    response.close()
+        except requests.ConnectionError as e:
+            # No server answered, which holds for every link to the host
+            LINK_CHECKS.labels(outcome='failed').inc()
+            logger.debug(f'Link check failed for {link}: {e}')
+            self.cache.put(urlsplit(link).netloc, False)
+            return False
+        except (requests.RequestException, ValueError) as e:
+            # LocationParseError from urllib3 is a ValueError, raised instead of requests.InvalidURL
+            LINK_CHECKS.labels(outcome='failed').inc()
+            logger.debug(f'Link check failed for {link}: {e}')
+            self.cache.put(link, False)
+            return False
+        LINK_CHECKS.labels(outcome='resolved' if response.ok else 'unresolved').inc()
+        self.cache.put(link, response.ok)
+        return response.ok
+
+    def close(self):
+        r"""Release the pooled connections and workers."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._session.close()
+
+    def _split(self, token):
+        r"""Split a token into a full url and its host.
+
+        Parameters
+        ----------
+        token
+            Text that may be a link
+
+        Returns
+        -------
+        tuple
+            Full url with its scheme and host lowercased and without a fragment, and
+            lowercase host, host is None if the token has no host
+        """
+        token = token.strip('.,;:!?()[]{}<>"\'')
+        link = token if token.startswith('http') else f'{self.scheme}://{token}'
+        try:
+            parts = urlsplit(link)
+            host = parts.hostname
+        except ValueError:
+            return link, None
+        if not host or '.' not in host:
+            return link, None
+        link = parts._replace(scheme=parts.scheme.lower(), netloc=parts.netloc.lower(), fragment='').geturl()
+        return link, host.lower()
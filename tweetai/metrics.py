@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+r"""Module for in-process metrics.
+
+Classes
+-------
+Counter
+    Metric that only goes up
+Gauge
+    Metric that goes up and down
+Histogram
+    Metric counting observations into buckets
+Registry
+    Collection of metrics rendered together
+
+Attributes
+----------
+REGISTRY
+    Registry used by TweetAI's own metrics
+"""
+import json
+import os
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter
+
+# Seconds, from fast in-process checks to slow model loads
+BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+
+
+class _Metric:
+    r"""Base of the metric types, one value per set of label values.
+
+    Parameters
+    ----------
+    name
+        Metric name
+    help
+        Description of the metric
+    labels: optional
+        Names of the labels, default is no labels
+    """
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        self._key = ()
+
+    def labels(self, **labels):
+        r"""Get the metric for a set of label values.
+
+        Parameters
+        ----------
+        labels
+            Value of every label
+
+        Returns
+        -------
+        Metric of the same type updating the values of those labels
+        """
+        if set(labels) != set(self.label_names):
+            raise ValueError(f'{self.name} needs labels {self.label_names}')
+        child = object.__new__(type(self))
+        child.__dict__.update(self.__dict__)
+        child._key = tuple(str(labels[name]) for name in self.label_names)
+        return child
+
+    def samples(self):
+        r"""List the samples of the metric.
+
+        Returns
+        -------
+        list
+            Tuples of sample name suffix, label dictionary and value
+        """
+        with self._lock:
+            values = dict(self._values)
+        return [
+            ('', dict(zip(self.label_names, key)), value)
+            for key, value in sorted(values.items())
+        ]
+
+
+class Counter(_Metric):
+    r"""Metric that only goes up.
+
+    Methods
+    -------
+    inc
+        Add to the count
+    value
+        Get the count
+    """
+    kind = 'counter'
+
+    def inc(self, amount=1):
+        r"""Add to the count.
+
+        Parameters
+        ----------
+        amount: optional
+            Amount to add, default is 1
+        """
+        with self._lock:
+            self._values[self._key] = self._values.get(self._key, 0) + amount
+
+    def value(self):
+        with self._lock:
+            return self._values.get(self._key, 0)
+
+
+class Gauge(_Metric):
+    r"""Metric that goes up and down.
+
+    Methods
+    -------
+    set
+        Set the value
+    inc
+        Add to the value
+    value
+        Get the value
+    """
+    kind = 'gauge'
+
+    def set(self, value):
+        with self._lock:
+            self._values[self._key] = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._values[self._key] = self._values.get(self._key, 0) + amount
+
+    def value(self):
+        with self._lock:
+            return self._values.get(self._key, 0)
+
+
+class Histogram(_Metric):
+    r"""Metric counting observations into buckets.
+
+    Parameters
+    ----------
+    name
+        Metric name
+    help
+        Description of the metric
+    labels: optional
+        Names of the labels, default is no labels
+    buckets: optional
+        Upper bounds of the buckets, default is a range of seconds
+
+    Methods
+    -------
+    observe
+        Add an observation
+    time
+        Context manager observing the seconds its body takes
+    count
+        Get the number of observations
+    total
+        Get the sum of observations
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, count=1):
+        r"""Add an observation.
+
+        Parameters
+        ----------
+        value
+            Value observed
+        count: optional
+            Number of times the value was observed, default is 1
+        """
+        with self._lock:
+            counts, total = self._values.get(self._key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect_left(self.buckets, value)] += count
+            self._values[self._key] = (counts, total + value * count)
+
+    @contextmanager
+    def time(self):
+        r"""Context manager observing the seconds its body takes."""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start)
+
+    def count(self):
+        with self._lock:
+            return sum(self._values.get(self._key, ([0], 0))[0])
+
+    def total(self):
+        with self._lock:
+            return self._values.get(self._key, ([0], 0.0))[1]
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        samples = []
+        for key, (counts, total) in sorted(values.items()):
+            labels = dict(zip(self.label_names, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                samples.append(('_bucket', {**labels, 'le': le}, cumulative))
+            samples.append(('_sum', labels, total))
+            samples.append(('_count', labels, cumulative))
+        return samples
+
+
+class Registry:
+    r"""Collection of metrics rendered together.
+
+    Asking for a metric that already exists returns it, so modules can declare the
+    metrics they update without coordinating.
+
+    Methods
+    -------
+    counter
+        Get or create a counter
+    gauge
+        Get or create a gauge
+    histogram
+        Get or create a histogram
+    render
+        Render every metric in the Prometheus text format
+    snapshot
+        Get the value of every metric
+    writeSnapshot
+        Write the value of every metric to a JSON file
+    """
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, help, labels=()):
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help, labels=()):
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(self, name, help, labels=(), buckets=BUCKETS):
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def render(self):
+        r"""Render every metric in the Prometheus text format.
+
+        Returns
+        -------
+        str
+            Text exposition of the metrics
+        """
+        lines = []
+        for metric in self._all():
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for suffix, labels, value in metric.samples():
+                if labels:
+                    text = ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+                    lines.append(f'{metric.name}{suffix}{{{text}}} {value}')
+                else:
+                    lines.append(f'{metric.name}{suffix} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        r"""Get the value of every metric.
+
+        Returns
+        -------
+        dict
+            List of samples for each metric name
+        """
+        return {
+            metric.name: [
+                {'sample': metric.name + suffix, 'labels': labels, 'value': value}
+                for suffix, labels, value in metric.samples()
+            ]
+            for metric in self._all()
+        }
+
+    def writeSnapshot(self, path):
+        r"""Write the value of every metric to a JSON file.
+
+        The file is replaced atomically so readers never see a partial snapshot.
+
+        Parameters
+        ----------
+        path
+            Path of the file to write
+        """
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump(self.snapshot(), f, indent=1)
+        os.replace(f'{path}.tmp', path)
+
+    def _get(self, cls, name, help, labels, **kwargs):
+        r"""Get or create a metric.
+
+        Parameters
+        ----------
+        cls
+            Metric type
+        name
+            Metric name
+        help
+            Description of the metric
+        labels
+            Names of the labels
+
+        Returns
+        -------
+        Metric of the type
+
+        Raises
+        ------
+        ValueError
+            Metric exists with a different type or labels
+        """
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, labels, **kwargs)
+            elif type(metric) is not cls or metric.label_names != tuple(labels):
+                raise ValueError(f'metric {name} already exists with a different type or labels')
+            return metric
+
+    def _all(self):
+        with self._lock:
+            return [self._metrics[name] for name in sorted(self._metrics)]
+
+
+def _escape(value):
+    r"""Escape a label value for the text format.
+
+    Parameters
+    ----------
+    value
+        Label value
+
+    Returns
+    -------
+    str
+        Escaped value
+    """
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+REGISTRY = Registry()
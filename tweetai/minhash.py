@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+r"""Module for finding near duplicates of the training data.
+
+Classes
+-------
+MinHashIndex
+    Persistent MinHash locality sensitive hashing index over the training data
+
+Functions
+---------
+shingles
+    Split text into overlapping word shingles
+"""
+import os
+import logging
+import json
+import hashlib
+import random
+import re
+import zlib
+from array import array
+
+from .corpus import readAppended
+from .history import normalizeText
+
+logger = logging.getLogger(__name__)
+
+# Mersenne prime used for the permutation hashes, keeps every value in 32 bits
+PRIME = (1 << 31) - 1
+
+
+def shingles(text, size=2):
+    r"""Split text into overlapping word shingles.
+
+    Parameters
+    ----------
+    text
+        Text to split, normalized before splitting
+    size: optional
+        Number of words in each shingle, default is 2
+
+    Returns
+    -------
+    set
+        Set of shingles, text shorter than one shingle gives its words alone
+    """
+    words = normalizeText(text).split()
+    if len(words) < size:
+        return set(words)
+    return {' '.join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+class MinHashIndex:
+    r"""Persistent MinHash locality sensitive hashing index over the training data.
+
+    Each line of the data file is reduced to a MinHash signature of its word
+    shingles. Signatures are split into bands and bucketed, so a query only compares
+    against lines sharing at least one band, and the estimated Jaccard similarity of
+    those decides the result. Signatures are stored beside the data file and only
+    lines appended since the last sync are hashed.
+
+    Parameters
+    ----------
+    path
+        Path to the csv file containing the training data
+    threshold: optional
+        Estimated Jaccard similarity at which text counts as a near duplicate,
+        default is 0.6
+    num_perm: optional
+        Number of hash permutations in a signature, default is 64
+    bands: optional
+        Number of bands the signature is split into, must divide num_perm, default is 16
+    shingle_size: optional
+        Number of words in each shingle, default is 2
+
+    Attributes
+    ----------
+    path
+        Path to the csv file containing the training data
+    threshold
+        Estimated Jaccard similarity at which text counts as a near duplicate
+    num_perm
+        Number of hash permutations in a signature
+    bands
+        Number of bands the signature is split into
+    shingle_size
+        Number of words in each shingle
+
+    Methods
+    -------
+    sync
+        Bring the index up to date with the data file
+    signature
+        Compute the MinHash signature of a text
+    similarity
+        Find the highest estimated similarity of a text to the data
+    isNearDuplicate
+        Check if a text is a near duplicate of a line of the data
+    """
+    def __init__(self, path, threshold=0.6, num_perm=64, bands=16, shingle_size=2):
+        if num_perm % bands != 0:
+            raise ValueError('bands must divide num_perm')
+        self.path = path
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.shingle_size = shingle_size
+        self._rows = num_perm // bands
+        rng = random.Random(num_perm)
+        self._perms = [(rng.randrange(1, PRIME), rng.randrange(0, PRIME)) for _ in range(num_perm)]
+        self._signatures = array('I')
+        self._buckets = [{} for _ in range(bands)]
+        self._manifest = self._emptyManifest()
+
+    def __len__(self):
+        return len(self._signatures) // self.num_perm
+
+    def sync(self):
+        r"""Bring the index up to date with the data file.
+
+        Lines appended since the last sync are hashed and added. If the data file was
+        rewritten or the index settings changed, every line is hashed again.
+        """
+        manifest_path = f'{self.path}.mh.json'
+        signature_path = f'{self.path}.mh'
+        if os.path.isfile(manifest_path) and os.path.isfile(signature_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            if manifest['params'] == self._params():
+                self._manifest = manifest
+                self._signatures = array('I')
+                with open(signature_path, 'rb') as f:
+                    self._signatures.frombytes(f.read(manifest['count'] * self.num_perm * 4))
+
+        appended, tail, offset, digest = readAppended(
+            self.path, self._manifest['offset'], self._manifest['digest']
+        )
+        if not appended:
+            logger.info('Training data changed, rebuilding near duplicate index')
+            self._signatures = array('I')
+
+        start = len(self._signatures)
+        for line in tail.decode('utf8', errors='replace').split('\n'):
+            words = shingles(re.sub('"', '', line), self.shingle_size)
+            if words:
+                self._signatures.extend(self._minhash(words))
+        added = (len(self._signatures) - start) // self.num_perm
+        if added:
+            logger.info(f'Hashed {added} line(s) for near duplicate index')
+
+        with open(signature_path, 'r+b' if appended and os.path.isfile(signature_path) else 'wb') as f:
+            f.seek(start * 4)
+            self._signatures[start:].tofile(f)
+            f.truncate()
+        self._manifest = {
+            'params': self._params(), 'offset': offset, 'digest': digest, 'count': len(self),
+        }
+        with open(f'{manifest_path}.tmp', 'w') as f:
+            json.dump(self._manifest, f)
+        os.replace(f'{manifest_path}.tmp', manifest_path)
+
+        self._buckets = [{} for _ in range(self.bands)]
+        for doc in range(len(self)):
+            self._addBuckets(doc, self._signatures[doc * self.num_perm:(doc + 1) * self.num_perm])
+
+    def signature(self, text):
+        r"""Compute the MinHash signature of a text.
+
+        Parameters
+        ----------
+        text
+            Text to compute the signature of
+
+        Returns
+        -------
+        list or None
+            Signature values, None if the text has no words
+        """
+        words = shingles(text, self.shingle_size)
+        if not words:
+            return None
+        return self._minhash(words)
+
+    def similarity(self, text):
+        r"""Find the highest estimated similarity of a text to the data.
+
+        Parameters
+        ----------
+        text
+            Text to compare
+
+        Returns
+        -------
+        float
+            Highest estimated Jaccard similarity to a line sharing a band, 0 if none do
+        """
+        sig = self.signature(text)
+        if sig is None:
+            return 0.0
+        candidates = set()
+        for band, key in enumerate(self._bandKeys(sig)):
+            candidates.update(self._buckets[band].get(key, ()))
+        best = 0.0
+        for doc in candidates:
+            other = self._signatures[doc * self.num_perm:(doc + 1) * self.num_perm]
+            matches = sum(1 for a, b in zip(sig, other) if a == b)
+            best = max(best, matches / self.num_perm)
+        return best
+
+    def isNearDuplicate(self, text):
+        r"""Check if a text is a near duplicate of a line of the data.
+
+        Parameters
+        ----------
+        text
+            Text to check
+
+        Returns
+        -------
+        bool
+            True if the estimated similarity reaches the threshold
+        """
+        return self.similarity(text) >= self.threshold
+
+    def _minhash(self, words):
+        r"""Compute the signature of a set of shingles.
+
+        Parameters
+        ----------
+        words
+            Non empty set of shingles
+
+        Returns
+        -------
+        list
+            Minimum permuted hash for each permutation
+        """
+        hashes = [zlib.crc32(word.encode('utf8')) for word in words]
+        return [min((a * h + b) % PRIME for h in hashes) for a, b in self._perms]
+
+    def _bandKeys(self, sig):
+        r"""Split a signature into band keys.
+
+        Parameters
+        ----------
+        sig
+            Signature to split
+
+        Returns
+        -------
+        list
+            One hashable key per band
+        """
+        rows = self._rows
+        return [tuple(sig[i:i + rows]) for i in range(0, self.num_perm, rows)]
+
+    def _addBuckets(self, doc, sig):
+        r"""Add a line's signature to the band buckets.
+
+        Parameters
+        ----------
+        doc
+            Index of the line's signature
+        sig
+            Signature of the line
+        """
+        for band, key in enumerate(self._bandKeys(sig)):
+            self._buckets[band].setdefault(key, []).append(doc)
+
+    def _params(self):
+        r"""Get the settings a stored index must match to be reused.
+
+        Returns
+        -------
+        list
+            Permutation count, band count and shingle size
+        """
+        return [self.num_perm, self.bands, self.shingle_size]
+
+    def _emptyManifest(self):
+        r"""Get the manifest of an empty index.
+
+        Returns
+        -------
+        dict
+            Manifest with nothing indexed
+        """
+        return {'params': self._params(), 'offset': 0, 'digest': hashlib.sha1().hexdigest(), 'count': 0}
@@ -7,46 +7,269 @@ Mouth
     Class for posting and managing tweets
 """
 import logging
+import asyncio
+import functools
+import random
 import re
+from time import perf_counter, time
 from unicodedata import normalize
 
+import requests
+import tweepy
+
+from .history import POSTED
+from .metrics import REGISTRY
+from .outbox import Outbox
+
 logger = logging.getLogger(__name__)
 
+POST_SECONDS = REGISTRY.histogram('tweetai_post_seconds', 'Seconds taken by each posting request')
+POSTS = REGISTRY.counter('tweetai_posts_total', 'Posting attempts by outcome', ['outcome'])
+OUTBOX_PENDING = REGISTRY.gauge('tweetai_outbox_pending', 'Tweets waiting to be posted', ['outbox'])
+
 
 class Mouth:
     r"""Class controlling the posting and managing of tweets.
 
+    Tweets are queued in a persistent outbox and posted by the deliver task, so a
+    failed post is retried later instead of being lost. Transient failures are
+    retried with jittered exponential backoff, rate limited posts wait for the
+    reset, and posts are spread so no more than the posting limit are sent in any
+    window. Twitter rejecting a post as duplicate content means an earlier attempt
+    already went through, so it counts as posted.
+
     Parameters
     ----------
     client
         Tweepy client instance
     enabled
         True if bot is allowed to send out tweets
+    history: optional
+        Record of tweets to add posted tweets to, default is None
+    outbox: optional
+        Outbox to queue tweets in, default is an outbox that is not kept
+    post_limit: optional
+        Most tweets posted in a window, None for no limit, default is 300
+    post_window: optional
+        Seconds of the posting limit window, default is 10800
+    max_attempts: optional
+        Number of attempts before a tweet is marked failed, default is 8
+    backoff: optional
+        Base seconds for the retry backoff, default is 30
+    max_backoff: optional
+        Most seconds waited between attempts, default is 3600
+
+    Attributes
+    ----------
+    client
+        Tweepy client used for posting
+    enabled
+        True if bot is allowed to send out tweets
+    history
+        Record of tweets posted tweets are added to
+    outbox
+        Outbox tweets are queued in
+    post_limit
+        Most tweets posted in a window
+    post_window
+        Seconds of the posting limit window
 
     Methods
     -------
     sendTweet
-        Send a given text as a tweet
+        Queue a given text to be sent as a tweet
+    deliver
+        Post queued tweets as they come due
     """
-    def __init__(self, client, enabled):
+    def __init__(self, client, enabled, history=None, outbox=None, post_limit=300, post_window=10800,
+                 max_attempts=8, backoff=30, max_backoff=3600):
         self.client = client
         self.enabled = enabled
+        self.history = history
+        self.outbox = Outbox(':memory:') if outbox is None else outbox
+        self.post_limit = post_limit
+        self.post_window = post_window
+        # Posts are counted against the limit for the whole window, so must be kept that long
+        self.outbox.retention = max(self.outbox.retention, post_window)
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._not_before = 0
+        self._loop = None
+        self._wakeup = None
 
     def sendTweet(self, tweet):
-        r"""Send a given text as a tweet.
+        r"""Queue a given text to be sent as a tweet.
 
         Parameters
         ----------
         tweet
             Text to send as a tweet
         """
+        generated = tweet
         tweet = re.sub(r'#', 'hashtag ', tweet)
         logger.info(f'Tweet prepared: {tweet}')
         if self.enabled:
+            if self.outbox.enqueue(normalize("NFC", tweet)[:279], generated):
+                OUTBOX_PENDING.labels(outbox=self.outbox.path).set(len(self.outbox))
+                self._wake()
+        else:
+            logger.info('Tweet posting is not enabled. Tweet not sent')
+
+    async def deliver(self):
+        r"""Post queued tweets as they come due.
+
+        Posting runs in the default executor so the event loop never waits on the
+        request.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        while True:
             try:
-                self.client.create_tweet(text=normalize("NFC", tweet)[:279])
+                self._wakeup.clear()
+                delay = self._nextDelay()
+                if delay is None:
+                    await self._wakeup.wait()
+                    continue
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                message = self.outbox.claim()
+                if message is not None:
+                    await self._post(message)
+            except asyncio.CancelledError:
+                logger.warning('Task cancelled: deliver')
+                return
             except Exception as e:
-                logger.error('Failed to post tweet with exception')
+                logger.error('Failed to deliver tweets with exception')
+                logger.error(e)
+                await asyncio.sleep(60)
+
+    async def _post(self, message):
+        r"""Attempt to post a message from the outbox.
+
+        Parameters
+        ----------
+        message
+            Message claimed from the outbox
+        """
+        start = perf_counter()
+        try:
+            response = await self._loop.run_in_executor(
+                None, functools.partial(self.client.create_tweet, text=message.text)
+            )
+        except tweepy.TooManyRequests as e:
+            POSTS.labels(outcome='rate_limited').inc()
+            self._rateLimited(e.response.headers)
+            self._retry(message, 'rate limited')
+        except tweepy.Forbidden as e:
+            if 'duplicate' in str(e).lower():
+                POSTS.labels(outcome='duplicate').inc()
+                logger.warning('Tweet was already posted by an earlier attempt')
+                self._posted(message)
+            else:
+                POSTS.labels(outcome='refused').inc()
+                logger.error('Tweet was refused, not retrying')
                 logger.error(e)
+                self.outbox.fail(message, str(e))
+        except (tweepy.BadRequest, tweepy.Unauthorized, tweepy.NotFound) as e:
+            POSTS.labels(outcome='refused').inc()
+            logger.error('Tweet was refused, not retrying')
+            logger.error(e)
+            self.outbox.fail(message, str(e))
+        except (tweepy.TweepyException, requests.RequestException) as e:
+            POSTS.labels(outcome='error').inc()
+            logger.warning(f'Failed to post tweet, retrying: {e}')
+            self._retry(message, str(e))
+        except asyncio.CancelledError:
+            # The message stays claimed and is retried when the outbox is opened again
+            raise
+        except Exception as e:
+            # Anything unexpected must still release the claim, or the message is stuck until a restart
+            POSTS.labels(outcome='error').inc()
+            logger.error('Failed to post tweet with exception, retrying')
+            logger.error(e)
+            self._retry(message, f'{type(e).__name__}: {e}')
         else:
-            logger.info('Tweet posting is not enabled. Tweet not sent')
+            POSTS.labels(outcome='sent').inc()
+            data = getattr(response, 'data', None)
+            self._posted(message, data.get('id') if isinstance(data, dict) else None)
+        finally:
+            POST_SECONDS.observe(perf_counter() - start)
+            OUTBOX_PENDING.labels(outbox=self.outbox.path).set(len(self.outbox))
+
+    def _posted(self, message, tweet_id=None):
+        r"""Record a message as posted.
+
+        Parameters
+        ----------
+        message
+            Message that was posted
+        tweet_id: optional
+            Id of the posted tweet, default is None if it is not known
+        """
+        self.outbox.sent(message, tweet_id)
+        if self.history is not None:
+            self.history.record(message.original, POSTED)
+        logger.info(f'Tweet posted: {message.text}')
+
+    def _retry(self, message, error):
+        r"""Queue a message for another attempt with jittered exponential backoff.
+
+        Parameters
+        ----------
+        message
+            Message whose attempt failed
+        error
+            Description of the failure
+        """
+        if message.attempts + 1 >= self.max_attempts:
+            logger.error(f'Giving up on tweet after {message.attempts + 1} attempt(s)')
+            self.outbox.fail(message, error)
+            return
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** message.attempts))
+        self.outbox.retry(message, max(delay, self._not_before - time()), error)
+
+    def _rateLimited(self, headers):
+        r"""Hold back posting until the rate limit resets.
+
+        Parameters
+        ----------
+        headers
+            Response headers, may be missing the rate limit fields
+        """
+        try:
+            reset = float(headers['x-rate-limit-reset'])
+        except (KeyError, TypeError, ValueError):
+            reset = time() + self.backoff
+        logger.warning(f'Posting rate limited for {max(reset - time(), 0):.0f}s')
+        self._not_before = max(self._not_before, reset + 1)
+
+    def _nextDelay(self):
+        r"""Get the seconds until the next tweet can be posted.
+
+        Returns
+        -------
+        float or None
+            Seconds to wait, 0 or less if a tweet can be posted now, None if the
+            outbox is empty
+        """
+        due = self.outbox.nextAttempt()
+        if due is None:
+            return None
+        now = time()
+        due = max(due, self._not_before)
+        if self.post_limit is not None:
+            sent = self.outbox.sentSince(now - self.post_window)
+            if len(sent) >= self.post_limit:
+                # Wait for enough posts to leave the window to make room for one more
+                due = max(due, sent[len(sent) - self.post_limit] + self.post_window)
+        return due - now
+
+    def _wake(self):
+        r"""Wake the deliver task to check the outbox."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+r"""Module for storing tweets waiting to be posted.
+
+Classes
+-------
+Message
+    Tweet waiting in the outbox
+Outbox
+    SQLite backed queue of tweets waiting to be posted
+"""
+import logging
+import hashlib
+import sqlite3
+import threading
+from collections import namedtuple
+from time import time
+
+from .history import normalizeText
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+SENDING = 'sending'
+SENT = 'sent'
+FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    text TEXT NOT NULL,
+    original TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    created REAL NOT NULL,
+    sent REAL,
+    tweet_id TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS outbox_status_next ON outbox (status, next_attempt);
+CREATE INDEX IF NOT EXISTS outbox_sent ON outbox (sent);
+"""
+
+Message = namedtuple('Message', ['id', 'key', 'text', 'original', 'attempts'])
+Message.__doc__ = r"""Tweet waiting in the outbox.
+
+Attributes
+----------
+id
+    Row id of the message
+key
+    Idempotency key of the message
+text
+    Text to post
+original
+    Generated text the post was prepared from
+attempts
+    Number of attempts made before this one
+"""
+
+
+class Outbox:
+    r"""SQLite backed queue of tweets waiting to be posted.
+
+    Every message has an idempotency key, by default the hash of its normalized
+    text, so the same tweet is never queued twice. A message is claimed before it
+    is posted, and messages still claimed when the outbox is opened again are
+    queued for another attempt since the process stopped before it knew the result.
+
+    Posted messages are kept for the retention period, long enough to count them
+    against the post limit, and are pruned as new messages are posted.
+
+    Parameters
+    ----------
+    path
+        Path to the database file, ':memory:' for an outbox that is not kept
+    clock: optional
+        Wall clock time function, default is time.time
+    retention: optional
+        Seconds posted messages are kept, must be longer than the post limit window,
+        default is 7 days
+
+    Attributes
+    ----------
+    path
+        Path to the database file
+    retention
+        Seconds posted messages are kept
+
+    Methods
+    -------
+    enqueue
+        Queue a tweet to be posted
+    claim
+        Take the next message that is due
+    nextAttempt
+        Get the time the next message is due
+    sent
+        Mark a message as posted
+    retry
+        Queue a message for another attempt later
+    fail
+        Mark a message as failed for good
+    requeue
+        Queue failed messages again
+    sentSince
+        List the times of messages posted since a time
+    prune
+        Remove messages posted before the retention period
+    counts
+        Count the messages of each status
+    close
+        Close the database
+    """
+    def __init__(self, path, clock=time, retention=7 * 86400):
+        self.path = path
+        self.retention = retention
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute('PRAGMA journal_mode = WAL')
+            self._db.executescript(SCHEMA)
+            resumed = self._db.execute(
+                'UPDATE outbox SET status = ? WHERE status = ?', (PENDING, SENDING)
+            ).rowcount
+        if resumed:
+            logger.warning(f'Resuming {resumed} tweet(s) interrupted while posting')
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute(
+                'SELECT COUNT(*) FROM outbox WHERE status IN (?, ?)', (PENDING, SENDING)
+            ).fetchone()[0]
+
+    def enqueue(self, text, original=None, key=None):
+        r"""Queue a tweet to be posted.
+
+        Parameters
+        ----------
+        text
+            Text to post
+        original: optional
+            Generated text the post was prepared from, default is the text
+        key: optional
+            Idempotency key, default is the hash of the normalized text
+
+        Returns
+        -------
+        bool
+            True if queued, False if a message with the key already exists
+        """
+        original = text if original is None else original
+        key = hashlib.sha1(normalizeText(text).encode('utf8')).hexdigest() if key is None else key
+        now = self._clock()
+        with self._lock, self._db:
+            added = self._db.execute(
+                'INSERT OR IGNORE INTO outbox (key, text, original, status, next_attempt, created) '
+                'VALUES (?, ?, ?, ?, ?, ?)', (key, text, original, PENDING, now, now)
+            ).rowcount
+        if not added:
+            logger.warning(f'Tweet already in outbox, not queued again: {key}')
+        return bool(added)
+
+    def claim(self):
+        r"""Take the next message that is due.
+
+        Returns
+        -------
+        Message or None
+            Oldest pending message that is due, None if none are
+        """
+        with self._lock, self._db:
+            row = self._db.execute(
+                'SELECT id, key, text, original, attempts FROM outbox '
+                'WHERE status = ? AND next_attempt <= ? ORDER BY next_attempt, id LIMIT 1',
+                (PENDING, self._clock())
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute('UPDATE outbox SET status = ? WHERE id = ?', (SENDING, row[0]))
+        return Message(*row)
+
+    def nextAttempt(self):
+        r"""Get the time the next message is due.
+
+        Returns
+        -------
+        float or None
+            Wall clock time of the earliest pending message, None if there are none
+        """
+        with self._lock:
+            return self._db.execute(
+                'SELECT MIN(next_attempt) FROM outbox WHERE status = ?', (PENDING,)
+            ).fetchone()[0]
+
+    def sent(self, message, tweet_id=None):
+        r"""Mark a message as posted.
+
+        Parameters
+        ----------
+        message
+            Message that was posted
+        tweet_id: optional
+            Id of the posted tweet, default is None if it is not known
+        """
+        with self._lock, self._db:
+            self._db.execute(
+                'UPDATE outbox SET status = ?, attempts = attempts + 1, sent = ?, tweet_id = ?, '
+                'error = NULL WHERE id = ?', (SENT, self._clock(), tweet_id, message.id)
+            )
+        self.prune()
+
+    def retry(self, message, delay, error=None):
+        r"""Queue a message for another attempt later.
+
+        Parameters
+        ----------
+        message
+            Message whose attempt failed
+        delay
+            Seconds until the next attempt
+        error: optional
+            Description of the failure, default is None
+        """
+        with self._lock, self._db:
+            self._db.execute(
+                'UPDATE outbox SET status = ?, attempts = attempts + 1, next_attempt = ?, error = ? '
+                'WHERE id = ?', (PENDING, self._clock() + delay, error, message.id)
+            )
+
+    def fail(self, message, error=None):
+        r"""Mark a message as failed for good.
+
+        The message is kept so it can be inspected or queued again with requeue.
+
+        Parameters
+        ----------
+        message
+            Message whose attempt failed
+        error: optional
+            Description of the failure, default is None
+        """
+        with self._lock, self._db:
+            self._db.execute(
+                'UPDATE outbox SET status = ?, attempts = attempts + 1, error = ? WHERE id = ?',
+                (FAILED, error, message.id)
+            )
+
+    def requeue(self):
+        r"""Queue failed messages again.
+
+        Returns
+        -------
+        int
+            Number of messages queued again
+        """
+        with self._lock, self._db:
+            return self._db.execute(
+                'UPDATE outbox SET status = ?, attempts = 0, next_attempt = ? WHERE status = ?',
+                (PENDING, self._clock(), FAILED)
+            ).rowcount
+
+    def sentSince(self, since):
+        r"""List the times of messages posted since a time.
+
+        Parameters
+        ----------
+        since
+            Wall clock time to look from
+
+        Returns
+        -------
+        list
+            Wall clock times of the posts, oldest first
+        """
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT sent FROM outbox WHERE sent >= ? ORDER BY sent', (since,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def prune(self):
+        r"""Remove messages posted before the retention period.
+
+        Returns
+        -------
+        int
+            Number of messages removed
+        """
+        with self._lock, self._db:
+            return self._db.execute(
+                'DELETE FROM outbox WHERE status = ? AND sent < ?', (SENT, self._clock() - self.retention)
+            ).rowcount
+
+    def counts(self):
+        r"""Count the messages of each status.
+
+        Returns
+        -------
+        dict
+            Number of messages stored for each status
+        """
+        with self._lock:
+            rows = self._db.execute('SELECT status, COUNT(*) FROM outbox GROUP BY status').fetchall()
+        return dict(rows)
+
+    def close(self):
+        r"""Close the database."""
+        with self._lock:
+            self._db.close()
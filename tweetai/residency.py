@@ -0,0 +1,502 @@
+# -*- coding: utf-8 -*-
+r"""Module for keeping the AI model loaded between uses.
+
+Classes
+-------
+ModelResidency
+    Manager for the loaded model session
+SessionPool
+    Bounded pool of loaded model sessions shared by several training runs
+
+Functions
+---------
+availableMemory
+    Get the amount of memory available to the system
+checkpointModel
+    Get the base GPT-2 model a training run was fine-tuned from
+checkpointVersion
+    Get the checkpoint directory a training run currently resolves to
+importGPT2
+    Import gpt_2_simple on first use
+newSession
+    Start a session in its own graph
+"""
+import os
+import logging
+import json
+import threading
+from contextlib import contextmanager
+from time import monotonic
+
+from .metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+LOAD_SECONDS = REGISTRY.histogram('tweetai_model_load_seconds', 'Seconds taken to load a model', ['run'])
+USE_SECONDS = REGISTRY.histogram('tweetai_model_use_seconds', 'Seconds a loaded model was used for generating', ['run'])
+EVICTIONS = REGISTRY.counter('tweetai_model_evictions_total', 'Times a loaded model was released', ['run'])
+LOADED = REGISTRY.gauge('tweetai_model_loaded', 'Whether a model is loaded', ['run'])
+
+# Base GPT-2 models by their number of layers
+MODEL_LAYERS = {12: '124M', 24: '355M', 36: '774M', 48: '1558M'}
+
+
+def importGPT2():
+    r"""Import gpt_2_simple on first use.
+
+    Importing it also imports TensorFlow, which takes several seconds, so it is
+    left until a model is needed.
+
+    Returns
+    -------
+    module
+        The gpt_2_simple module
+    """
+    import gpt_2_simple
+    return gpt_2_simple
+
+
+def newSession(intra_op_threads=0, inter_op_threads=0):
+    r"""Start a session in its own graph.
+
+    Each session gets a separate graph so models of several training runs can be
+    loaded in the same process at once.
+
+    Parameters
+    ----------
+    intra_op_threads: optional
+        Threads running the work of a single operation, default is 0 to let
+        TensorFlow decide
+    inter_op_threads: optional
+        Operations run at once, default is 0 to let TensorFlow decide
+
+    Returns
+    -------
+    tf.Session
+        New session, use its graph as the default while building the model
+
+    Warning
+    -------
+    TensorFlow creates its thread pools with the first session of a process, later
+    sessions share them whatever their thread counts
+    """
+    import tensorflow as tf
+    gpt2 = importGPT2()
+    graph = tf.Graph()
+    with graph.as_default():
+        if not intra_op_threads and not inter_op_threads:
+            return gpt2.start_tf_sess()
+        # start_tf_sess only takes one count for both pools, so its config is built here
+        from tensorflow.core.protobuf import rewriter_config_pb2
+        config = tf.compat.v1.ConfigProto()
+        config.gpu_options.allow_growth = True
+        config.graph_options.rewrite_options.layout_optimizer = rewriter_config_pb2.RewriterConfig.OFF
+        config.intra_op_parallelism_threads = intra_op_threads
+        config.inter_op_parallelism_threads = inter_op_threads
+        return tf.compat.v1.Session(config=config)
+
+
+def checkpointModel(run_name, checkpoint_dir='checkpoint'):
+    r"""Get the base GPT-2 model a training run was fine-tuned from.
+
+    Parameters
+    ----------
+    run_name
+        Name of the AI model training run
+    checkpoint_dir: optional
+        Directory holding the training runs, default is checkpoint
+
+    Returns
+    -------
+    str or None
+        Name of the base model, None if it cannot be told from the checkpoint
+    """
+    try:
+        with open(os.path.join(checkpoint_dir, run_name, 'hparams.json')) as f:
+            return MODEL_LAYERS.get(json.load(f).get('n_layer'))
+    except (OSError, ValueError):
+        return None
+
+
+def checkpointVersion(run_name, checkpoint_dir='checkpoint'):
+    r"""Get the checkpoint directory a training run currently resolves to.
+
+    Parameters
+    ----------
+    run_name
+        Name of the AI model training run
+    checkpoint_dir: optional
+        Directory holding the training runs, default is checkpoint
+
+    Returns
+    -------
+    str
+        Real path of the run's checkpoint, changes when a retrained version is swapped in
+    """
+    return os.path.realpath(os.path.join(checkpoint_dir, run_name))
+
+
+def availableMemory():
+    r"""Get the amount of memory available to the system.
+
+    Returns
+    -------
+    int or None
+        Available memory in megabytes, None if it cannot be determined
+    """
+    try:
+        import psutil
+        return psutil.virtual_memory().available // (1 << 20)
+    except ImportError:
+        pass
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) // 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+class ModelResidency:
+    r"""Manager for the loaded model session.
+
+    The session is loaded on first use and kept warm between uses. It is only
+    released after it has been idle for the configured time or when available
+    memory drops below the configured floor. Keeping the model resident trades
+    memory for not reloading the checkpoint on every batch, so the default is to
+    release it right after use. A loaded session is replaced on its next use once a
+    retrained checkpoint has been swapped in.
+
+    Parameters
+    ----------
+    run_name
+        Name of the AI model training run to load
+    idle_timeout: optional
+        Seconds the session is kept after use, None to keep it until memory is low,
+        default is 0 to release it right after use
+    min_available: optional
+        Megabytes of available memory below which the session is released, default
+        is None to ignore memory pressure
+    interval: optional
+        Seconds between checks for idle time and memory pressure, default is 10
+    pool: optional
+        Pool limiting how many sessions are loaded at once, default is None
+    intra_op_threads: optional
+        Threads running the work of a single operation, see newSession, default is 0
+    inter_op_threads: optional
+        Operations run at once, see newSession, default is 0
+
+    Attributes
+    ----------
+    run_name
+        Name of the AI model training run to load
+    idle_timeout
+        Seconds the session is kept after use
+    min_available
+        Megabytes of available memory below which the session is released
+    pool
+        Pool limiting how many sessions are loaded at once, None if unlimited
+    intra_op_threads
+        Threads running the work of a single operation, 0 if left to TensorFlow
+    inter_op_threads
+        Operations run at once, 0 if left to TensorFlow
+    last_used
+        Monotonic time the session was last used
+    stats
+        Dictionary of load and generation counts and times
+
+    Methods
+    -------
+    session
+        Context manager providing a loaded session
+    adopt
+        Take ownership of an already loaded session
+    evict
+        Release the loaded session
+    tryEvict
+        Release the loaded session unless it is in use
+    isLoaded
+        Check if a session is currently loaded
+    stop
+        Stop background checks and release the session
+    """
+    def __init__(self, run_name, idle_timeout=0, min_available=None, interval=10, pool=None,
+                 intra_op_threads=0, inter_op_threads=0):
+        self.run_name = run_name
+        self.idle_timeout = idle_timeout
+        self.min_available = min_available
+        self.pool = pool
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.stats = {
+            'loads': 0, 'load_seconds': 0.0, 'last_load_seconds': 0.0,
+            'uses': 0, 'use_seconds': 0.0, 'last_use_seconds': 0.0,
+            'evictions': 0,
+        }
+        self._session = None
+        self._version = None
+        self.last_used = monotonic()
+        self._lock = threading.RLock()
+        self._stopped = threading.Event()
+        self._monitor = None
+        if idle_timeout != 0 or min_available is not None:
+            self._monitor = threading.Thread(
+                target=self._watch, args=(interval,), name='model-residency', daemon=True
+            )
+            self._monitor.start()
+
+    @contextmanager
+    def session(self):
+        r"""Context manager providing a loaded session.
+
+        Yields
+        ------
+        tf.Session
+            Session with the model of the training run loaded, its graph is the
+            default graph while in use
+        """
+        with self._lock:
+            if self._session is not None and self._version != checkpointVersion(self.run_name):
+                logger.info(f'New checkpoint for {self.run_name}, reloading model')
+                self.evict()
+            if self._session is None:
+                self._load()
+            start = monotonic()
+            try:
+                with self._session.graph.as_default():
+                    yield self._session
+            finally:
+                elapsed = monotonic() - start
+                self.stats['uses'] += 1
+                self.stats['use_seconds'] += elapsed
+                self.stats['last_use_seconds'] = elapsed
+                USE_SECONDS.labels(run=self.run_name).observe(elapsed)
+                self.last_used = monotonic()
+                logger.info(
+                    f'Model load took {self.stats["last_load_seconds"]:.2f}s, '
+                    f'generation took {elapsed:.2f}s'
+                )
+                self.stats['last_load_seconds'] = 0.0
+                if self.idle_timeout == 0:
+                    self.evict()
+
+    def adopt(self, session):
+        r"""Take ownership of an already loaded session.
+
+        Parameters
+        ----------
+        session
+            Session with the model of the training run loaded, started by newSession
+        """
+        with self._lock:
+            if self._session is not None and self._session is not session:
+                self.evict()
+            if self.pool is not None:
+                self.pool.makeRoom(self)
+            self._session = session
+            self._version = checkpointVersion(self.run_name)
+            self.last_used = monotonic()
+            LOADED.labels(run=self.run_name).set(1)
+
+    def evict(self):
+        r"""Release the loaded session."""
+        with self._lock:
+            if self._session is None:
+                return
+            self._session.close()
+            self._session = None
+            self.stats['evictions'] += 1
+            EVICTIONS.labels(run=self.run_name).inc()
+            LOADED.labels(run=self.run_name).set(0)
+            logger.info('Model session released')
+
+    def tryEvict(self):
+        r"""Release the loaded session unless it is in use.
+
+        Returns
+        -------
+        bool
+            True if no session is loaded afterwards
+        """
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            self.evict()
+        finally:
+            self._lock.release()
+        return True
+
+    def isLoaded(self):
+        r"""Check if a session is currently loaded.
+
+        Returns
+        -------
+        bool
+            True if a session is loaded
+        """
+        return self._session is not None
+
+    def stop(self):
+        r"""Stop background checks and release the session."""
+        self._stopped.set()
+        if self._monitor is not None:
+            self._monitor.join()
+            self._monitor = None
+        self.evict()
+
+    def _load(self):
+        r"""Start a session and load the training run into it."""
+        if self.pool is not None:
+            self.pool.makeRoom(self)
+        logger.info(f'Loading model {self.run_name}...')
+        start = monotonic()
+        version = checkpointVersion(self.run_name)
+        session = newSession(self.intra_op_threads, self.inter_op_threads)
+        with session.graph.as_default():
+            importGPT2().load_gpt2(session, run_name=self.run_name)
+        self._session = session
+        self._version = version
+        elapsed = monotonic() - start
+        self.stats['loads'] += 1
+        self.stats['load_seconds'] += elapsed
+        self.stats['last_load_seconds'] = elapsed
+        LOAD_SECONDS.labels(run=self.run_name).observe(elapsed)
+        LOADED.labels(run=self.run_name).set(1)
+
+    def _watch(self, interval):
+        r"""Release the session when idle for too long or memory is low.
+
+        Parameters
+        ----------
+        interval
+            Seconds between checks
+        """
+        while not self._stopped.wait(interval):
+            if self._session is None:
+                continue
+            idle = monotonic() - self.last_used
+            if self.idle_timeout is not None and idle >= self.idle_timeout:
+                logger.info(f'Model idle for {idle:.0f}s, releasing')
+            elif self.min_available is not None and (availableMemory() or self.min_available) < self.min_available:
+                logger.warning('Available memory is low, releasing model')
+            else:
+                continue
+            # Skip this round if the session is in use, it is checked again next time
+            self.tryEvict()
+
+
+class SessionPool:
+    r"""Bounded pool of loaded model sessions shared by several training runs.
+
+    Every training run gets its own residency from the pool. Before a residency
+    loads its session, the least recently used sessions of other runs are released
+    until the number loaded stays within the capacity.
+
+    Parameters
+    ----------
+    capacity: optional
+        Most sessions loaded at once, default is 1
+    idle_timeout: optional
+        Seconds each session is kept after use, see ModelResidency, default is 0
+    min_available: optional
+        Megabytes of available memory below which sessions are released, default is None
+    intra_op_threads: optional
+        Threads running the work of a single operation, see newSession, default is 0
+    inter_op_threads: optional
+        Operations run at once, see newSession, default is 0
+
+    Attributes
+    ----------
+    capacity
+        Most sessions loaded at once
+    idle_timeout
+        Seconds each session is kept after use
+    min_available
+        Megabytes of available memory below which sessions are released
+    intra_op_threads
+        Threads running the work of a single operation, 0 if left to TensorFlow
+    inter_op_threads
+        Operations run at once, 0 if left to TensorFlow
+
+    Methods
+    -------
+    residency
+        Get the residency of a training run
+    makeRoom
+        Release sessions so another can be loaded
+    loaded
+        List the training runs with a loaded session
+    stop
+        Stop every residency and release their sessions
+    """
+    def __init__(self, capacity=1, idle_timeout=0, min_available=None, intra_op_threads=0, inter_op_threads=0):
+        if capacity < 1:
+            raise ValueError('capacity must be at least 1')
+        self.capacity = capacity
+        self.idle_timeout = idle_timeout
+        self.min_available = min_available
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self._residencies = {}
+        self._lock = threading.Lock()
+
+    def residency(self, run_name):
+        r"""Get the residency of a training run.
+
+        Parameters
+        ----------
+        run_name
+            Name of the AI model training run
+
+        Returns
+        -------
+        ModelResidency
+            Residency of the run, created on first request
+        """
+        with self._lock:
+            if run_name not in self._residencies:
+                self._residencies[run_name] = ModelResidency(
+                    run_name, idle_timeout=self.idle_timeout,
+                    min_available=self.min_available, pool=self,
+                    intra_op_threads=self.intra_op_threads, inter_op_threads=self.inter_op_threads
+                )
+            return self._residencies[run_name]
+
+    def makeRoom(self, residency):
+        r"""Release sessions so another can be loaded.
+
+        Parameters
+        ----------
+        residency
+            Residency about to load its session
+        """
+        with self._lock:
+            loaded = sorted(
+                (other for other in self._residencies.values() if other is not residency and other.isLoaded()),
+                key=lambda other: other.last_used
+            )
+        for other in loaded[:max(len(loaded) + 1 - self.capacity, 0)]:
+            # A session in use cannot be released, the pool runs over capacity until it is free
+            logger.info(f'Releasing model {other.run_name} to make room for {residency.run_name}')
+            if not other.tryEvict():
+                logger.warning(f'Model {other.run_name} is in use, pool is over capacity')
+
+    def loaded(self):
+        r"""List the training runs with a loaded session.
+
+        Returns
+        -------
+        list
+            Names of the runs with a loaded session
+        """
+        with self._lock:
+            return [name for name, residency in self._residencies.items() if residency.isLoaded()]
+
+    def stop(self):
+        r"""Stop every residency and release their sessions."""
+        with self._lock:
+            residencies = list(self._residencies.values())
+        for residency in residencies:
+            residency.stop()
@@ -0,0 +1,515 @@
+# -*- coding: utf-8 -*-
+r"""Module for scheduling timed jobs on the event loop.
+
+Classes
+-------
+Interval
+    Schedule firing at a fixed period
+Cron
+    Schedule firing on cron style fields
+Job
+    Timed job with a schedule, jitter and catch up policy
+Clock
+    Real clock used by the scheduler
+FakeClock
+    Manually advanced clock for deterministic scheduling
+Scheduler
+    Heap based job scheduler
+
+Functions
+---------
+parseSchedule
+    Build a schedule from text
+"""
+import logging
+import asyncio
+import heapq
+import itertools
+import random
+from datetime import datetime, timedelta
+from math import ceil
+from time import monotonic
+
+logger = logging.getLogger(__name__)
+
+SKIP = 'skip'
+ONCE = 'once'
+ALL = 'all'
+
+
+def parseSchedule(text):
+    r"""Build a schedule from text.
+
+    Parameters
+    ----------
+    text
+        Number of seconds for an interval, or five cron fields
+
+    Returns
+    -------
+    Interval or Cron
+        Schedule described by the text
+    """
+    try:
+        return Interval(float(text))
+    except ValueError:
+        return Cron(text)
+
+
+class Interval:
+    r"""Schedule firing at a fixed period.
+
+    Parameters
+    ----------
+    seconds
+        Period between firings
+    anchor: optional
+        Wall clock time the firings line up with, default is midnight at the start
+        of year 2000 so periods dividing a day line up with the clock
+
+    Methods
+    -------
+    next
+        Get the first firing after a time
+    """
+    def __init__(self, seconds, anchor=None):
+        if seconds <= 0:
+            raise ValueError('interval must be positive')
+        self.period = timedelta(seconds=seconds)
+        self.anchor = datetime(2000, 1, 1) if anchor is None else anchor
+
+    def __repr__(self):
+        return f'Interval({self.period.total_seconds()})'
+
+    def next(self, after):
+        r"""Get the first firing after a time.
+
+        Parameters
+        ----------
+        after
+            Wall clock time
+
+        Returns
+        -------
+        datetime
+            First firing strictly after the time
+        """
+        periods = (after - self.anchor) / self.period
+        return self.anchor + self.period * (int(periods) + 1 if periods >= 0 else ceil(periods))
+
+
+class Cron:
+    r"""Schedule firing on cron style fields.
+
+    Fields are minute, hour, day of month, month and day of week, with Sunday as 0
+    or 7. Each field may be '*', a number, a range 'a-b', any of those with a step
+    '/n', or a comma separated list of them.
+
+    Parameters
+    ----------
+    fields
+        Five space separated cron fields, e.g. '0 */2 * * *' for every even hour
+
+    Methods
+    -------
+    next
+        Get the first firing after a time
+    """
+    RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, fields):
+        parts = fields.split()
+        if len(parts) != 5:
+            raise ValueError(f'cron schedule needs 5 fields: {fields}')
+        self.fields = fields
+        self._minutes, self._hours, self._days, self._months, weekdays = (
+            _parseField(part, low, high) for part, (low, high) in zip(parts, self.RANGES)
+        )
+        self._weekdays = {day % 7 for day in weekdays}
+        self._any_day = parts[2] == '*'
+        self._any_weekday = parts[4] == '*'
+
+    def __repr__(self):
+        return f'Cron({self.fields!r})'
+
+    def next(self, after):
+        r"""Get the first firing after a time.
+
+        Parameters
+        ----------
+        after
+            Wall clock time
+
+        Returns
+        -------
+        datetime
+            First firing strictly after the time
+
+        Raises
+        ------
+        ValueError
+            Fields never match a real date
+        """
+        time = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = after + timedelta(days=366 * 5)
+        while time <= limit:
+            if time.month not in self._months:
+                year, month = (time.year + 1, 1) if time.month == 12 else (time.year, time.month + 1)
+                time = time.replace(year=year, month=month, day=1, hour=0, minute=0)
+            elif not self._dayMatches(time):
+                time = time.replace(hour=0, minute=0) + timedelta(days=1)
+            elif time.hour not in self._hours:
+                time = time.replace(minute=0) + timedelta(hours=1)
+            elif time.minute not in self._minutes:
+                time += timedelta(minutes=1)
+            else:
+                return time
+        raise ValueError(f'cron schedule never fires: {self.fields}')
+
+    def _dayMatches(self, time):
+        r"""Check the day of month and day of week fields.
+
+        Parameters
+        ----------
+        time
+            Time to check
+
+        Returns
+        -------
+        bool
+            True if the day matches, either field matching is enough when both are set
+        """
+        day = time.day in self._days
+        weekday = (time.weekday() + 1) % 7 in self._weekdays
+        if self._any_day:
+            return weekday
+        if self._any_weekday:
+            return day
+        return day or weekday
+
+
+def _parseField(field, low, high):
+    r"""Expand a cron field into the set of values it matches.
+
+    Parameters
+    ----------
+    field
+        Cron field text
+    low
+        Smallest allowed value
+    high
+        Largest allowed value
+
+    Returns
+    -------
+    set
+        Values matched by the field
+    """
+    values = set()
+    for part in field.split(','):
+        span, _, step = part.partition('/')
+        step = int(step) if step else 1
+        if span == '*':
+            start, end = low, high
+        elif '-' in span:
+            start, end = (int(value) for value in span.split('-', 1))
+        else:
+            start = end = int(span)
+            if step != 1:
+                end = high
+        if not low <= start <= end <= high or step < 1:
+            raise ValueError(f'invalid cron field: {field}')
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class Job:
+    r"""Timed job with a schedule, jitter and catch up policy.
+
+    Parameters
+    ----------
+    name
+        Name of the job used in logs
+    schedule
+        Interval or Cron deciding when the job runs
+    callback
+        Function or coroutine function called with no arguments when the job runs
+    jitter: optional
+        Most random seconds added to each run time, default is 0
+    catchup: optional
+        What to do with runs missed while the loop was busy or asleep, 'skip' to
+        drop them, 'once' to run once for all of them or 'all' to run each, default
+        is 'once'
+    grace: optional
+        Seconds late a run can be before it counts as missed, default is 60
+
+    Attributes
+    ----------
+    name
+        Name of the job
+    schedule
+        Interval or Cron deciding when the job runs
+    callback
+        Function or coroutine function called when the job runs
+    jitter
+        Most random seconds added to each run time
+    catchup
+        Policy for missed runs
+    grace
+        Seconds late a run can be before it counts as missed
+    next_run
+        Wall clock time of the next scheduled run
+    due
+        Wall clock time the next run is due, the scheduled run plus its jitter
+    runs
+        Number of times the job has run
+    """
+    def __init__(self, name, schedule, callback, jitter=0, catchup=ONCE, grace=60):
+        if catchup not in (SKIP, ONCE, ALL):
+            raise ValueError(f'invalid catch up policy: {catchup}')
+        self.name = name
+        self.schedule = schedule
+        self.callback = callback
+        self.jitter = jitter
+        self.catchup = catchup
+        self.grace = grace
+        self.next_run = None
+        self.due = None
+        self.runs = 0
+        self._cancelled = False
+
+    def cancel(self):
+        r"""Stop the job from running again."""
+        self._cancelled = True
+
+
+class Clock:
+    r"""Real clock used by the scheduler.
+
+    Methods
+    -------
+    monotonic
+        Get the monotonic time in seconds
+    now
+        Get the wall clock time
+    sleep
+        Sleep on the event loop
+    """
+    def monotonic(self):
+        return monotonic()
+
+    def now(self):
+        return datetime.now()
+
+    async def sleep(self, seconds, wakeup):
+        r"""Sleep on the event loop until the time passes or the wakeup is set.
+
+        Parameters
+        ----------
+        seconds
+            Seconds to sleep, None to sleep until woken
+        wakeup
+            asyncio.Event that ends the sleep early
+        """
+        try:
+            await asyncio.wait_for(wakeup.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+
+class FakeClock(Clock):
+    r"""Manually advanced clock for deterministic scheduling.
+
+    Sleeping returns right away after moving the clock to the end of the sleep, so
+    a scheduler driven by it runs through its jobs without waiting.
+
+    Parameters
+    ----------
+    start: optional
+        Wall clock time to start at, default is midnight at the start of year 2000
+
+    Methods
+    -------
+    advance
+        Move the clock forward
+    """
+    def __init__(self, start=None):
+        self._start = datetime(2000, 1, 1) if start is None else start
+        self._elapsed = 0.0
+
+    def monotonic(self):
+        return self._elapsed
+
+    def now(self):
+        return self._start + timedelta(seconds=self._elapsed)
+
+    def advance(self, seconds):
+        r"""Move the clock forward.
+
+        Parameters
+        ----------
+        seconds
+            Seconds to move forward
+        """
+        self._elapsed += seconds
+
+    async def sleep(self, seconds, wakeup):
+        if seconds is None:
+            await wakeup.wait()
+            return
+        self.advance(max(seconds, 0))
+        await asyncio.sleep(0)
+
+
+class Scheduler:
+    r"""Heap based job scheduler.
+
+    Jobs are kept in a heap ordered by their next monotonic run time, so adding and
+    running a job costs O(log n). Wall clock schedules are converted to monotonic
+    deadlines so clock changes do not disturb sleeping, and runs found to be late
+    by more than their grace are handled by the job's catch up policy.
+
+    Parameters
+    ----------
+    clock: optional
+        Clock to schedule with, default is the real clock
+
+    Attributes
+    ----------
+    clock
+        Clock the scheduler runs on
+
+    Methods
+    -------
+    add
+        Add a job
+    jobs
+        List the scheduled jobs in run order
+    run
+        Run jobs as they come due until stopped
+    stop
+        Stop running jobs
+    """
+    def __init__(self, clock=None):
+        self.clock = Clock() if clock is None else clock
+        self._heap = []
+        self._counter = itertools.count()
+        self._wakeup = None
+        self._running = False
+
+    def __len__(self):
+        return len(self._heap)
+
+    def add(self, job):
+        r"""Add a job.
+
+        Parameters
+        ----------
+        job
+            Job to schedule from the current time
+
+        Returns
+        -------
+        Job
+            The job added
+        """
+        self._push(job, job.schedule.next(self.clock.now()))
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job
+
+    def jobs(self):
+        r"""List the scheduled jobs in run order.
+
+        Returns
+        -------
+        list
+            Jobs that have not been cancelled, soonest first
+        """
+        return [job for _, _, job in sorted(self._heap) if not job._cancelled]
+
+    async def run(self):
+        r"""Run jobs as they come due until stopped."""
+        self._running = True
+        self._wakeup = asyncio.Event()
+        try:
+            while self._running:
+                self._wakeup.clear()
+                if not self._heap:
+                    await self.clock.sleep(None, self._wakeup)
+                    continue
+                due, _, job = self._heap[0]
+                delay = due - self.clock.monotonic()
+                if delay > 0:
+                    await self.clock.sleep(delay, self._wakeup)
+                    continue
+                heapq.heappop(self._heap)
+                if job._cancelled:
+                    continue
+                self._fire(job)
+        except asyncio.CancelledError:
+            logger.warning('Task cancelled: scheduler')
+
+    def stop(self):
+        r"""Stop running jobs."""
+        self._running = False
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _push(self, job, run_at):
+        r"""Schedule a job's next run.
+
+        Parameters
+        ----------
+        job
+            Job to schedule
+        run_at
+            Wall clock time of the run before jitter
+        """
+        job.next_run = run_at
+        job.due = run_at + timedelta(seconds=random.uniform(0, job.jitter) if job.jitter else 0)
+        delay = (job.due - self.clock.now()).total_seconds()
+        heapq.heappush(self._heap, (self.clock.monotonic() + delay, next(self._counter), job))
+
+    def _fire(self, job):
+        r"""Run a due job and schedule its next run.
+
+        Parameters
+        ----------
+        job
+            Job that has come due
+        """
+        now = self.clock.now()
+        # Jitter is part of the due time, so a jittered run is not counted as late
+        late = (now - job.due).total_seconds()
+        runs = 1
+        if late > job.grace:
+            missed = 0
+            run_at = job.next_run
+            while run_at <= now:
+                missed += 1
+                run_at = job.schedule.next(run_at)
+            logger.warning(f'Job {job.name} is {late:.0f}s late, {missed} run(s) missed')
+            runs = {SKIP: 0, ONCE: 1, ALL: missed}[job.catchup]
+        for _ in range(runs):
+            job.runs += 1
+            asyncio.ensure_future(self._call(job))
+        self._push(job, job.schedule.next(now))
+
+    async def _call(self, job):
+        r"""Call a job's callback, logging any failure.
+
+        Parameters
+        ----------
+        job
+            Job to call
+        """
+        try:
+            result = job.callback()
+            if asyncio.iscoroutine(result):
+                await result
+        except asyncio.CancelledError:
+            logger.warning(f'Job cancelled: {job.name}')
+        except Exception as e:
+            logger.error(f'Job {job.name} failed with exception')
+            logger.error(e)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+r"""Module for timing the phases of startup.
+
+Classes
+-------
+StartupTimer
+    Record of how long each startup phase took
+
+Attributes
+----------
+STARTUP
+    Timer used for TweetAI's own startup
+"""
+import logging
+import threading
+from contextlib import contextmanager
+from time import monotonic
+
+from .metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+PHASE_SECONDS = REGISTRY.gauge('tweetai_startup_phase_seconds', 'Seconds taken by each startup phase', ['phase'])
+
+
+class StartupTimer:
+    r"""Record of how long each startup phase took.
+
+    Parameters
+    ----------
+    start: optional
+        Monotonic time startup began, default is when the timer is created
+
+    Methods
+    -------
+    phase
+        Context manager timing a phase
+    mark
+        Record a point in startup such as becoming live or ready
+    report
+        Get the phase times and marks
+    log
+        Log the phase times and marks
+    """
+    def __init__(self, start=None):
+        self.start = monotonic() if start is None else start
+        self._phases = {}
+        self._marks = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        r"""Context manager timing a phase.
+
+        Parameters
+        ----------
+        name
+            Name of the phase
+        """
+        begin = monotonic()
+        try:
+            yield
+        finally:
+            elapsed = monotonic() - begin
+            with self._lock:
+                self._phases[name] = elapsed
+            PHASE_SECONDS.labels(phase=name).set(elapsed)
+            logger.debug(f'Startup phase {name} took {elapsed:.3f}s')
+
+    def mark(self, name):
+        r"""Record a point in startup such as becoming live or ready.
+
+        Parameters
+        ----------
+        name
+            Name of the point
+
+        Returns
+        -------
+        float
+            Seconds since startup began
+        """
+        elapsed = monotonic() - self.start
+        with self._lock:
+            self._marks.setdefault(name, elapsed)
+        return elapsed
+
+    def report(self):
+        r"""Get the phase times and marks.
+
+        Returns
+        -------
+        dict
+            Seconds taken by each phase and seconds since startup of each mark
+        """
+        with self._lock:
+            return {'phases': dict(self._phases), 'marks': dict(self._marks)}
+
+    def log(self):
+        r"""Log the phase times and marks."""
+        report = self.report()
+        phases = ', '.join(f'{name} {seconds:.2f}s' for name, seconds in report['phases'].items())
+        marks = ', '.join(f'{name} at {seconds:.2f}s' for name, seconds in report['marks'].items())
+        logger.info(f'Startup phases: {phases or "none"}; {marks or "no marks"}')
+
+
+STARTUP = StartupTimer()
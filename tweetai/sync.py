@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+r"""Module for tracking twitter data downloads.
+
+Classes
+-------
+SyncState
+    Persistent record of how far a user's tweets have been downloaded
+"""
+import os
+import logging
+import json
+
+logger = logging.getLogger(__name__)
+
+
+class SyncState:
+    r"""Persistent record of how far a user's tweets have been downloaded.
+
+    Parameters
+    ----------
+    path
+        Path to the file the state is stored in
+
+    Attributes
+    ----------
+    path
+        Path to the file the state is stored in
+    newest_id
+        Id of the newest tweet from the last completed download, None if there was none
+    since_id
+        Id the download in progress is fetching tweets newer than
+    cursor
+        Pagination token of the next page of the download in progress
+    pending_newest
+        Id of the newest tweet seen by the download in progress
+
+    Methods
+    -------
+    load
+        Read the state from disk
+    save
+        Write the state to disk
+    inProgress
+        Check if a download was interrupted
+    begin
+        Start a new download
+    advance
+        Record a downloaded page
+    complete
+        Mark the download in progress as finished
+    reset
+        Forget all download progress
+    """
+    def __init__(self, path):
+        self.path = path
+        self.newest_id = None
+        self.since_id = None
+        self.cursor = None
+        self.pending_newest = None
+
+    def load(self):
+        r"""Read the state from disk.
+
+        Returns
+        -------
+        SyncState
+            This instance, for chaining
+        """
+        if os.path.isfile(self.path):
+            with open(self.path) as f:
+                state = json.load(f)
+            self.newest_id = state.get('newest_id')
+            self.since_id = state.get('since_id')
+            self.cursor = state.get('cursor')
+            self.pending_newest = state.get('pending_newest')
+        return self
+
+    def save(self):
+        r"""Write the state to disk."""
+        state = {
+            'newest_id': self.newest_id,
+            'since_id': self.since_id,
+            'cursor': self.cursor,
+            'pending_newest': self.pending_newest,
+        }
+        with open(f'{self.path}.tmp', 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f'{self.path}.tmp', self.path)
+
+    def inProgress(self):
+        r"""Check if a download was interrupted.
+
+        Returns
+        -------
+        bool
+            True if there is a page left to fetch from an earlier download
+        """
+        return self.cursor is not None
+
+    def begin(self):
+        r"""Start a new download.
+
+        Returns
+        -------
+        str or None
+            Id to fetch tweets newer than, None to fetch the whole timeline
+        """
+        self.since_id = self.newest_id
+        self.cursor = None
+        self.pending_newest = None
+        return self.since_id
+
+    def advance(self, newest_id, cursor):
+        r"""Record a downloaded page.
+
+        Parameters
+        ----------
+        newest_id
+            Id of the newest tweet on the page
+        cursor
+            Pagination token of the next page, None if this was the last page
+        """
+        if self.pending_newest is None:
+            # Pages run newest to oldest, so the first page holds the newest tweet
+            self.pending_newest = newest_id
+        self.cursor = cursor
+        self.save()
+
+    def complete(self):
+        r"""Mark the download in progress as finished."""
+        if self.pending_newest is not None:
+            self.newest_id = self.pending_newest
+        self.since_id = None
+        self.cursor = None
+        self.pending_newest = None
+        self.save()
+
+    def reset(self):
+        r"""Forget all download progress."""
+        self.newest_id = None
+        self.since_id = None
+        self.cursor = None
+        self.pending_newest = None
+        self.save()
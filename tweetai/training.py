@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+r"""Module for fine-tuning the AI model further in the background.
+
+Classes
+-------
+Retrainer
+    Background fine-tuning of a training run with an atomic checkpoint swap
+"""
+import os
+import logging
+import multiprocessing
+import re
+import shutil
+import threading
+from time import strftime
+
+from .residency import checkpointVersion, importGPT2, newSession
+
+logger = logging.getLogger(__name__)
+
+DATASET_KEY = 'dataset.key'
+
+
+class Retrainer:
+    r"""Background fine-tuning of a training run with an atomic checkpoint swap.
+
+    Each retraining copies the current checkpoint into a new version directory and
+    resumes fine-tuning it on the latest training data in a separate, low priority
+    process, so generation carries on with the current model meanwhile. When the
+    process succeeds, the run's checkpoint path is switched to the new version by
+    replacing a symlink, which loaders either see entirely before or entirely after.
+    Retraining is skipped if the model was already trained on the same data.
+
+    Parameters
+    ----------
+    run_name
+        Name of the AI model training run
+    model_name: optional
+        Name of the base GPT-2 model of the run, default is 355M
+    steps: optional
+        Number of fine-tuning steps per retraining, default is 100
+    checkpoint_dir: optional
+        Directory holding the training runs, default is checkpoint
+    keep: optional
+        Number of checkpoint versions kept, including the current one, default is 2
+    niceness: optional
+        Niceness added to the fine-tuning process, default is 19 for lowest priority
+
+    Attributes
+    ----------
+    run_name
+        Name of the AI model training run
+    model_name
+        Name of the base GPT-2 model of the run
+    steps
+        Number of fine-tuning steps per retraining
+    path
+        Checkpoint path of the run, a symlink to the current version once retrained
+    versions
+        Directory holding the checkpoint versions
+
+    Methods
+    -------
+    train
+        Fine-tune the current checkpoint further and swap the result in
+    trainedOn
+        Get the key of the dataset the current checkpoint was trained on
+    record
+        Record the dataset the current checkpoint was trained on
+    running
+        Check if fine-tuning is in progress
+    stop
+        Stop any fine-tuning in progress
+    """
+    def __init__(self, run_name, model_name='355M', steps=100, checkpoint_dir='checkpoint', keep=2, niceness=19):
+        if keep < 1:
+            raise ValueError('keep must be at least 1')
+        self.run_name = run_name
+        self.model_name = model_name
+        self.steps = steps
+        self.checkpoint_dir = checkpoint_dir
+        self.path = os.path.join(checkpoint_dir, run_name)
+        self.versions = os.path.join(checkpoint_dir, f'{run_name}.versions')
+        self.keep = keep
+        self.niceness = niceness
+        self._process = None
+        self._lock = threading.Lock()
+
+    def train(self, dataset, key):
+        r"""Fine-tune the current checkpoint further and swap the result in.
+
+        Blocks until fine-tuning finishes, so it is usually run off the event loop.
+
+        Parameters
+        ----------
+        dataset
+            Path to the training dataset
+        key
+            Key identifying the dataset, see DatasetCache
+
+        Returns
+        -------
+        bool
+            True if a new checkpoint was swapped in, False if retraining was skipped
+
+        Raises
+        ------
+        RuntimeError
+            If the fine-tuning process failed
+        """
+        if not self._lock.acquire(blocking=False):
+            logger.info(f'Retraining of {self.run_name} already in progress')
+            return False
+        try:
+            if key == self.trainedOn():
+                logger.info(f'Model {self.run_name} is already trained on the current data')
+                return False
+            version = self._stage()
+            logger.info(f'Retraining model {self.run_name} as version {version}...')
+            context = multiprocessing.get_context('spawn')
+            self._process = context.Process(
+                target=_fineTune, name=f'retrain-{self.run_name}',
+                args=(self.versions, version, dataset, self.model_name, self.steps, self.niceness)
+            )
+            self._process.start()
+            self._process.join()
+            code = self._process.exitcode
+            self._process = None
+            staged = os.path.join(self.versions, version)
+            if code != 0:
+                shutil.rmtree(staged, ignore_errors=True)
+                raise RuntimeError(f'fine-tuning {self.run_name} exited with code {code}')
+            _relocate(staged, prune=True)
+            with open(os.path.join(staged, DATASET_KEY), 'w') as f:
+                f.write(key)
+            self._swap(version)
+            logger.info(f'Model {self.run_name} retrained, now using version {version}')
+            return True
+        finally:
+            self._lock.release()
+
+    def trainedOn(self):
+        r"""Get the key of the dataset the current checkpoint was trained on.
+
+        Returns
+        -------
+        str or None
+            Dataset key, None if it is not known
+        """
+        try:
+            with open(os.path.join(self.path, DATASET_KEY)) as f:
+                return f.read().strip()
+        except OSError:
+            return None
+
+    def record(self, key):
+        r"""Record the dataset the current checkpoint was trained on.
+
+        Parameters
+        ----------
+        key
+            Key identifying the dataset, see DatasetCache
+        """
+        with open(os.path.join(self.path, DATASET_KEY), 'w') as f:
+            f.write(key)
+
+    def running(self):
+        r"""Check if fine-tuning is in progress.
+
+        Returns
+        -------
+        bool
+            True if the fine-tuning process is running
+        """
+        process = self._process
+        return process is not None and process.is_alive()
+
+    def stop(self):
+        r"""Stop any fine-tuning in progress."""
+        process = self._process
+        if process is not None and process.is_alive():
+            logger.warning(f'Stopping retraining of {self.run_name}')
+            process.terminate()
+            process.join()
+
+    def _stage(self):
+        r"""Copy the current checkpoint into a new version directory.
+
+        Weight files are hard linked instead of copied, fine-tuning saves new ones
+        rather than changing them.
+
+        Returns
+        -------
+        str
+            Name of the new version
+        """
+        self._migrate()
+        version = strftime('%Y%m%dT%H%M%S')
+        while os.path.exists(os.path.join(self.versions, version)):
+            version = f'{version}-1'
+        staged = os.path.join(self.versions, version)
+
+        def link(source, destination):
+            if os.path.basename(source).startswith('model-'):
+                os.link(source, destination)
+            else:
+                shutil.copy2(source, destination)
+
+        shutil.copytree(os.path.realpath(self.path), staged, copy_function=link)
+        _relocate(staged)
+        return version
+
+    def _migrate(self):
+        r"""Move a checkpoint trained in place into the first version directory."""
+        if os.path.islink(self.path) or not os.path.isdir(self.path):
+            return
+        os.makedirs(self.versions, exist_ok=True)
+        logger.info(f'Moving checkpoint {self.run_name} into versioned storage')
+        # Loading fails for the moment between these two, the next generation retries
+        os.rename(self.path, os.path.join(self.versions, 'initial'))
+        os.symlink(os.path.join(f'{self.run_name}.versions', 'initial'), self.path)
+
+    def _swap(self, version):
+        r"""Point the run's checkpoint path at a version and remove old versions.
+
+        Parameters
+        ----------
+        version
+            Name of the version to use
+        """
+        link = os.path.join(self.checkpoint_dir, f'.{self.run_name}.swap')
+        if os.path.lexists(link):
+            os.remove(link)
+        os.symlink(os.path.join(f'{self.run_name}.versions', version), link)
+        os.replace(link, self.path)
+
+        current = os.path.basename(checkpointVersion(self.run_name, self.checkpoint_dir))
+        versions = sorted(
+            (os.path.join(self.versions, name) for name in os.listdir(self.versions)),
+            key=os.path.getmtime, reverse=True
+        )
+        for old in [v for v in versions if os.path.basename(v) != current][self.keep - 1:]:
+            logger.info(f'Removing old checkpoint version {os.path.basename(old)}')
+            shutil.rmtree(old, ignore_errors=True)
+
+
+def _relocate(directory, prune=False):
+    r"""Make the checkpoint state of a directory independent of its location.
+
+    Parameters
+    ----------
+    directory
+        Checkpoint directory of a training run
+    prune: optional
+        True to also remove weights other than the latest, default is False
+    """
+    state = os.path.join(directory, 'checkpoint')
+    if not os.path.isfile(state):
+        return
+    with open(state) as f:
+        lines = f.read().splitlines()
+    latest = None
+    relocated = []
+    for line in lines:
+        match = re.match(r'(\w+): "(.*)"$', line)
+        if match is None:
+            relocated.append(line)
+            continue
+        name = os.path.basename(match.group(2))
+        if match.group(1) == 'model_checkpoint_path':
+            latest = name
+        if not prune or match.group(1) != 'all_model_checkpoint_paths' or name == latest:
+            relocated.append(f'{match.group(1)}: "{name}"')
+    with open(f'{state}.tmp', 'w') as f:
+        f.write('\n'.join(relocated) + '\n')
+    os.replace(f'{state}.tmp', state)
+    if prune and latest is not None:
+        for name in os.listdir(directory):
+            if name.startswith('model-') and not name.startswith(f'{latest}.'):
+                os.remove(os.path.join(directory, name))
+
+
+def _fineTune(checkpoint_dir, run_name, dataset, model_name, steps, niceness):
+    r"""Resume fine-tuning a training run, run in the retraining process.
+
+    Parameters
+    ----------
+    checkpoint_dir
+        Directory holding the training run
+    run_name
+        Name of the training run
+    dataset
+        Path to the training dataset
+    model_name
+        Name of the base GPT-2 model
+    steps
+        Number of fine-tuning steps
+    niceness
+        Niceness added to the process
+    """
+    if niceness and hasattr(os, 'nice'):
+        os.nice(niceness)
+    gpt2 = importGPT2()
+    session = newSession()
+    with session.graph.as_default():
+        gpt2.finetune(session, dataset=dataset, steps=steps, model_name=model_name,
+                      restore_from='latest', run_name=run_name, checkpoint_dir=checkpoint_dir,
+                      save_every=steps, print_every=10)
+    session.close()
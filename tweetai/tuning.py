@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+r"""Module for choosing the inference profile of the local machine.
+
+An inference profile is the base GPT-2 model and the TensorFlow thread counts
+tweets are generated with. The best profile depends on the number of cores, so
+it is measured on each machine and recorded for later runs.
+
+Functions
+---------
+candidateProfiles
+    List the inference profiles worth measuring on this machine
+measureProfile
+    Time generating tweets with an inference profile
+autotune
+    Measure the candidate profiles and record the best one
+loadProfile
+    Read the recorded profile of this machine
+"""
+import os
+import logging
+import json
+import multiprocessing
+from time import perf_counter
+
+from .residency import importGPT2, newSession
+
+logger = logging.getLogger(__name__)
+
+PROFILE_PATH = 'profile.json'
+
+
+def candidateProfiles(models=('124M', '355M'), cores=None):
+    r"""List the inference profiles worth measuring on this machine.
+
+    Parameters
+    ----------
+    models: optional
+        Names of the base GPT-2 models to try, default is 124M and 355M
+    cores: optional
+        Number of cores to size the thread counts for, default is the number of
+        cores of this machine
+
+    Returns
+    -------
+    list
+        Dictionaries of model_name, intra_op_threads and inter_op_threads, thread
+        counts of 0 leave the choice to TensorFlow
+    """
+    cores = (os.cpu_count() or 1) if cores is None else cores
+    intra = sorted({max(cores // divisor, 1) for divisor in (1, 2, 4)}, reverse=True)
+    inter = sorted({1, min(2, cores)})
+    threads = [(0, 0)] + [(i, j) for i in intra for j in inter]
+    return [
+        {'model_name': model_name, 'intra_op_threads': i, 'inter_op_threads': j}
+        for model_name in models for i, j in threads
+    ]
+
+
+def measureProfile(profile, length=100, batch_size=1, repeats=3, model_dir='models'):
+    r"""Time generating tweets with an inference profile.
+
+    The base model is loaded in a new process, since TensorFlow keeps the thread
+    pools of the first session for the life of a process.
+
+    Parameters
+    ----------
+    profile
+        Dictionary of model_name, intra_op_threads and inter_op_threads
+    length: optional
+        Tokens generated for each tweet, default is 100
+    batch_size: optional
+        Tweets generated in parallel, default is 1
+    repeats: optional
+        Batches timed after a first untimed batch, default is 3
+    model_dir: optional
+        Directory the base models are downloaded to, default is models
+
+    Returns
+    -------
+    float
+        Seconds taken per tweet
+    """
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1) as pool:
+        return pool.apply(_measure, (profile, length, batch_size, repeats, model_dir))
+
+
+def autotune(budget, path=PROFILE_PATH, models=('124M', '355M'), length=100, batch_size=1, repeats=3):
+    r"""Measure the candidate profiles and record the best one.
+
+    The smallest model is always the fastest, so the budget decides how large a
+    model this machine can afford. The best profile is the fastest one of the
+    largest model generating within the budget, or the fastest profile overall if
+    none does. Base models not downloaded yet are downloaded first.
+
+    Parameters
+    ----------
+    budget
+        Most seconds generating a tweet may take
+    path: optional
+        Path of the JSON file the profile is recorded to, default is profile.json
+    models: optional
+        Names of the base GPT-2 models to try, default is 124M and 355M
+    length: optional
+        Tokens generated for each tweet, default is 100
+    batch_size: optional
+        Tweets generated in parallel, default is 1
+    repeats: optional
+        Batches timed for each profile, default is 3
+
+    Returns
+    -------
+    dict
+        Best profile with the seconds it took per tweet
+    """
+    gpt2 = importGPT2()
+    for model_name in models:
+        if not os.path.isdir(os.path.join('models', model_name)):
+            logger.info(f'Downloading {model_name} model...')
+            gpt2.download_gpt2(model_name=model_name)
+
+    results = []
+    for profile in candidateProfiles(models):
+        seconds = measureProfile(profile, length=length, batch_size=batch_size, repeats=repeats)
+        logger.info(f'{profile} took {seconds:.3f}s per tweet')
+        results.append({**profile, 'seconds': seconds})
+
+    within = [result for result in results if result['seconds'] <= budget]
+    if within:
+        largest = max(int(result['model_name'].rstrip('M')) for result in within)
+        best = min(
+            (result for result in within if int(result['model_name'].rstrip('M')) == largest),
+            key=lambda result: result['seconds']
+        )
+    else:
+        best = min(results, key=lambda result: result['seconds'])
+        logger.warning(f'No profile generates a tweet within {budget}s, using the fastest')
+    logger.info(f'Best profile is {best}')
+
+    record = {
+        'cores': os.cpu_count(), 'budget': budget, 'length': length, 'batch_size': batch_size,
+        'profile': best, 'results': results,
+    }
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(record, f, indent=2)
+    os.replace(f'{path}.tmp', path)
+    return best
+
+
+def loadProfile(path=PROFILE_PATH):
+    r"""Read the recorded profile of this machine.
+
+    Parameters
+    ----------
+    path: optional
+        Path of the JSON file the profile was recorded to, default is profile.json
+
+    Returns
+    -------
+    dict or None
+        Dictionary of model_name, intra_op_threads and inter_op_threads, None if
+        no profile was recorded or it was recorded on a machine with a different
+        number of cores
+    """
+    try:
+        with open(path) as f:
+            record = json.load(f)
+    except FileNotFoundError:
+        return None
+    if record['cores'] != os.cpu_count():
+        logger.warning(
+            f'Profile in {path} was tuned for {record["cores"]} cores, not {os.cpu_count()}, ignoring it'
+        )
+        return None
+    return {key: record['profile'][key] for key in ('model_name', 'intra_op_threads', 'inter_op_threads')}
+
+
+def _measure(profile, length, batch_size, repeats, model_dir):
+    r"""Time generating tweets with an inference profile in this process.
+
+    Parameters
+    ----------
+    profile
+        Dictionary of model_name, intra_op_threads and inter_op_threads
+    length
+        Tokens generated for each tweet
+    batch_size
+        Tweets generated in parallel
+    repeats
+        Batches timed after a first untimed batch
+    model_dir
+        Directory the base models are downloaded to
+
+    Returns
+    -------
+    float
+        Seconds taken per tweet
+    """
+    gpt2 = importGPT2()
+    options = dict(
+        model_name=profile['model_name'], model_dir=model_dir, length=length,
+        nsamples=batch_size, batch_size=batch_size, return_as_list=True
+    )
+    session = newSession(profile['intra_op_threads'], profile['inter_op_threads'])
+    try:
+        with session.graph.as_default():
+            gpt2.load_gpt2(session, model_name=profile['model_name'], model_dir=model_dir)
+            gpt2.generate(session, **options)
+            start = perf_counter()
+            for _ in range(repeats):
+                gpt2.generate(session, **options)
+            elapsed = perf_counter() - start
+    finally:
+        session.close()
+    return elapsed / (repeats * batch_size)
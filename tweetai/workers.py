@@ -0,0 +1,402 @@
+# -*- coding: utf-8 -*-
+r"""Module for generating tweets in worker processes.
+
+Classes
+-------
+GenerationPool
+    Pool of worker processes holding the model sessions and generating tweets
+"""
+import logging
+import logging.handlers
+import multiprocessing
+import signal
+import threading
+from itertools import count
+from time import monotonic, perf_counter
+
+from .metrics import REGISTRY
+from .residency import LOAD_SECONDS, SessionPool, importGPT2
+
+logger = logging.getLogger(__name__)
+
+REQUEST_SECONDS = REGISTRY.histogram('tweetai_generation_request_seconds', 'Seconds taken by each generation request')
+WORKERS_ALIVE = REGISTRY.gauge('tweetai_generation_workers', 'Generation worker processes running')
+WORKER_RESTARTS = REGISTRY.counter(
+    'tweetai_generation_worker_restarts_total', 'Generation workers restarted', ['reason']
+)
+
+
+class GenerationPool:
+    r"""Pool of worker processes holding the model sessions and generating tweets.
+
+    Each worker process loads models into its own session pool, so a stalled or
+    crashed TensorFlow only takes down that worker. Requests go to an idle worker,
+    preferring one that last generated for the same training run so its model is
+    likely still loaded. A worker that dies, stops answering health checks or takes
+    longer than the timeout is killed and replaced, and the request it was serving
+    fails.
+
+    Workers log at the level of the main process's root logger, and their records
+    are sent back over a queue and handled by the main process's loggers, so they
+    end up in the same log files without processes writing to them at once.
+
+    Parameters
+    ----------
+    workers: optional
+        Number of worker processes, default is 1
+    capacity: optional
+        Most models each worker keeps loaded at once, default is 1
+    idle_timeout: optional
+        Seconds each worker keeps a model loaded after use, see ModelResidency,
+        default is 0
+    min_available: optional
+        Megabytes of available memory below which workers release models, default
+        is None
+    timeout: optional
+        Seconds a generation request may take before its worker is restarted,
+        default is 900
+    interval: optional
+        Seconds between health checks of idle workers, default is 30
+    intra_op_threads: optional
+        Threads each worker runs the work of a single operation on, see
+        newSession, default is 0
+    inter_op_threads: optional
+        Operations each worker runs at once, see newSession, default is 0
+
+    Attributes
+    ----------
+    workers
+        Number of worker processes
+    timeout
+        Seconds a generation request may take
+
+    Methods
+    -------
+    generate
+        Generate samples in a worker process
+    alive
+        Count the worker processes running
+    stop
+        Stop every worker process
+    """
+    def __init__(self, workers=1, capacity=1, idle_timeout=0, min_available=None, timeout=900, interval=30,
+                 intra_op_threads=0, inter_op_threads=0):
+        if workers < 1:
+            raise ValueError('workers must be at least 1')
+        self.workers = workers
+        self.timeout = timeout
+        self._options = {
+            'capacity': capacity, 'idle_timeout': idle_timeout, 'min_available': min_available,
+            'intra_op_threads': intra_op_threads, 'inter_op_threads': inter_op_threads,
+        }
+        self._context = multiprocessing.get_context('spawn')
+        self._cond = threading.Condition()
+        self._stopped = threading.Event()
+        self._logs = self._context.Queue()
+        self._listener = logging.handlers.QueueListener(self._logs, _Forward())
+        self._listener.start()
+        logs = (self._logs, logging.getLogger().getEffectiveLevel())
+        self._workers = [_Worker(index, self._context, self._options, logs) for index in range(workers)]
+        for worker in self._workers:
+            worker.start()
+        WORKERS_ALIVE.set(workers)
+        self._monitor = threading.Thread(target=self._watch, args=(interval,), name='generation-health', daemon=True)
+        self._monitor.start()
+
+    def generate(self, run_name, **kwargs):
+        r"""Generate samples in a worker process.
+
+        Blocks until a worker is free and has generated the samples.
+
+        Parameters
+        ----------
+        run_name
+            Name of the AI model training run to generate with
+        kwargs
+            Options passed on to gpt_2_simple.generate, samples are always returned
+            as a list
+
+        Returns
+        -------
+        list
+            Generated samples
+
+        Raises
+        ------
+        RuntimeError
+            If generation failed or the worker had to be restarted
+        """
+        worker = self._acquire(run_name)
+        start = perf_counter()
+        try:
+            ok, result = worker.call('generate', self.timeout, run_name=run_name, **kwargs)
+        except TimeoutError:
+            self._restart(worker, 'timeout')
+            raise RuntimeError(f'generation worker {worker.index} timed out after {self.timeout}s')
+        except (EOFError, OSError) as e:
+            self._restart(worker, 'crashed')
+            raise RuntimeError(f'generation worker {worker.index} stopped unexpectedly') from e
+        finally:
+            self._release(worker)
+        REQUEST_SECONDS.observe(perf_counter() - start)
+        if not ok:
+            raise RuntimeError(f'generation worker {worker.index} failed: {result}')
+        if result['load_seconds']:
+            LOAD_SECONDS.labels(run=run_name).observe(result['load_seconds'])
+        return result['samples']
+
+    def alive(self):
+        r"""Count the worker processes running.
+
+        Returns
+        -------
+        int
+            Number of worker processes alive
+        """
+        return sum(worker.isAlive() for worker in self._workers)
+
+    def stop(self):
+        r"""Stop every worker process.
+
+        Requests waiting on a worker fail.
+        """
+        self._stopped.set()
+        with self._cond:
+            self._cond.notify_all()
+        for worker in self._workers:
+            worker.stop()
+        WORKERS_ALIVE.set(0)
+        self._listener.stop()
+
+    def _acquire(self, run_name):
+        r"""Wait for an idle worker and mark it busy.
+
+        Parameters
+        ----------
+        run_name
+            Training run the worker is wanted for
+
+        Returns
+        -------
+        _Worker
+            Idle worker, one that last served the run if there is one
+        """
+        with self._cond:
+            while True:
+                if self._stopped.is_set():
+                    raise RuntimeError('generation pool is stopped')
+                idle = [worker for worker in self._workers if not worker.busy]
+                if idle:
+                    worker = next((worker for worker in idle if worker.last_run == run_name), None)
+                    if worker is None:
+                        worker = min(idle, key=lambda other: other.last_used)
+                    worker.busy = True
+                    worker.last_run = run_name
+                    return worker
+                self._cond.wait()
+
+    def _release(self, worker):
+        r"""Mark a worker idle again.
+
+        Parameters
+        ----------
+        worker
+            Worker to release
+        """
+        with self._cond:
+            worker.busy = False
+            worker.last_used = monotonic()
+            self._cond.notify()
+
+    def _restart(self, worker, reason):
+        r"""Replace a worker's process.
+
+        Parameters
+        ----------
+        worker
+            Worker to restart
+        reason
+            Reason in the metrics and log
+        """
+        if self._stopped.is_set():
+            return
+        logger.warning(f'Restarting generation worker {worker.index}: {reason}')
+        WORKER_RESTARTS.labels(reason=reason).inc()
+        worker.stop()
+        worker.start()
+        WORKERS_ALIVE.set(self.alive())
+
+    def _watch(self, interval):
+        r"""Check idle workers are healthy, restarting those that are not.
+
+        Parameters
+        ----------
+        interval
+            Seconds between checks
+        """
+        while not self._stopped.wait(interval):
+            for worker in self._workers:
+                with self._cond:
+                    if worker.busy or self._stopped.is_set():
+                        continue
+                    worker.busy = True
+                try:
+                    if not worker.isAlive():
+                        self._restart(worker, 'crashed')
+                        continue
+                    try:
+                        worker.call('ping', min(interval, 10))
+                    except (TimeoutError, EOFError, OSError):
+                        self._restart(worker, 'unresponsive')
+                finally:
+                    with self._cond:
+                        worker.busy = False
+                        self._cond.notify()
+
+
+class _Worker:
+    r"""Handle of one generation worker process.
+
+    Parameters
+    ----------
+    index
+        Number of the worker in its pool
+    context
+        Multiprocessing context to start the process with
+    options
+        Session pool options of the worker
+    logs
+        Queue the worker sends its log records to and the level it logs at
+    """
+    def __init__(self, index, context, options, logs):
+        self.index = index
+        self.busy = False
+        self.last_run = None
+        self.last_used = 0
+        self._context = context
+        self._options = options
+        self._logs = logs
+        self._ids = count()
+        self._process = None
+        self._conn = None
+
+    def start(self):
+        r"""Start the worker process."""
+        self._conn, child = self._context.Pipe()
+        self._process = self._context.Process(
+            target=_serve, args=(child, self._options, self._logs), name=f'generation-{self.index}', daemon=True
+        )
+        self._process.start()
+        child.close()
+        self.last_run = None
+
+    def stop(self):
+        r"""Stop the worker process, killing it if it does not exit."""
+        if self._process is None:
+            return
+        try:
+            self._conn.send(None)
+        except OSError:
+            pass
+        self._process.join(5)
+        if self._process.is_alive():
+            self._process.kill()
+            self._process.join()
+        self._conn.close()
+        self._process = None
+
+    def isAlive(self):
+        r"""Check if the worker process is running.
+
+        Returns
+        -------
+        bool
+            True if the process is alive
+        """
+        return self._process is not None and self._process.is_alive()
+
+    def call(self, method, timeout, **kwargs):
+        r"""Send a request to the worker and wait for its response.
+
+        Parameters
+        ----------
+        method
+            Name of the request
+        timeout
+            Seconds to wait for the response
+        kwargs
+            Arguments of the request
+
+        Returns
+        -------
+        tuple
+            True and the result if the request succeeded, False and a description
+            of the error otherwise
+
+        Raises
+        ------
+        TimeoutError
+            If there was no response in time
+        EOFError
+            If the worker process exited
+        """
+        request_id = next(self._ids)
+        self._conn.send((request_id, method, kwargs))
+        while True:
+            if not self._conn.poll(timeout):
+                raise TimeoutError(f'no response to {method} in {timeout}s')
+            response_id, ok, result = self._conn.recv()
+            # Responses to requests that timed out earlier are skipped
+            if response_id == request_id:
+                return ok, result
+
+
+class _Forward(logging.Handler):
+    r"""Handler passing records from worker processes to the logger they were logged on."""
+    def handle(self, record):
+        logging.getLogger(record.name).handle(record)
+
+
+def _serve(conn, options, logs):
+    r"""Answer requests in a worker process until told to stop.
+
+    Parameters
+    ----------
+    conn
+        Connection to the pool
+    options
+        Session pool options
+    logs
+        Queue to send log records to and the level to log at
+    """
+    # Interrupts are handled by the main process, which stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    queue, level = logs
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(queue))
+    root.setLevel(level)
+    pool = SessionPool(**options)
+
+    def generate(run_name, **kwargs):
+        residency = pool.residency(run_name)
+        load_seconds = residency.stats['load_seconds']
+        with residency.session() as session:
+            samples = importGPT2().generate(session, return_as_list=True, **kwargs)
+        return {'samples': samples, 'load_seconds': residency.stats['load_seconds'] - load_seconds}
+
+    handlers = {'generate': generate, 'ping': lambda: 'pong'}
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, OSError):
+            break
+        if request is None:
+            break
+        request_id, method, kwargs = request
+        try:
+            conn.send((request_id, True, handlers[method](**kwargs)))
+        except Exception as e:
+            conn.send((request_id, False, f'{type(e).__name__}: {e}'))
+    pool.stop()